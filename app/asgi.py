@@ -0,0 +1,389 @@
+# asgi.py
+#
+# ASGI entry point. Every route is served by the Flask app of server.py, run on a
+# thread pool through a WSGI adapter, except the two that hold a connection open
+# for the length of an utterance: OpenAI speech (raw audio, SSE and binary
+# streams) runs natively on the server's event loop, so a streaming connection
+# costs a coroutine instead of a thread, and the WebSocket speech stream, which
+# WSGI cannot serve at all. The native speech route shares its request handling
+# with server.py (parse_speech_request).
+#
+# Run with: uvicorn asgi:app --app-dir app --host 0.0.0.0 --port 5050
+#       or: python app/asgi.py
+
+import asyncio
+import json
+import os
+import time
+import traceback
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+from config import DEFAULT_CONFIGS
+from tts_handler import generate_speech_stream_async, generate_timed_speech_stream_async, is_known_voice, metric_labels
+from voice_catalog import voice_catalog
+from scheduler import AdmissionRejected
+from fragment_cache import track_fragments
+from jobs import job_runner
+from warmup import warmup
+from speech_stream import SpeechStream
+from sse import (FRAMED_HEADERS, SSE_HEADERS, audio_delta_event, audio_done_event, audio_done_payload, audio_frame,
+                 coalesce_chunks, error_event, error_payload, event_frame, word_event, word_payload)
+from metrics import ERRORS, IN_FLIGHT, REQUESTS, RESPONSE_BYTES, observe_stage
+from tracing import finish_trace, start_trace
+from utils import api_key_error, DETAILED_ERROR_LOGGING
+import async_bridge
+import server
+from server import DEFAULT_SPEED, DEFAULT_VOICE, PORT, VALIDATE_VOICES, RequestError, parse_speech_request
+
+# Threads serving the Flask routes; each streamed batch, ElevenLabs or Azure response holds one
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', str(DEFAULT_CONFIGS["ASGI_THREADS"])))
+
+# Request bodies larger than this are parsed and normalized on a worker thread, off the event loop
+INLINE_PARSE_BYTES = 4096
+
+SPEECH_PATHS = ('/v1/audio/speech', '/audio/speech')
+SPEECH_STREAM_PATHS = ('/v1/audio/speech/stream', '/audio/speech/stream')
+
+flask_app = WSGIMiddleware(server.app, workers=ASGI_THREADS)
+
+class Request:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope["headers"]}
+        self.args = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode('latin-1')).items()}
+        self.body = body
+
+    @property
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+    @property
+    def client_key(self):
+        """The remote address (see utils.get_client_key)."""
+        client = self.scope.get("client")
+        return client[0] if client else 'anonymous'
+
+class Response:
+    """A response with either a complete body or an async iterator of chunks (bytes or str)."""
+
+    def __init__(self, body=b"", status=200, headers=None, stream=None):
+        self.body = body
+        self.status = status
+        self.headers = dict(headers or {})
+        self.stream = stream
+
+def json_response(data, status=200, headers=None):
+    return Response(json.dumps(data).encode('utf-8'), status, {'Content-Type': 'application/json', **(headers or {})})
+
+async def prime_audio_stream(audio_stream):
+    """
+    Wait for the first chunk of an audio stream before a response is started, so that
+    upstream failures and admission rejections still produce an error response.
+    """
+    try:
+        first_chunk = await audio_stream.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+
+    async def primed_stream():
+        try:
+            yield first_chunk
+            async for chunk in audio_stream:
+                yield chunk
+        finally:
+            await audio_stream.aclose()  # Stops upstream synthesis when the client goes away
+
+    return primed_stream()
+
+async def generate_sse_audio_stream(text, audio_stream):
+    try:
+        async for chunk in audio_stream:
+            yield audio_delta_event(chunk) if isinstance(chunk, bytes) else word_event(chunk)
+        yield audio_done_event(text)
+    except Exception as e:
+        print(f"Error during SSE streaming: {e}")
+        yield error_event(e)
+
+async def generate_framed_audio_stream(text, audio_stream):
+    try:
+        async for chunk in audio_stream:
+            yield audio_frame(chunk) if isinstance(chunk, bytes) else event_frame(word_payload(chunk))
+        yield event_frame(audio_done_payload(text))
+    except Exception as e:
+        print(f"Error during framed streaming: {e}")
+        yield event_frame(error_payload(e))
+
+async def text_to_speech(req):
+    """The OpenAI speech route of server.py, streaming from the event loop."""
+    try:
+        if len(req.body) > INLINE_PARSE_BYTES:
+            # Text filtering of a long input would stall every other request and WebSocket
+            speech = await asyncio.to_thread(lambda: parse_speech_request(req.json))
+        else:
+            speech = parse_speech_request(req.json)
+        text, voice, speed = speech['text'], speech['voice'], speech['speed']
+        fragments = track_fragments()  # Filled in by the cache lookups made before the first chunk
+
+        if speech['stream_format'] in ('sse', 'binary'):
+            # mp3 chunks, merged into fewer events, with word timings if asked for
+            if speech['timestamps']:
+                events = generate_timed_speech_stream_async(text, voice, speed, client_key=req.client_key)
+            else:
+                events = generate_speech_stream_async(text, voice, speed, client_key=req.client_key)
+            audio_stream = await prime_audio_stream(coalesce_chunks(events))
+            if speech['stream_format'] == 'binary':
+                return Response(headers={**FRAMED_HEADERS, **fragments.headers()}, stream=generate_framed_audio_stream(text, audio_stream))
+            return Response(headers={**SSE_HEADERS, **fragments.headers()}, stream=generate_sse_audio_stream(text, audio_stream))
+
+        audio_stream = await prime_audio_stream(
+            generate_speech_stream_async(text, voice, speed, speech['response_format'], client_key=req.client_key))
+        headers = {
+            'Content-Type': speech['mime_type'],
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # Disable nginx buffering
+            **fragments.headers(),
+        }
+        return Response(headers=headers, stream=audio_stream)
+
+    except RequestError as e:
+        return json_response({"error": str(e)}, 400)
+    except AdmissionRejected as e:
+        return json_response({"error": str(e)}, e.status_code, {'Retry-After': str(e.retry_after)})
+    except Exception as e:
+        if DETAILED_ERROR_LOGGING:
+            print(f"Error in text_to_speech: {str(e)}\n{traceback.format_exc()}")
+        else:
+            print(f"Error in text_to_speech: {str(e)}")
+        return json_response({"error": "An internal server error occurred", "details": str(e)}, 500)
+
+async def speech_app(scope, receive, send):
+    """Serve the OpenAI speech route, metered and traced like server.metered('speech')."""
+    body = await read_body(receive)
+    if body is None:
+        return
+    req = Request(scope, body)
+
+    error = api_key_error(req.headers.get('authorization'))
+    if error is not None:
+        await send_response(json_response({"error": error}, 401), send, receive)
+        return
+
+    IN_FLIGHT.inc('speech')
+    trace = start_trace('speech')
+    started = None
+    sent = 0
+    status = 500
+    try:
+        response = await text_to_speech(req)
+        status = response.status
+        if response.status == 400:
+            ERRORS.inc("validation")
+        elif response.status in (429, 503):
+            ERRORS.inc("admission")
+        if trace is not None:
+            # Streamed responses only report the stages finished before the first chunk
+            response.headers['Server-Timing'] = trace.server_timing()
+            response.headers['X-Trace-Id'] = trace.id
+        started = time.perf_counter() if response.stream is not None else None
+        sent = await send_response(response, send, receive)
+    finally:
+        if started is not None:
+            observe_stage("response_write", time.perf_counter() - started)
+        RESPONSE_BYTES.inc('speech', amount=sent)
+        IN_FLIGHT.dec('speech')
+        if trace is not None:
+            finish_trace(trace, status, sent)
+
+def check_websocket_api_key(req):
+    """Like utils.api_key_error, also accepting ?api_key= as browsers cannot set headers on a WebSocket."""
+    auth_header = req.headers.get('authorization')
+    if auth_header is None and 'api_key' in req.args:
+        auth_header = f"Bearer {req.args['api_key']}"
+    return api_key_error(auth_header)
+
+async def speech_stream_socket(req, receive, send):
+    """
+    Duplex speech for voice agents: text deltas in, mp3 audio out as each sentence completes.
+
+    voice and speed are query parameters. The client sends JSON text messages:
+    {"type": "text", "text": ...} with each delta, {"type": "flush"} at the end of
+    a turn and {"type": "close"} when done. The server sends the audio as binary
+    messages, in order, with JSON events around it: "sentence" before each
+    sentence's audio, "error" for a sentence that failed, "flushed" once a turn's
+    audio has been sent, and "done" (with time from first text to first audio)
+    before it closes the socket.
+    """
+    async def send_event(event):
+        await send({"type": "websocket.send", "text": json.dumps(event)})
+
+    voice = req.args.get('voice', DEFAULT_VOICE)
+    try:
+        speed = float(req.args.get('speed', DEFAULT_SPEED))
+    except ValueError:
+        speed = None
+    await send({"type": "websocket.accept"})
+    if speed is None or (VALIDATE_VOICES and not is_known_voice(voice)):
+        ERRORS.inc("validation")
+        await send_event({"type": "error", "error": f"Unknown voice '{voice}'" if speed is not None else "Invalid 'speed'"})
+        await send({"type": "websocket.close", "code": 1008})
+        return
+
+    REQUESTS.inc('stream', *metric_labels('mp3', voice))
+    stream = SpeechStream(voice, speed, req.client_key)
+
+    async def read_messages():
+        """Feed client messages to the stream; True once the client closed it, False if it went away."""
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                return False
+            try:
+                data = json.loads(message.get("text") or "")
+                kind = data.get("type")
+            except (ValueError, AttributeError):
+                kind = data = None
+            if kind == "text" and isinstance(data.get("text"), str):
+                stream.feed(data["text"])
+            elif kind == "flush":
+                stream.flush()
+            elif kind == "close":
+                stream.close()
+                return True
+            else:
+                await send_event({"type": "error", "error": "Expected a JSON message of type text, flush or close"})
+
+    async def write_events():
+        async for event in stream.events():
+            if event[0] == "audio":
+                await send({"type": "websocket.send", "bytes": event[1]})
+            elif event[0] == "sentence":
+                await send_event({"type": "sentence", "index": event[1], "text": event[2]})
+            elif event[0] == "error":
+                ERRORS.inc("upstream")
+                await send_event({"type": "error", "index": event[1], "error": event[2]})
+            else:
+                await send_event({"type": "flushed"})
+
+    IN_FLIGHT.inc('stream')
+    reader = asyncio.create_task(read_messages())
+    writer = asyncio.create_task(write_events())
+    try:
+        await asyncio.wait([reader, writer], return_when=asyncio.FIRST_COMPLETED)
+        if writer.done() or reader.result():  # Otherwise the client went away
+            await writer  # Raises if sending failed
+            await send_event({"type": "done", **stream.summary()})
+            await send({"type": "websocket.close", "code": 1000})
+    finally:
+        reader.cancel()
+        writer.cancel()
+        stream.cancel()
+        IN_FLIGHT.dec('stream')
+        RESPONSE_BYTES.inc('stream', amount=stream.audio_bytes)
+
+async def websocket_app(scope, receive, send):
+    if (await receive())["type"] != "websocket.connect":
+        return
+    req = Request(scope, b"")
+    # Closing before accepting rejects the handshake (the server answers 403)
+    if scope["path"] not in SPEECH_STREAM_PATHS or check_websocket_api_key(req) is not None:
+        await send({"type": "websocket.close", "code": 1008})
+        return
+    await speech_stream_socket(req, receive, send)
+
+_started = False
+
+async def startup():
+    """Adopt the server's event loop as the shared loop, load the voice catalogue, start the job workers and the warmup."""
+    global _started
+    if _started:
+        return
+    _started = True
+    async_bridge.use_running_loop()
+    await voice_catalog.start_async()
+    if job_runner is not None:
+        await job_runner.start_async()
+    await warmup.start_async()
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await startup()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+async def send_response(response, send, receive):
+    """Send a response, returning the number of body bytes written."""
+    headers = response.headers
+    if response.stream is None:
+        headers = {**headers, 'Content-Length': str(len(response.body))}
+    await send({
+        "type": "http.response.start",
+        "status": response.status,
+        "headers": [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()],
+    })
+    if response.stream is None:
+        await send({"type": "http.response.body", "body": response.body})
+        return len(response.body)
+
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    disconnected = asyncio.create_task(wait_for_disconnect())
+    sent = 0
+    try:
+        async for chunk in response.stream:
+            if disconnected.done():
+                break
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            sent += len(chunk)
+        else:
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        disconnected.cancel()
+        await response.stream.aclose()
+    return sent
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] == "websocket":
+        await startup()
+        await websocket_app(scope, receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    await startup()
+    if scope["path"] in SPEECH_PATHS and scope["method"] == 'POST':
+        await speech_app(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    server.print_banner(" (ASGI)")
+    uvicorn.run(app, host='0.0.0.0', port=PORT, log_level='warning')
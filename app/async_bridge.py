@@ -0,0 +1,143 @@
+# async_bridge.py
+
+import asyncio
+import contextvars
+import threading
+
+try:
+    import gevent
+    from gevent.hub import Waiter
+except ImportError:  # Allow use outside of the gevent server
+    gevent = None
+
+_loop = None
+_loop_thread = None
+_gevent_server = gevent is not None  # False in ASGI mode, where callers are plain threads
+_loop_lock = threading.Lock()
+
+def _run_loop(loop, ready):
+    asyncio.set_event_loop(loop)
+    loop.call_soon(ready.set)
+    loop.run_forever()
+
+def get_loop():
+    """Return the shared asyncio event loop, starting its thread on first use."""
+    global _loop, _loop_thread
+    if _loop is not None:
+        return _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            thread = threading.Thread(target=_run_loop, args=(loop, ready), name="asyncio-bridge", daemon=True)
+            thread.start()
+            ready.wait()
+            _loop_thread = thread
+            _loop = loop
+    return _loop
+
+def use_running_loop():
+    """
+    Make the caller's running loop the shared loop, for servers that already run one
+    (ASGI mode). Must be called from that loop before anything else uses the bridge.
+    Synchronous callers, the Flask routes on the ASGI server's thread pool, then
+    wait by blocking their own thread.
+    """
+    global _loop, _gevent_server
+    loop = asyncio.get_running_loop()
+    with _loop_lock:
+        if _loop is not None and _loop is not loop:
+            raise RuntimeError("The shared event loop is already running elsewhere")
+        _loop = loop
+        _gevent_server = False
+
+def _in_gevent_greenlet():
+    return _gevent_server and gevent.getcurrent() is not gevent.get_hub()
+
+def _on_loop():
+    try:
+        return _loop is not None and asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        return False
+
+def submit(coro):
+    """Schedule a coroutine on the shared loop and return a concurrent.futures.Future."""
+    loop = get_loop()
+    context = contextvars.copy_context()
+    return asyncio.run_coroutine_threadsafe(_run_in_context(coro, context), loop)
+
+async def _run_in_context(coro, context):
+    # Run the coroutine in the caller's context so context variables set by the
+    # request handler are visible to the async code.
+    return await asyncio.get_running_loop().create_task(coro, context=context)
+
+def wait(future, timeout=None):
+    """
+    Wait for a concurrent.futures.Future from the shared loop.
+
+    Inside a gevent greenlet this yields to the hub instead of blocking the thread,
+    so other requests keep running while this one waits on upstream I/O.
+    """
+    if _in_gevent_greenlet():
+        # An async watcher is the thread-safe way to wake the gevent hub from the loop thread
+        hub = gevent.get_hub()
+        watcher = hub.loop.async_()
+        waiter = Waiter(hub)
+        watcher.start(waiter.switch, None)
+        future.add_done_callback(lambda _done: watcher.send())
+        try:
+            with gevent.Timeout(timeout, TimeoutError("Timed out waiting for the async task")):
+                while not future.done():
+                    waiter.get()
+                    waiter.clear()
+        except BaseException:
+            future.cancel()  # Request was killed or timed out, don't leave the task running
+            raise
+        finally:
+            watcher.close()
+        return future.result()
+
+    try:
+        return future.result(timeout=timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+def run(coro, timeout=None):
+    """Run a coroutine on the shared loop from synchronous code and return its result."""
+    if _on_loop():
+        coro.close()
+        raise RuntimeError("async_bridge.run() called from the shared loop itself; await the coroutine instead")
+    return wait(submit(coro), timeout)
+
+def iterate(async_iterable, max_buffered=16):
+    """
+    Consume an async iterable from synchronous code.
+
+    A producer task on the shared loop pulls items ahead into a bounded queue,
+    so upstream reads overlap with the consumer writing its response.
+    """
+    queue = asyncio.Queue(maxsize=max_buffered)
+    done = object()
+
+    async def _produce():
+        try:
+            async for item in async_iterable:
+                await queue.put((item, None))
+        except Exception as e:
+            await queue.put((done, e))
+        else:
+            await queue.put((done, None))
+
+    producer = submit(_produce())
+    try:
+        while True:
+            item, error = run(queue.get())
+            if item is done:
+                if error is not None:
+                    raise error
+                break
+            yield item
+    finally:
+        # Stop the producer if the consumer went away early (e.g. client disconnected)
+        producer.cancel()
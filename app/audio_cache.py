@@ -0,0 +1,344 @@
+# audio_cache.py
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from config import DEFAULT_CONFIGS
+from utils import getenv_bool
+
+AUDIO_CACHE_ENABLED = getenv_bool('AUDIO_CACHE_ENABLED', DEFAULT_CONFIGS["AUDIO_CACHE_ENABLED"])
+AUDIO_CACHE_MEMORY_MB = float(os.getenv('AUDIO_CACHE_MEMORY_MB', str(DEFAULT_CONFIGS["AUDIO_CACHE_MEMORY_MB"])))
+AUDIO_CACHE_DISK_MB = float(os.getenv('AUDIO_CACHE_DISK_MB', str(DEFAULT_CONFIGS["AUDIO_CACHE_DISK_MB"])))
+AUDIO_CACHE_PINNED_MB = float(os.getenv('AUDIO_CACHE_PINNED_MB', str(DEFAULT_CONFIGS["AUDIO_CACHE_PINNED_MB"])))
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', DEFAULT_CONFIGS["AUDIO_CACHE_DIR"]) or os.path.join(tempfile.gettempdir(), 'openai-edge-tts-cache')
+
+# Seconds between rescans of the disk tier, so processes sharing it agree on its size
+DISK_REINDEX_INTERVAL = 60
+
+def make_cache_key(text, edge_tts_voice, speed_rate, response_format):
+    """Build a content-addressed key from everything that affects the rendered audio."""
+    material = "\x00".join([text, edge_tts_voice, speed_rate, response_format])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+class AudioCache:
+    """
+    Two-tier audio cache: a bounded in-memory LRU in front of an on-disk store.
+
+    Both tiers are bounded by total payload size in bytes. The memory tier evicts
+    least recently used entries; the disk tier evicts least recently accessed files.
+    A byte limit of 0 disables that tier. Entries pinned with pin() live in a
+    separate in-memory region of their own size, which is never evicted.
+    """
+
+    def __init__(self, memory_max_bytes, disk_dir=None, disk_max_bytes=0, pinned_max_bytes=0):
+        self.memory_max_bytes = int(memory_max_bytes)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = int(disk_max_bytes) if disk_dir else 0
+        self.pinned_max_bytes = int(pinned_max_bytes)
+
+        self._lock = threading.Lock()
+        self._pinned = {}  # key -> bytes
+        self._pinned_bytes = 0
+        self._memory = OrderedDict()  # key -> bytes, oldest first
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> size, oldest first
+        self._disk_bytes = 0
+        self._disk_indexed_at = 0.0
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.pinned_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_max_bytes > 0:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.audio")
+
+    def _load_disk_index(self):
+        """Rebuild the disk index from the files on disk, oldest access first."""
+        entries = []
+        for root, _dirs, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith('.audio'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name[:-len('.audio')], stat.st_size))
+
+        disk = OrderedDict((key, size) for _mtime, key, size in sorted(entries))
+        with self._lock:
+            self._disk = disk
+            self._disk_bytes = sum(disk.values())
+            self._disk_indexed_at = time.monotonic()
+            self._evict_disk()
+
+    def get(self, key):
+        """Return the cached audio for key, or None."""
+        with self._lock:
+            data = self._pinned.get(key)
+            if data is not None:
+                self.hits += 1
+                self.pinned_hits += 1
+                return data
+
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return data
+
+            if key not in self._disk and not self.disk_max_bytes:
+                self.misses += 1
+                return None
+
+        # Entries missing from the index may still have been written by another worker process
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # Mark as recently used for eviction ordering
+        except OSError:
+            with self._lock:
+                self._forget_disk(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            else:
+                self._disk[key] = len(data)
+                self._disk_bytes += len(data)
+            self.hits += 1
+            self.disk_hits += 1
+            self._put_memory(key, data)
+        return data
+
+    def put(self, key, data):
+        """Store audio under key in both tiers."""
+        if not data:
+            return
+
+        with self._lock:
+            if key in self._pinned:
+                return
+            self._put_memory(key, data)
+            write_disk = self.disk_max_bytes > 0 and key not in self._disk and len(data) <= self.disk_max_bytes
+
+        if not write_disk:
+            return
+
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file first so readers never see a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Audio cache: failed to write {path}: {e}")
+            return
+
+        self._added_to_disk(key, len(data))
+
+    def _added_to_disk(self, key, size):
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = size
+                self._disk_bytes += size
+            self._evict_disk()
+            reindex = time.monotonic() - self._disk_indexed_at > DISK_REINDEX_INTERVAL
+
+        if reindex:
+            # Other worker processes sharing the directory add and evict files too
+            self._load_disk_index()
+
+    def open_entry(self, key):
+        """
+        Return an EntryWriter that collects audio for key as it is produced.
+
+        The audio is held in memory up to the memory tier's entry limit and spooled
+        to a temp file in the disk tier past that, so a long render never buffers
+        more than memory_max_bytes. Returns None if neither tier could hold it.
+        """
+        if self.memory_max_bytes <= 0 and self.disk_max_bytes <= 0:
+            return None
+        return EntryWriter(self, key)
+
+    def pin(self, key, data):
+        """
+        Keep audio under key in the pinned region, where eviction never reaches it.
+
+        Returns False, leaving the entry to the regular tiers, if the region has no
+        room left for it.
+        """
+        if not data:
+            return False
+        with self._lock:
+            previous = self._pinned.get(key)
+            pinned_bytes = self._pinned_bytes - (len(previous) if previous is not None else 0) + len(data)
+            if pinned_bytes > self.pinned_max_bytes:
+                return False
+            self._pinned[key] = data
+            self._pinned_bytes = pinned_bytes
+            duplicate = self._memory.pop(key, None)  # Served from the pinned region from now on
+            if duplicate is not None:
+                self._memory_bytes -= len(duplicate)
+        return True
+
+    def _put_memory(self, key, data):
+        if len(data) > self.memory_max_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    def _forget_disk(self, key):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._disk_path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": True,
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "pinned_hits": self.pinned_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_max_bytes": self.memory_max_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes,
+                "pinned_entries": len(self._pinned),
+                "pinned_bytes": self._pinned_bytes,
+                "pinned_max_bytes": self.pinned_max_bytes,
+            }
+
+class EntryWriter:
+    """
+    Audio for one cache entry, written chunk by chunk (see AudioCache.open_entry).
+
+    Call commit() once the audio is complete to store it, or discard() to drop it.
+    write() only touches the disk once the entry has outgrown the memory tier;
+    on_disk tells callers when to move writes off the event loop.
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        self.on_disk = False
+        self._chunks = []
+        self._file = None
+        self._temp_path = None
+        self._abandoned = False
+
+    def write(self, chunk):
+        if self._abandoned:
+            return
+        self.size += len(chunk)
+        if not self.on_disk and self.size <= self.cache.memory_max_bytes:
+            self._chunks.append(chunk)
+            return
+        if self.size > self.cache.disk_max_bytes:
+            self.discard()  # Too large for either tier
+            return
+        try:
+            if not self.on_disk:
+                self._spool()
+            self._file.write(chunk)
+        except OSError as e:
+            print(f"Audio cache: failed to spool {self.key}: {e}")
+            self.discard()
+
+    def _spool(self):
+        directory = os.path.dirname(self.cache._disk_path(self.key))
+        os.makedirs(directory, exist_ok=True)
+        fd, self._temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+        self.on_disk = True
+        for buffered in self._chunks:
+            self._file.write(buffered)
+        self._chunks = []
+
+    def commit(self):
+        """Store the entry: in both tiers if it fits in memory, otherwise straight into the disk tier."""
+        if self._abandoned:
+            return
+        if not self.on_disk:
+            data = b"".join(self._chunks)
+            self._chunks = []
+            self._abandoned = True
+            self.cache.put(self.key, data)
+            return
+
+        path = self.cache._disk_path(self.key)
+        try:
+            self._file.close()
+            os.replace(self._temp_path, path)
+        except OSError as e:
+            print(f"Audio cache: failed to write {path}: {e}")
+            self.discard()
+            return
+        self._file = self._temp_path = None
+        self._abandoned = True
+        self.cache._added_to_disk(self.key, self.size)
+
+    def discard(self):
+        self._abandoned = True
+        self._chunks = []
+        if self._file is not None:
+            try:
+                self._file.close()
+                os.unlink(self._temp_path)
+            except OSError:
+                pass
+            self._file = self._temp_path = None
+
+audio_cache = AudioCache(
+    memory_max_bytes=AUDIO_CACHE_MEMORY_MB * 1024 * 1024,
+    disk_dir=AUDIO_CACHE_DIR,
+    disk_max_bytes=AUDIO_CACHE_DISK_MB * 1024 * 1024,
+    pinned_max_bytes=AUDIO_CACHE_PINNED_MB * 1024 * 1024,
+) if AUDIO_CACHE_ENABLED else None
+
+def get_cache_stats():
+    if audio_cache is None:
+        return {"enabled": False}
+    return audio_cache.stats()
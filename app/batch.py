@@ -0,0 +1,187 @@
+# batch.py
+
+import asyncio
+import base64
+import json
+import os
+import re
+import time
+import zipfile
+
+from config import DEFAULT_CONFIGS
+from metrics import REQUESTS
+from tts_handler import FFMPEG_OUTPUT_ARGS, generate_speech_async, is_ffmpeg_installed, is_known_voice, metric_labels
+from utils import getenv_bool, AUDIO_FORMAT_MIME_TYPES
+
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', str(DEFAULT_CONFIGS["BATCH_MAX_ITEMS"])))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', str(DEFAULT_CONFIGS["BATCH_CONCURRENCY"])))
+
+DEFAULT_VOICE = os.getenv('DEFAULT_VOICE', DEFAULT_CONFIGS["DEFAULT_VOICE"])
+DEFAULT_RESPONSE_FORMAT = os.getenv('DEFAULT_RESPONSE_FORMAT', DEFAULT_CONFIGS["DEFAULT_RESPONSE_FORMAT"])
+DEFAULT_SPEED = float(os.getenv('DEFAULT_SPEED', str(DEFAULT_CONFIGS["DEFAULT_SPEED"])))
+VALIDATE_VOICES = getenv_bool('VALIDATE_VOICES', DEFAULT_CONFIGS["VALIDATE_VOICES"])
+
+STREAM_FORMATS = ('ndjson', 'zip')
+
+class BatchError(ValueError):
+    """The batch request as a whole is invalid (answered with a 400)."""
+
+class BatchItem:
+    """One entry of a batch, with its validated parameters or the reason it was rejected."""
+
+    def __init__(self, index, item_id=None):
+        self.index = index
+        self.id = item_id
+        self.text = None
+        self.voice = None
+        self.response_format = None
+        self.speed = None
+        self.error = None
+
+    @property
+    def file_name(self):
+        name = re.sub(r'[^A-Za-z0-9._-]+', '_', str(self.id))[:64] if self.id is not None else 'item'
+        return f"{self.index:04d}-{name}.{self.response_format or 'mp3'}"
+
+def prepare_batch(data, filter_text):
+    """
+    Validate a batch request body and prepare its items.
+
+    The body holds a list of {input, voice, speed, response_format, id} items; voice,
+    speed and response_format may also be given once at the top level as defaults.
+    Raises BatchError for problems with the batch itself, while invalid items are
+    returned with their error set so they are reported without failing the others.
+    Returns the items and the stream format ('ndjson' or 'zip').
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
+        raise BatchError("Missing 'items' in request body")
+    if BATCH_MAX_ITEMS and len(data['items']) > BATCH_MAX_ITEMS:
+        raise BatchError(f"Too many items: {len(data['items'])} (the limit is {BATCH_MAX_ITEMS})")
+    stream_format = data.get('stream_format', 'ndjson')
+    if stream_format not in STREAM_FORMATS:
+        raise BatchError(f"Unsupported stream_format '{stream_format}', use one of: {', '.join(STREAM_FORMATS)}")
+
+    items = []
+    for index, raw in enumerate(data['items']):
+        item = BatchItem(index, raw.get('id') if isinstance(raw, dict) else None)
+        items.append(item)
+        if not isinstance(raw, dict) or not isinstance(raw.get('input'), str) or not raw['input'].strip():
+            item.error = "Missing 'input'"
+            continue
+        try:
+            item.voice = raw.get('voice', data.get('voice', DEFAULT_VOICE))
+            item.response_format = raw.get('response_format', data.get('response_format', DEFAULT_RESPONSE_FORMAT))
+            item.speed = float(raw.get('speed', data.get('speed', DEFAULT_SPEED)))
+        except (TypeError, ValueError):
+            item.error = "Invalid 'speed'"
+            continue
+        if item.response_format not in AUDIO_FORMAT_MIME_TYPES:
+            item.error = f"Unsupported response_format '{item.response_format}'"
+            continue
+        if item.response_format in FFMPEG_OUTPUT_ARGS and not is_ffmpeg_installed():
+            item.response_format = 'mp3'  # Served unmodified, as by the single-item routes
+        if VALIDATE_VOICES and not is_known_voice(item.voice):
+            item.error = f"Unknown voice '{item.voice}'"
+            continue
+        item.text = filter_text(raw['input'])
+        REQUESTS.inc('batch', *metric_labels(item.response_format, item.voice))
+    return items, stream_format
+
+async def _synthesize(items, client_key):
+    """Synthesize the items at most BATCH_CONCURRENCY at a time, yielding (item, audio, error) as each finishes."""
+    finished = asyncio.Queue()
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY if BATCH_CONCURRENCY > 0 else len(items))
+
+    async def run(item):
+        if item.error is not None:
+            finished.put_nowait((item, None, item.error))
+            return
+        async with semaphore:
+            try:
+                audio = await generate_speech_async(item.text, item.voice, item.response_format, item.speed, client_key)
+                finished.put_nowait((item, audio, None))
+            except Exception as e:
+                finished.put_nowait((item, None, str(e) or type(e).__name__))
+
+    tasks = [asyncio.create_task(run(item)) for item in items]
+    try:
+        for _ in items:
+            yield await finished.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def _item_result(item, audio, error):
+    result = {"object": "batch.item", "index": item.index, "id": item.id}
+    if error is not None:
+        result.update(status="error", error=error)
+    else:
+        result.update(status="ok", response_format=item.response_format,
+                      content_type=AUDIO_FORMAT_MIME_TYPES[item.response_format], bytes=len(audio))
+    return result
+
+def _summary(items, failed, started):
+    return {
+        "object": "batch.summary",
+        "total": len(items),
+        "succeeded": len(items) - failed,
+        "failed": failed,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+async def ndjson_stream(items, client_key):
+    """One JSON line per item as it completes (with base64 audio on success), then a summary line."""
+    started = time.perf_counter()
+    failed = 0
+    async for item, audio, error in _synthesize(items, client_key):
+        result = _item_result(item, audio, error)
+        if error is None:
+            result["audio"] = base64.b64encode(audio).decode('ascii')
+        else:
+            failed += 1
+        yield json.dumps(result) + "\n"
+    yield json.dumps(_summary(items, failed, started)) + "\n"
+
+class _ZipBuffer:
+    """Write-only file object collecting zip output until it is drained into the response."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.data)
+        self.data.clear()
+        return data
+
+async def zip_stream(items, client_key):
+    """
+    A zip archive written as items complete: one stored (uncompressed) entry per clip,
+    and a manifest.json with every item's status at the end.
+    """
+    started = time.perf_counter()
+    failed = 0
+    manifest = []
+    buffer = _ZipBuffer()
+    archive = zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED)
+    async for item, audio, error in _synthesize(items, client_key):
+        result = _item_result(item, audio, error)
+        if error is None:
+            result["file"] = item.file_name
+            archive.writestr(zipfile.ZipInfo(item.file_name, time.localtime()[:6]), audio)
+            yield buffer.drain()
+        else:
+            failed += 1
+        manifest.append(result)
+
+    manifest.sort(key=lambda result: result["index"])
+    archive.writestr(zipfile.ZipInfo('manifest.json', time.localtime()[:6]),
+                     json.dumps({"items": manifest, **_summary(items, failed, started)}, indent=2))
+    archive.close()
+    yield buffer.drain()
@@ -0,0 +1,154 @@
+# coalesce.py
+
+import asyncio
+import os
+
+from config import DEFAULT_CONFIGS
+
+# Audio a flight keeps for late joiners; longer flights stop taking new subscribers
+COALESCE_REPLAY_MB = float(os.getenv('COALESCE_REPLAY_MB', str(DEFAULT_CONFIGS["COALESCE_REPLAY_MB"])))
+
+class _Flight:
+    """One in-flight upstream synthesis and the chunks its subscribers have yet to read."""
+
+    def __init__(self, max_replay_bytes):
+        self.max_replay_bytes = max_replay_bytes
+        self.chunks = []
+        self.offset = 0  # Position of chunks[0] in the whole stream
+        self.produced_bytes = 0
+        self.joinable = True
+        self.done = False
+        self.error = None
+        self.task = None
+        self._positions = {}  # Subscriber -> position of the next chunk it reads
+        self._new_data = asyncio.Event()
+
+    @property
+    def subscribers(self):
+        return len(self._positions)
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        self.produced_bytes += len(chunk)
+        if self.joinable and self.produced_bytes > self.max_replay_bytes:
+            self.joinable = False  # Too long to replay, so only chunks not yet read by everyone are kept
+        if not self.joinable:
+            self._trim()
+        self._wake()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._wake()
+
+    def _wake(self):
+        # Wake everyone waiting on the current event and start a fresh one
+        self._new_data.set()
+        self._new_data = asyncio.Event()
+
+    def _trim(self):
+        """Drop the chunks every subscriber has already read."""
+        end = self.offset + len(self.chunks)
+        lowest = min(self._positions.values(), default=end)
+        if lowest > self.offset:
+            del self.chunks[:lowest - self.offset]
+            self.offset = lowest
+
+    def subscribe(self):
+        """
+        Register a subscriber and return its stream: a replay of the chunks produced
+        so far, then the live tail. The subscriber is registered before the stream is
+        first iterated, so no chunk it needs is trimmed in between.
+        """
+        subscriber = object()
+        self._positions[subscriber] = self.offset
+        return self._follow(subscriber)
+
+    async def _follow(self, subscriber):
+        try:
+            while True:
+                while self._positions[subscriber] < self.offset + len(self.chunks):
+                    position = self._positions[subscriber]
+                    self._positions[subscriber] = position + 1
+                    yield self.chunks[position - self.offset]
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                if not self.joinable:
+                    self._trim()
+                await self._new_data.wait()
+        finally:
+            del self._positions[subscriber]
+
+class RequestCoalescer:
+    """
+    Deduplicates identical concurrent synthesis requests.
+
+    The first request for a key starts the upstream stream; requests for the same key
+    that arrive while it is running subscribe to it instead of starting their own,
+    receiving a replay of what was already produced followed by the live tail. Once a
+    flight has produced more than max_replay_bytes it takes no new subscribers (they
+    start a flight of their own) and keeps only the chunks its subscribers have not
+    read yet. The upstream stream is cancelled if every subscriber goes away. Must
+    only be used from the shared event loop.
+    """
+
+    def __init__(self, max_replay_bytes):
+        self.max_replay_bytes = max_replay_bytes
+        self._flights = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def stream(self, key, start_stream):
+        """Yield the chunks for key, calling start_stream() only if nothing joinable is in flight."""
+        flight = self._flights.get(key)
+        if flight is None or not flight.joinable:
+            flight = _Flight(self.max_replay_bytes)
+            self._flights[key] = flight
+            self.started += 1
+            flight.task = asyncio.create_task(self._produce(key, flight, start_stream()))
+        else:
+            self.coalesced += 1
+
+        chunks = flight.subscribe()
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+            if flight.subscribers == 0 and not flight.done:
+                # Forget the flight first, so a request arriving before the task unwinds starts a new one
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _produce(self, key, flight, chunks):
+        try:
+            async for chunk in chunks:
+                flight.publish(chunk)
+                if not flight.joinable:
+                    self._forget(key, flight)
+        except asyncio.CancelledError:
+            flight.finish(RuntimeError("Synthesis was cancelled"))
+            raise
+        except Exception as e:
+            flight.finish(e)
+        else:
+            flight.finish()
+        finally:
+            self._forget(key, flight)
+
+    def stats(self):
+        total = self.started + self.coalesced
+        return {
+            "in_flight": len(self._flights),
+            "upstream_started": self.started,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+        }
+
+request_coalescer = RequestCoalescer(COALESCE_REPLAY_MB * 1024 * 1024)
@@ -4,16 +4,83 @@ DEFAULT_CONFIGS = {
     # Server settings
     "PORT": 5050,
     "API_KEY": 'your_api_key_here',  # Fallback API key
+    "WORKERS": 1,  # Worker processes sharing the port, 1 runs a single process
+    "GRACEFUL_TIMEOUT": 30,  # Seconds a worker may spend finishing requests on shutdown
+    "ASGI_THREADS": 32,  # ASGI mode: threads serving the routes that run on Flask (all but speech streaming)
 
     # TTS settings
     "DEFAULT_VOICE": 'en-US-AvaNeural',
     "DEFAULT_RESPONSE_FORMAT": 'mp3',
     "DEFAULT_SPEED": 1.0,
     "DEFAULT_LANGUAGE": 'en-US',
+    "SYNTHESIS_PARALLELISM": 4,  # Concurrent edge-tts sessions per long input, 1 disables splitting
+    "SEGMENT_MAX_CHARS": 1000,  # Inputs longer than this are split at sentence boundaries
+    "COALESCE_REQUESTS": True,  # Identical concurrent requests share one upstream synthesis
+    "COALESCE_REPLAY_MB": 4,  # Audio a shared synthesis keeps for requests joining late, longer ones stop taking joiners
+    "BATCH_MAX_ITEMS": 500,  # Items accepted by one batch request, 0 for no limit
+    "BATCH_CONCURRENCY": 8,  # Items of one batch request synthesized at once
+    "SPEECH_STREAM_LOOKAHEAD": 3,  # Sentences of a WebSocket speech stream synthesized or buffered before the client reads them
+    "SSE_COALESCE_BYTES": 8192,  # Audio merged into one SSE or binary stream event, 0 sends every edge-tts chunk on its own
+    "SSE_COALESCE_MS": 100,  # Longest a chunk is held back waiting to be merged
+
+    # Asynchronous jobs
+    "JOBS_ENABLED": True,  # Submit / poll / fetch job API under /v1/audio/speech/jobs
+    "JOBS_DIR": '',  # Job database and finished audio, defaults to a directory under the system temp dir
+    "JOBS_WORKERS": 2,  # Jobs synthesized at once per server process
+    "JOBS_TTL": 24 * 60 * 60,  # Seconds a finished job and its audio are kept
+    "JOBS_CHUNK_CHARS": 4000,  # Jobs are synthesized (and report progress) in chunks of about this many characters
+    "JOBS_MAX_CHARS": 1000000,  # Longest input accepted by a job, 0 for no limit
+
+    # Startup warmup
+    "WARMUP_MANIFEST": '',  # JSONL or YAML list of {input, voice, speed, response_format} rendered and pinned at startup
+    "WARMUP_CONCURRENCY": 4,  # Warmup entries rendered at once
+
+    # Upstream connection pool
+    "UPSTREAM_POOL_SIZE": 0,  # Idle edge-tts connections kept open for reuse, 0 disables pooling (opt-in)
+    "UPSTREAM_POOL_IDLE_TIMEOUT": 30,  # Seconds an idle connection is kept
+    "UPSTREAM_POOL_MAX_AGE": 300,  # Seconds before a connection is retired, however busy
+    "UPSTREAM_URL": '',  # Defaults to the edge-tts service, override to test against a local stand-in
+
+    # Upstream timeouts, retries and hedging
+    "UPSTREAM_CONNECT_TIMEOUT": 10,  # Seconds to open a connection to edge-tts
+    "UPSTREAM_FIRST_CHUNK_TIMEOUT": 10,  # Seconds from starting a synthesis to its first audio
+    "UPSTREAM_CHUNK_TIMEOUT": 10,  # Seconds between messages once audio is flowing
+    "UPSTREAM_RETRIES": 2,  # Further attempts after a failed or stalled synthesis
+    "UPSTREAM_RETRY_BACKOFF": 0.25,  # Base delay in seconds before a retry, doubled for each further one
+    "UPSTREAM_HEDGE_PERCENTILE": 0,  # Start a duplicate synthesis when the first chunk is slower than this percentile, 0 disables
+
+    # Admission control (0 disables a limit)
+    "MAX_CONCURRENT_SYNTHESIS": 32,  # Upstream sessions running at once
+    "MAX_CONCURRENT_PER_KEY": 0,  # Upstream sessions running at once per client address (all clients share one behind a proxy)
+    "MAX_QUEUE_SIZE": 100,  # Requests waiting for a slot before new ones get a 429
+    "QUEUE_TIMEOUT": 30,  # Seconds a request may wait for a slot before it gets a 503
 
     # Feature flags
     "REQUIRE_API_KEY": True,
     "REMOVE_FILTER": False,
     "EXPAND_API": True,
     "DETAILED_ERROR_LOGGING": True,
+    "VALIDATE_VOICES": True,  # Reject unknown voices with a 400 before calling edge-tts
+    "METRICS_ENABLED": True,  # Prometheus metrics at /metrics
+
+    # Per-request tracing
+    "TRACING_ENABLED": False,  # Stage timings in a Server-Timing header and a JSONL trace file
+    "TRACE_SAMPLE_RATE": 1.0,  # Fraction of speech requests traced
+    "TRACE_FILE": '',  # Defaults to openai-edge-tts-traces.jsonl under the system temp dir
+    "TRACE_FILE_MAX_MB": 10,  # Size at which the trace file is rotated
+    "TRACE_FILE_BACKUPS": 3,  # Rotated trace files kept
+    "TRACE_PROFILE_MS": 0,  # Profile traced requests and keep a cProfile dump of those slower than this, 0 disables
+    "TRACE_PROFILE_DIR": '',  # Defaults to a directory under the system temp dir
+
+    # Voice catalogue settings
+    "VOICE_CATALOG_TTL": 6 * 60 * 60,  # Seconds between background refreshes
+    "VOICE_CATALOG_SNAPSHOT": '',  # Defaults to openai-edge-tts-voices.json in the system temp dir
+
+    # Audio cache settings
+    "AUDIO_CACHE_ENABLED": True,
+    "AUDIO_CACHE_MEMORY_MB": 64,  # In-memory LRU tier
+    "AUDIO_CACHE_DISK_MB": 512,  # On-disk tier, 0 disables it
+    "AUDIO_CACHE_DIR": '',  # Defaults to a directory under the system temp dir
+    "AUDIO_CACHE_PINNED_MB": 16,  # Reserved in-memory region for warmup phrases, never evicted
+    "FRAGMENT_CACHE": False,  # Cache audio per sentence, so texts sharing sentences only synthesize the new ones
 } 
\ No newline at end of file
@@ -0,0 +1,93 @@
+# fragment_cache.py
+
+import contextvars
+import threading
+
+from config import DEFAULT_CONFIGS
+from audio_cache import audio_cache, make_cache_key
+from metrics import FRAGMENTS
+from utils import getenv_bool
+
+FRAGMENT_CACHE = getenv_bool('FRAGMENT_CACHE', DEFAULT_CONFIGS["FRAGMENT_CACHE"])
+
+def fragment_cache_enabled():
+    return FRAGMENT_CACHE and audio_cache is not None
+
+def fragment_key(sentence, edge_tts_voice, speed_rate):
+    """
+    Cache key of one sentence's mp3 audio.
+
+    It is the key a request for just that sentence would use, so single-sentence
+    requests and fragments of longer ones share their audio.
+    """
+    return make_cache_key(sentence, edge_tts_voice, speed_rate, "mp3")
+
+class FragmentReport:
+    """How much of one request's audio came from cached sentences."""
+
+    def __init__(self):
+        self.sentences = 0
+        self.hits = 0
+        self.chars = 0
+        self.cached_chars = 0
+
+    def record(self, sentences, cached):
+        self.sentences += len(sentences)
+        self.hits += sum(1 for audio in cached if audio is not None)
+        self.chars += sum(len(sentence) for sentence in sentences)
+        self.cached_chars += sum(len(sentence) for sentence, audio in zip(sentences, cached) if audio is not None)
+
+    @property
+    def hit_ratio(self):
+        return self.hits / self.sentences if self.sentences else 0.0
+
+    def headers(self):
+        """Response headers describing the report, empty if no fragments were looked up."""
+        if not self.sentences:
+            return {}
+        return {'X-Fragment-Cache': f"hits={self.hits}/{self.sentences}; chars={self.cached_chars}/{self.chars}; ratio={self.hit_ratio:.2f}"}
+
+_report = contextvars.ContextVar('fragment_report', default=None)
+
+def track_fragments():
+    """
+    Start a FragmentReport for the current request and return it.
+
+    Lookups made while generating the request's audio (on the shared loop too, as
+    the async bridge runs coroutines in the caller's context) are added to it.
+    """
+    report = FragmentReport()
+    _report.set(report)
+    return report
+
+_lock = threading.Lock()
+_stats = {"requests": 0, "sentences": 0, "hits": 0, "chars": 0, "cached_chars": 0}
+
+def lookup(sentences, edge_tts_voice, speed_rate):
+    """Cached audio (or None) for each sentence; counted in the request's report and the totals."""
+    cached = [audio_cache.get(fragment_key(sentence, edge_tts_voice, speed_rate)) for sentence in sentences]
+    hits = sum(1 for audio in cached if audio is not None)
+    FRAGMENTS.inc("hit", amount=hits)
+    FRAGMENTS.inc("miss", amount=len(sentences) - hits)
+
+    report = _report.get()
+    if report is not None:
+        report.record(sentences, cached)
+    with _lock:
+        _stats["requests"] += 1
+        _stats["sentences"] += len(sentences)
+        _stats["hits"] += hits
+        _stats["chars"] += sum(len(sentence) for sentence in sentences)
+        _stats["cached_chars"] += sum(len(sentence) for sentence, audio in zip(sentences, cached) if audio is not None)
+    return cached
+
+def store(sentence, edge_tts_voice, speed_rate, audio):
+    audio_cache.put(fragment_key(sentence, edge_tts_voice, speed_rate), audio)
+
+def get_fragment_stats():
+    if not fragment_cache_enabled():
+        return {"enabled": False}
+    with _lock:
+        stats = dict(_stats)
+    stats["hit_ratio"] = round(stats["hits"] / stats["sentences"], 4) if stats["sentences"] else 0.0
+    return {"enabled": True, **stats}
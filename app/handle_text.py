@@ -3,6 +3,45 @@
 import re
 import emoji
 
+from tracing import span
+
+# Patterns are compiled once at import. Each rewrite below depends on the output of the
+# previous one (e.g. links are removed before images are matched), so the passes keep
+# their original order; each is skipped when its trigger characters are absent.
+HEADER_PATTERN = re.compile(r"^(#{1,6})\s+(.*)", flags=re.MULTILINE)
+LINK_PATTERN = re.compile(r"\[([^\]]+)\]\([^\)]+\)")
+INLINE_CODE_PATTERN = re.compile(r"`([^`]+)`")
+CODE_BLOCK_PATTERN = re.compile(r"```([\s\S]+?)```")
+IMAGE_PATTERN = re.compile(r"!\[([^\]]*)\]\([^\)]+\)")
+HTML_TAG_PATTERN = re.compile(r"</?[^>]+(>|$)")
+PARAGRAPH_BREAK_PATTERN = re.compile(r"\n{2,}")
+MULTIPLE_SPACES_PATTERN = re.compile(r" {2,}")
+
+# Removing bold/italic markers is a plain character deletion
+EMPHASIS_DELETE_TABLE = str.maketrans('', '', '*_')
+
+# Every emoji contains at least one non-ASCII character from this set (stray variation
+# selectors are removed too). The comparatively slow emoji tokenizer only runs on runs of
+# non-ASCII text (plus the preceding character, which may start a keycap) that contain one.
+EMOJI_CHARS = frozenset(c for e in emoji.EMOJI_DATA for c in e if not c.isascii()) | {'\ufe0e', '\ufe0f'}
+EMOJI_CANDIDATE_PATTERN = re.compile(r"[\x00-\x7f]?[^\x00-\x7f]+")
+
+def _remove_emoji_candidate(match):
+    candidate = match.group()
+    if EMOJI_CHARS.isdisjoint(candidate):
+        return candidate
+    return emoji.replace_emoji(candidate, replace='')
+
+def _replace_header(match):
+    level = len(match.group(1))  # Number of '#' symbols
+    header_text = match.group(2).strip()
+    if level == 1:
+        return f"Title — {header_text}\n"
+    elif level == 2:
+        return f"Section — {header_text}\n"
+    else:
+        return f"Subsection — {header_text}\n"
+
 def prepare_tts_input_with_context(text: str) -> str:
     """
     Prepares text for a TTS API by cleaning Markdown and adding minimal contextual hints
@@ -16,49 +55,153 @@ def prepare_tts_input_with_context(text: str) -> str:
     """
 
     # Remove emojis
-    text = emoji.replace_emoji(text, replace='')
-
-    # Add context for headers
-    def header_replacer(match):
-        level = len(match.group(1))  # Number of '#' symbols
-        header_text = match.group(2).strip()
-        if level == 1:
-            return f"Title — {header_text}\n"
-        elif level == 2:
-            return f"Section — {header_text}\n"
-        else:
-            return f"Subsection — {header_text}\n"
+    with span("text_filter_emoji"):
+        if not text.isascii():
+            text = EMOJI_CANDIDATE_PATTERN.sub(_remove_emoji_candidate, text)
 
-    text = re.sub(r"^(#{1,6})\s+(.*)", header_replacer, text, flags=re.MULTILINE)
+    with span("text_filter_markdown"):
+        # Add context for headers
+        if '#' in text:
+            text = HEADER_PATTERN.sub(_replace_header, text)
 
-    # Announce links (currently commented out for potential future use)
-    # text = re.sub(r"\[([^\]]+)\]\((https?:\/\/[^\)]+)\)", r"\1 (link: \2)", text)
+        # Announce links (currently commented out for potential future use)
+        # text = re.sub(r"\[([^\]]+)\]\((https?:\/\/[^\)]+)\)", r"\1 (link: \2)", text)
 
-    # Remove links while keeping the link text
-    text = re.sub(r"\[([^\]]+)\]\([^\)]+\)", r"\1", text)
+        # Remove links while keeping the link text
+        if '](' in text:
+            text = LINK_PATTERN.sub(r"\1", text)
 
-    # Describe inline code
-    text = re.sub(r"`([^`]+)`", r"code snippet: \1", text)
+        if '`' in text:
+            # Describe inline code
+            text = INLINE_CODE_PATTERN.sub(r"code snippet: \1", text)
 
-    # Remove bold/italic symbols but keep the content
-    text = re.sub(r"(\*\*|__|\*|_)", '', text)
+        # Remove bold/italic symbols but keep the content
+        text = text.translate(EMPHASIS_DELETE_TABLE)
 
-    # Remove code blocks (multi-line) with a description
-    text = re.sub(r"```([\s\S]+?)```", r"(code block omitted)", text)
+        # Remove code blocks (multi-line) with a description
+        if '```' in text:
+            text = CODE_BLOCK_PATTERN.sub(r"(code block omitted)", text)
 
-    # Remove image syntax but add alt text if available
-    text = re.sub(r"!\[([^\]]*)\]\([^\)]+\)", r"Image: \1", text)
+        # Remove image syntax but add alt text if available
+        if '![' in text:
+            text = IMAGE_PATTERN.sub(r"Image: \1", text)
 
-    # Remove HTML tags
-    text = re.sub(r"</?[^>]+(>|$)", '', text)
+        # Remove HTML tags
+        if '<' in text:
+            text = HTML_TAG_PATTERN.sub('', text)
 
     # Normalize line breaks
-    text = re.sub(r"\n{2,}", '\n\n', text)  # Ensure consistent paragraph separation
+    if '\n\n\n' in text:
+        text = PARAGRAPH_BREAK_PATTERN.sub('\n\n', text)  # Ensure consistent paragraph separation
 
     # Replace multiple spaces within lines
-    text = re.sub(r" {2,}", ' ', text)
+    if '  ' in text:
+        text = MULTIPLE_SPACES_PATTERN.sub(' ', text)
 
     # Trim leading and trailing whitespace from the whole text
     text = text.strip()
 
     return text
+
+# Sentence ends: terminal punctuation (optionally followed by closing quotes/brackets) then whitespace
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"(?<=[.!?…。！？])[\"'”’)\]]*\s+")
+SENTENCE_OR_PARAGRAPH_PATTERN = re.compile(f"{SENTENCE_BOUNDARY_PATTERN.pattern}|{PARAGRAPH_BREAK_PATTERN.pattern}")
+
+class IncrementalTextNormalizer:
+    """
+    Normalizes text that arrives in pieces, such as streamed LLM tokens.
+
+    Text is buffered until a paragraph break (two or more newlines) is reached at a
+    point where no Markdown construct is left open, then the completed paragraphs
+    are normalized with prepare_tts_input_with_context and returned. The output is
+    the same as normalizing each of those paragraph blocks separately.
+
+    With by_sentence=True text is released at every sentence end as well, for
+    callers that start speaking as soon as a sentence is complete. normalize
+    replaces prepare_tts_input_with_context (e.g. str.strip when filtering is off).
+    """
+
+    def __init__(self, by_sentence=False, normalize=prepare_tts_input_with_context):
+        self._buffer = ""
+        self._boundary = SENTENCE_OR_PARAGRAPH_PATTERN if by_sentence else PARAGRAPH_BREAK_PATTERN
+        self._normalize = normalize
+
+    def _safe_cut(self, text):
+        """Index just past the last boundary that no pattern can match across, or -1."""
+        for match in reversed(list(self._boundary.finditer(text))):
+            if match.end() == len(text):
+                continue  # More newlines may still arrive
+            prefix = text[:match.start()]
+            if prefix.count('`') % 2:
+                continue  # Inside inline code or a code block
+            if prefix.rfind('[') > prefix.rfind(']') or prefix.rfind('(') > prefix.rfind(')'):
+                continue  # Inside link or image syntax
+            if prefix.rfind('<') > prefix.rfind('>'):
+                continue  # Inside an HTML tag
+            if prefix.rstrip().endswith('#'):
+                continue  # A header marker could still take the next line as its text
+            return match.end()
+        return -1
+
+    def feed(self, text: str) -> str:
+        """Add text and return normalized output for any completed paragraphs (may be '')."""
+        self._buffer += text
+        cut = self._safe_cut(self._buffer)
+        if cut == -1:
+            return ""
+        ready, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        return self._normalize(ready)
+
+    def flush(self) -> str:
+        """Normalize and return whatever text is still buffered."""
+        ready, self._buffer = self._buffer, ""
+        return self._normalize(ready)
+
+def split_sentences(text: str) -> list:
+    """
+    Splits text into sentences at terminal punctuation and paragraph breaks.
+
+    Args:
+        text (str): Text already cleaned by prepare_tts_input_with_context.
+
+    Returns:
+        list: Non-empty sentences, in order, with surrounding whitespace removed.
+    """
+    sentences = []
+    for paragraph in PARAGRAPH_BREAK_PATTERN.split(text):
+        start = 0
+        for match in SENTENCE_BOUNDARY_PATTERN.finditer(paragraph):
+            sentence = paragraph[start:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        sentence = paragraph[start:].strip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+def split_into_segments(text: str, max_chars: int) -> list:
+    """
+    Groups sentences into segments of at most max_chars characters for parallel synthesis.
+
+    Sentences are never split, so a single sentence longer than max_chars becomes its
+    own segment. Joining the segments with spaces reproduces the spoken content of text.
+
+    Args:
+        text (str): Text already cleaned by prepare_tts_input_with_context.
+        max_chars (int): Target maximum length of a segment.
+
+    Returns:
+        list: Segments in reading order.
+    """
+    segments = []
+    current = ""
+    for sentence in split_sentences(text):
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            segments.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        segments.append(current)
+    return segments
@@ -0,0 +1,442 @@
+# jobs.py
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from config import DEFAULT_CONFIGS
+from handle_text import split_into_segments
+from scheduler import AdmissionRejected
+from metrics import REQUESTS
+from tts_handler import FFMPEG_OUTPUT_ARGS, is_ffmpeg_installed, is_known_voice, metric_labels, synthesize_mp3
+from utils import getenv_bool, AUDIO_FORMAT_MIME_TYPES
+import async_bridge
+
+JOBS_ENABLED = getenv_bool('JOBS_ENABLED', DEFAULT_CONFIGS["JOBS_ENABLED"])
+JOBS_DIR = os.getenv('JOBS_DIR', DEFAULT_CONFIGS["JOBS_DIR"]) or os.path.join(tempfile.gettempdir(), 'openai-edge-tts-jobs')
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', str(DEFAULT_CONFIGS["JOBS_WORKERS"])))
+JOBS_TTL = float(os.getenv('JOBS_TTL', str(DEFAULT_CONFIGS["JOBS_TTL"])))
+JOBS_CHUNK_CHARS = int(os.getenv('JOBS_CHUNK_CHARS', str(DEFAULT_CONFIGS["JOBS_CHUNK_CHARS"])))
+JOBS_MAX_CHARS = int(os.getenv('JOBS_MAX_CHARS', str(DEFAULT_CONFIGS["JOBS_MAX_CHARS"])))
+
+DEFAULT_VOICE = os.getenv('DEFAULT_VOICE', DEFAULT_CONFIGS["DEFAULT_VOICE"])
+DEFAULT_RESPONSE_FORMAT = os.getenv('DEFAULT_RESPONSE_FORMAT', DEFAULT_CONFIGS["DEFAULT_RESPONSE_FORMAT"])
+DEFAULT_SPEED = float(os.getenv('DEFAULT_SPEED', str(DEFAULT_CONFIGS["DEFAULT_SPEED"])))
+VALIDATE_VOICES = getenv_bool('VALIDATE_VOICES', DEFAULT_CONFIGS["VALIDATE_VOICES"])
+
+# A running job whose owner has not renewed its lease for this long is taken over
+JOB_LEASE_SECONDS = 300
+LEASE_RENEW_INTERVAL = JOB_LEASE_SECONDS / 5
+POLL_INTERVAL = 2
+SWEEP_INTERVAL = 60
+CHUNK_RETRIES = 3
+
+# Admission key shared by all job chunks, so jobs count against the per-key limit as one client
+JOBS_CLIENT_KEY = 'jobs'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    chunks TEXT NOT NULL,
+    chunks_total INTEGER NOT NULL,
+    voice TEXT NOT NULL,
+    speed REAL NOT NULL,
+    response_format TEXT NOT NULL,
+    chunks_done INTEGER NOT NULL DEFAULT 0,
+    bytes_done INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER,
+    error TEXT,
+    owner TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+FINISHED = ('succeeded', 'failed')
+
+class JobError(ValueError):
+    """The job request is invalid (answered with a 400)."""
+
+class JobStore:
+    """
+    Durable job records in SQLite, with the audio of each job in files beside it.
+
+    Several processes (pre-fork workers) may share the store; a job is claimed with
+    a single conditional UPDATE so only one of them runs it, and the claim is a lease
+    that is renewed with every chunk of progress.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+
+    @property
+    def db(self):
+        # Opened on first use in each process, a connection must not be shared across fork()
+        if self._pid != os.getpid():
+            db = sqlite3.connect(os.path.join(self.directory, 'jobs.db'), check_same_thread=False, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA busy_timeout=5000")
+            db.executescript(SCHEMA)
+            self._migrate(db)
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    @staticmethod
+    def _migrate(db):
+        columns = {row['name'] for row in db.execute("PRAGMA table_info(jobs)")}
+        if 'chunks_total' not in columns:
+            # Stores created before chunks_total was a column
+            try:
+                db.execute("ALTER TABLE jobs ADD COLUMN chunks_total INTEGER NOT NULL DEFAULT 0")
+                db.execute("UPDATE jobs SET chunks_total = json_array_length(chunks)")
+            except sqlite3.OperationalError:
+                pass  # Another worker migrated the store first
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def _update(self, sql, params=()):
+        with self._lock:
+            return self.db.execute(sql, params).rowcount
+
+    def path(self, job_id, response_format):
+        return os.path.join(self.directory, f"{job_id}.{response_format}")
+
+    def part_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.mp3.part")
+
+    def create(self, chunks, voice, speed, response_format):
+        job_id = uuid.uuid4().hex
+        self._update(
+            "INSERT INTO jobs (id, status, chunks, chunks_total, voice, speed, response_format, created_at) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+            (job_id, json.dumps(chunks), len(chunks), voice, speed, response_format, time.time()))
+        return self.get(job_id)
+
+    def get(self, job_id):
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return dict(rows[0]) if rows else None
+
+    def claim(self, owner):
+        """Take the oldest queued job (or one whose lease ran out), or return None."""
+        now = time.time()
+        with self._lock:
+            row = self.db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY created_at LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            claimed = self.db.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, lease_until = ?, started_at = COALESCE(started_at, ?) "
+                "WHERE id = ? AND (status = 'queued' OR (status = 'running' AND lease_until < ?))",
+                (owner, now + JOB_LEASE_SECONDS, now, row['id'], now)).rowcount
+        return self.get(row['id']) if claimed else None
+
+    def requeue_orphans(self, host, boot):
+        """
+        Requeue running jobs of processes on this host that no longer exist (after a restart or crash).
+
+        A job owned by an earlier boot of the server is an orphan even if its PID is in
+        use again, as after a container restart where the server is always PID 1.
+        """
+        for row in self._query("SELECT id, owner FROM jobs WHERE status = 'running'"):
+            owner_host, pid, owner_boot = ((row['owner'] or '').rsplit(':', 2) + ['', ''])[:3]
+            if owner_host == host and (owner_boot != boot or not pid.isdigit() or not _process_alive(int(pid))):
+                self._update("UPDATE jobs SET status = 'queued', owner = NULL WHERE id = ? AND owner = ?", (row['id'], row['owner']))
+
+    def progress(self, job_id, owner, chunks_done, bytes_done):
+        """Record a finished chunk and renew the lease; False if the job was deleted or taken over."""
+        return self._update(
+            "UPDATE jobs SET chunks_done = ?, bytes_done = ?, lease_until = ? WHERE id = ? AND owner = ? AND status = 'running'",
+            (chunks_done, bytes_done, time.time() + JOB_LEASE_SECONDS, job_id, owner)) == 1
+
+    def renew(self, job_id, owner):
+        """Extend the lease of a running job; False if the job was deleted or taken over."""
+        return self._update(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'running'",
+            (time.time() + JOB_LEASE_SECONDS, job_id, owner)) == 1
+
+    def finish(self, job_id, owner, status, response_format=None, size=None, error=None):
+        now = time.time()
+        return self._update(
+            "UPDATE jobs SET status = ?, response_format = COALESCE(?, response_format), bytes = ?, error = ?, "
+            "finished_at = ?, expires_at = ?, lease_until = NULL WHERE id = ? AND owner = ?",
+            (status, response_format, size, error, now, now + JOBS_TTL, job_id, owner)) == 1
+
+    def delete(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return False
+        self._update("DELETE FROM jobs WHERE id = ?", (job_id,))
+        self.remove_files(job)
+        return True
+
+    def remove_files(self, job):
+        for path in (self.path(job['id'], job['response_format']), self.part_path(job['id'])):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def delete_expired(self):
+        rows = self._query("SELECT * FROM jobs WHERE expires_at < ?", (time.time(),))
+        for row in rows:
+            self.delete(row['id'])
+        return len(rows)
+
+    def counts(self):
+        return {row['status']: row['n'] for row in self._query("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def job_status(job):
+    """Public JSON representation of a job record."""
+    chunks_total = job['chunks_total']
+    as_int = lambda t: int(t) if t is not None else None
+    return {
+        "id": job['id'],
+        "object": "speech.job",
+        "status": job['status'],
+        "progress": round(100.0 * job['chunks_done'] / chunks_total, 1) if chunks_total else 100.0,
+        "chunks_done": job['chunks_done'],
+        "chunks_total": chunks_total,
+        "voice": job['voice'],
+        "speed": job['speed'],
+        "response_format": job['response_format'],
+        "bytes": job['bytes'],
+        "error": job['error'],
+        "created_at": as_int(job['created_at']),
+        "started_at": as_int(job['started_at']),
+        "finished_at": as_int(job['finished_at']),
+        "expires_at": as_int(job['expires_at']),
+    }
+
+class JobRunner:
+    """
+    Background worker pool running jobs from a JobStore on the shared event loop.
+
+    Each job's text is split into sentence-aligned chunks when it is submitted. The
+    chunks are synthesized one after another through admission control and appended
+    to a part file, and progress is recorded after each one, so a job interrupted by
+    a restart continues from its last finished chunk. Non-mp3 formats are converted
+    once the mp3 is complete. The lease on a running job is renewed in the background
+    until it finishes, so a slow chunk or conversion is not taken over by another
+    worker. Finished jobs are deleted JOBS_TTL seconds later.
+    """
+
+    def __init__(self, store, workers):
+        self.store = store
+        self.workers = workers
+        self.host = socket.gethostname()
+        self.boot = uuid.uuid4().hex[:12]  # Shared by pre-fork workers, new with every start of the server
+        self._started = False
+        self._wake = None
+        self._tasks = []
+
+    @property
+    def owner(self):
+        return f"{self.host}:{os.getpid()}:{self.boot}"  # Evaluated per call, pre-fork workers inherit the runner
+
+    def submit(self, text, voice, speed, response_format):
+        chunks = split_into_segments(text, JOBS_CHUNK_CHARS) or [text]
+        job = self.store.create(chunks, voice, speed, response_format)
+        self.start()
+        async_bridge.get_loop().call_soon_threadsafe(self._notify)
+        return job
+
+    def _notify(self):
+        if self._wake is not None:
+            self._wake.set()  # Let an idle worker claim the job without waiting for its next poll
+
+    async def _load(self):
+        self._wake = asyncio.Event()
+        await asyncio.to_thread(self.store.requeue_orphans, self.host, self.boot)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep_forever()))
+
+    def start(self):
+        """Start the workers on the shared loop; jobs left over from a previous run are picked up."""
+        if self._started:
+            return
+        self._started = True
+        async_bridge.run(self._load())
+
+    async def start_async(self):
+        """Same as start(), for callers already running on the shared loop."""
+        if self._started:
+            return
+        self._started = True
+        await self._load()
+
+    async def _work(self):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.store.claim, self.owner)
+                if job is None:
+                    self._wake.clear()
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Jobs: worker error: {e}")
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _synthesize_chunk(self, job, text):
+        for attempt in range(CHUNK_RETRIES + 1):
+            try:
+                return await synthesize_mp3(text, job['voice'], job['speed'], JOBS_CLIENT_KEY)
+            except AdmissionRejected as e:
+                await asyncio.sleep(e.retry_after)  # Busy with interactive traffic, wait for a slot
+            except Exception as e:
+                if attempt == CHUNK_RETRIES:
+                    raise
+                print(f"Jobs: chunk of job {job['id']} failed, retrying: {e}")
+                await asyncio.sleep(2 ** attempt)
+        raise RuntimeError("Server stayed too busy to synthesize the job")
+
+    async def _renew_lease(self, job_id, owner):
+        while True:
+            await asyncio.sleep(LEASE_RENEW_INTERVAL)
+            try:
+                if not await asyncio.to_thread(self.store.renew, job_id, owner):
+                    return  # Deleted or taken over; _run finds out when it next records progress
+            except Exception as e:
+                print(f"Jobs: could not renew the lease of job {job_id}: {e}")
+
+    async def _run(self, job):
+        lease = asyncio.create_task(self._renew_lease(job['id'], self.owner))
+        try:
+            await self._run_job(job)
+        finally:
+            lease.cancel()
+
+    async def _lost(self, job):
+        """Clean up after a job that is no longer ours: only its files if it was deleted."""
+        if await asyncio.to_thread(self.store.get, job['id']) is None:
+            self.store.remove_files(job)
+        # Otherwise another worker took it over and the files are its own
+
+    async def _run_job(self, job):
+        job_id, owner = job['id'], self.owner
+        chunks = json.loads(job['chunks'])
+        part_path = self.store.part_path(job_id)
+        bytes_done = job['bytes_done']
+        try:
+            # Drop anything written after the last recorded chunk, then continue from there
+            with open(part_path, 'ab') as part:
+                part.truncate(bytes_done)
+
+            for index in range(job['chunks_done'], len(chunks)):
+                audio = await self._synthesize_chunk(job, chunks[index])
+                await asyncio.to_thread(_append, part_path, audio)
+                bytes_done += len(audio)
+                if not await asyncio.to_thread(self.store.progress, job_id, owner, index + 1, bytes_done):
+                    return await self._lost(job)
+
+            response_format = job['response_format']
+            if response_format in FFMPEG_OUTPUT_ARGS and is_ffmpeg_installed():
+                await _transcode_file(part_path, self.store.path(job_id, response_format), response_format)
+                os.remove(part_path)
+            else:
+                response_format = 'mp3'  # FFmpeg was removed since the job was submitted
+                os.replace(part_path, self.store.path(job_id, response_format))
+            size = os.path.getsize(self.store.path(job_id, response_format))
+            if not await asyncio.to_thread(self.store.finish, job_id, owner, 'succeeded', response_format, size):
+                await self._lost({**job, 'response_format': response_format})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Jobs: job {job_id} failed: {e}")
+            if await asyncio.to_thread(self.store.finish, job_id, owner, 'failed', error=str(e) or type(e).__name__):
+                self.store.remove_files(job)
+            else:
+                await self._lost(job)
+
+    async def _sweep_forever(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.store.delete_expired)
+                await asyncio.to_thread(self.store.requeue_orphans, self.host, self.boot)
+            except Exception as e:
+                print(f"Jobs: cleanup failed: {e}")
+            await asyncio.sleep(SWEEP_INTERVAL)
+
+    def stats(self):
+        counts = self.store.counts()
+        return {"enabled": True, "workers": self.workers, **{status: counts.get(status, 0) for status in ('queued', 'running', *FINISHED)}}
+
+def _append(path, data):
+    with open(path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())  # Progress is recorded only once the chunk is on disk
+
+async def _transcode_file(source, destination, response_format):
+    temp_path = destination + '.tmp'
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "mp3", "-i", source,
+        *FFMPEG_OUTPUT_ARGS[response_format], temp_path,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"FFmpeg error during audio conversion: {stderr.decode('utf-8', 'ignore').strip()}")
+    os.replace(temp_path, destination)
+
+job_runner = JobRunner(JobStore(JOBS_DIR), JOBS_WORKERS) if JOBS_ENABLED else None
+
+def submit_job(data, filter_text):
+    """Validate a job request body (the same fields as /v1/audio/speech) and queue the job."""
+    if not isinstance(data, dict) or not isinstance(data.get('input'), str) or not data['input'].strip():
+        raise JobError("Missing 'input' in request body")
+    if JOBS_MAX_CHARS and len(data['input']) > JOBS_MAX_CHARS:
+        raise JobError(f"Input too long: {len(data['input'])} characters (the limit is {JOBS_MAX_CHARS})")
+    voice = data.get('voice', DEFAULT_VOICE)
+    response_format = data.get('response_format', DEFAULT_RESPONSE_FORMAT)
+    try:
+        speed = float(data.get('speed', DEFAULT_SPEED))
+    except (TypeError, ValueError):
+        raise JobError("Invalid 'speed'") from None
+    if response_format not in AUDIO_FORMAT_MIME_TYPES:
+        raise JobError(f"Unsupported response_format '{response_format}'")
+    if response_format in FFMPEG_OUTPUT_ARGS and not is_ffmpeg_installed():
+        response_format = 'mp3'  # Served unmodified, as by the streaming routes
+    if VALIDATE_VOICES and not is_known_voice(voice):
+        raise JobError(f"Unknown voice '{voice}'")
+    text = filter_text(data['input'])
+    if not text.strip():
+        raise JobError("Nothing to synthesize after text filtering")
+    REQUESTS.inc('job', *metric_labels(response_format, voice))
+    return job_runner.submit(text, voice, speed, response_format)
+
+def get_job_stats():
+    if job_runner is None:
+        return {"enabled": False}
+    return job_runner.stats()
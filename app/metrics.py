@@ -0,0 +1,311 @@
+# metrics.py
+
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from config import DEFAULT_CONFIGS
+from utils import getenv_bool
+from tracing import record_span
+
+METRICS_ENABLED = getenv_bool('METRICS_ENABLED', DEFAULT_CONFIGS["METRICS_ENABLED"])
+
+# Latency buckets in seconds, from fast text filtering up to long syntheses
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def merge(self, values, other):
+        """Add a snapshot from another process into values."""
+        for labelvalues, value in other.items():
+            values[labelvalues] = values.get(labelvalues, 0) + value
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self, values):
+        lines = self.header()
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues, value):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labelvalues] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labelvalues, value):
+        if not METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labelvalues)
+            if series is None:
+                series = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labelvalues, value=time.perf_counter() - started)
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: [list(counts), total] for labels, (counts, total) in self._values.items()}
+
+    def merge(self, values, other):
+        for labelvalues, (counts, total) in other.items():
+            series = values.setdefault(labelvalues, [[0] * (len(self.buckets) + 1), 0.0])
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
+
+    def render(self, values):
+        lines = self.header()
+        for labelvalues, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.store = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Register a callable returning [(name, documentation, {labels tuple: value})] gauges, read at scrape time."""
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        """JSON-serializable values of every metric and collector in this process."""
+        return {
+            "metrics": {
+                metric.name: [[list(labels), value] for labels, value in metric.snapshot().items()]
+                for metric in self.metrics
+            },
+            "collectors": [
+                [name, documentation, [[list(labels), value] for labels, value in values.items()]]
+                for collector in self.collectors
+                for name, documentation, values in collector()
+            ],
+        }
+
+    def render(self):
+        if self.store is not None:
+            return self._render_aggregated()
+
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(metric.snapshot()))
+        for collector in self.collectors:
+            for name, documentation, values in collector():
+                gauge = Gauge(name, documentation)
+                lines.extend(gauge.render(values))
+        return "\n".join(lines) + "\n"
+
+    def _render_aggregated(self):
+        """Render the sum over all worker processes; collector gauges get a worker label."""
+        self.store.write(self.snapshot())  # Make this worker's own values current
+        snapshots = self.store.read_all()
+
+        lines = []
+        for metric in self.metrics:
+            values = {}
+            for worker, snapshot in snapshots:
+                if worker == RETIRED and isinstance(metric, Gauge):
+                    continue  # A stopped worker has nothing in flight
+                entries = snapshot["metrics"].get(metric.name, [])
+                metric.merge(values, {tuple(labels): value for labels, value in entries})
+            lines.extend(metric.render(values))
+
+        gauges = {}
+        for worker, snapshot in snapshots:
+            if worker == RETIRED:
+                continue
+            for name, documentation, entries in snapshot["collectors"]:
+                gauge, values = gauges.setdefault(name, (Gauge(name, documentation, ("worker",)), {}))
+                for labels, value in entries:
+                    values[(worker, *labels)] = value
+        for gauge, values in gauges.values():
+            lines.extend(gauge.render(values))
+        return "\n".join(lines) + "\n"
+
+# Name of the snapshot file holding the totals of workers that have exited
+RETIRED = "retired"
+
+# Seconds between snapshot writes of each worker
+SNAPSHOT_INTERVAL = 2
+
+class SnapshotStore:
+    """
+    Directory of per-worker metric snapshots shared by the processes of a pre-fork server.
+
+    Each worker writes its registry snapshot to <dir>/<worker>.json periodically and
+    before answering a scrape, so any worker can render totals for all of them.
+    """
+
+    def __init__(self, directory, worker=None):
+        self.directory = directory
+        self.worker = worker
+
+    def _path(self, worker):
+        return os.path.join(self.directory, f"{worker}.json")
+
+    def write(self, snapshot, worker=None):
+        worker = worker or self.worker
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, self._path(worker))
+
+    def read(self, worker):
+        try:
+            with open(self._path(worker), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def read_all(self):
+        snapshots = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.json'):
+                snapshot = self.read(name[:-len('.json')])
+                if snapshot is not None:
+                    snapshots.append((name[:-len('.json')], snapshot))
+        return snapshots
+
+    def retire(self, worker, registry):
+        """Fold the counters and histograms of an exited worker into the retired totals."""
+        snapshot = self.read(worker)
+        if snapshot is None:
+            return
+        retired = self.read(RETIRED) or {"metrics": {}, "collectors": []}
+        for metric in registry.metrics:
+            if isinstance(metric, Gauge):
+                continue
+            values = {tuple(labels): value for labels, value in retired["metrics"].get(metric.name, [])}
+            metric.merge(values, {tuple(labels): value for labels, value in snapshot["metrics"].get(metric.name, [])})
+            retired["metrics"][metric.name] = [[list(labels), value] for labels, value in values.items()]
+        self.write(retired, worker=RETIRED)
+        try:
+            os.unlink(self._path(worker))
+        except OSError:
+            pass
+
+    def start_writer(self, registry, interval):
+        """Write this worker's snapshot every interval seconds from a daemon thread."""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write(registry.snapshot())
+                except Exception as e:
+                    print(f"Metrics: could not write snapshot: {e}")
+
+        threading.Thread(target=run, name="metrics-snapshot", daemon=True).start()
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    "tts_requests_total", "Speech requests received.", ("route", "format", "voice")))
+ERRORS = registry.register(Counter(
+    "tts_errors_total", "Speech generation errors by cause (upstream, ffmpeg, validation, admission).", ("cause",)))
+STAGE_SECONDS = registry.register(Histogram(
+    "tts_stage_duration_seconds", "Time spent in each stage of speech generation.", ("stage",)))
+RESPONSE_BYTES = registry.register(Counter(
+    "tts_response_bytes_total", "Audio and event bytes written to clients.", ("route",)))
+RETRIES = registry.register(Counter(
+    "tts_upstream_retries_total", "Upstream sessions retried after a failure or stall, by reason (error, timeout).", ("reason",)))
+HEDGES = registry.register(Counter(
+    "tts_upstream_hedges_total", "Duplicate upstream sessions started for a slow first chunk, and how many answered first.", ("outcome",)))
+FRAGMENTS = registry.register(Counter(
+    "tts_fragment_cache_total", "Sentences of multi-sentence requests found in the fragment cache (hit) or synthesized (miss).", ("result",)))
+IN_FLIGHT = registry.register(Gauge(
+    "tts_requests_in_flight", "Speech requests currently being handled or streamed.", ("route",)))
+
+def observe_stage(stage, seconds):
+    """Record a stage duration in the stage histogram and the current request's trace."""
+    STAGE_SECONDS.observe(stage, value=seconds)
+    record_span(stage, seconds)
+
+@contextmanager
+def time_stage(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+def render_metrics():
+    return registry.render()
+
+def share_metrics(directory, worker, interval=SNAPSHOT_INTERVAL):
+    """Aggregate metrics with the other workers of a pre-fork server (call in the worker)."""
+    registry.store = SnapshotStore(directory, worker)
+    registry.store.write(registry.snapshot())
+    registry.store.start_writer(registry, interval)
@@ -0,0 +1,110 @@
+# mp3_frames.py
+
+# Bitrates in kbps indexed by [MPEG-1 or not][bitrate index] for Layer III
+_LAYER3_BITRATES = {
+    True: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    False: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+# Sample rates in Hz indexed by [version bits][sample rate index]
+_SAMPLE_RATES = {
+    0b11: (44100, 48000, 32000),  # MPEG-1
+    0b10: (22050, 24000, 16000),  # MPEG-2
+    0b00: (11025, 12000, 8000),   # MPEG-2.5
+}
+
+# A silent MPEG-2 Layer III frame in edge-tts's format (24 kHz, 48 kbps, mono): zeroed
+# side information decodes as 576 samples (24 ms) of silence
+SILENT_FRAME = bytes([0xFF, 0xF3, 0x64, 0xC0]) + bytes(140)
+SILENT_FRAME_MS = 24
+
+def silent_frames(milliseconds):
+    """Whole silent frames lasting about the given number of milliseconds."""
+    return SILENT_FRAME * round(milliseconds / SILENT_FRAME_MS)
+
+def parse_frame_header(header):
+    """
+    Parse a 4-byte MPEG audio Layer III frame header.
+
+    Returns (frame_length, samples_per_frame, sample_rate), or None if the bytes
+    are not a valid Layer III header.
+    """
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+
+    version = (header[1] >> 3) & 0b11
+    layer = (header[1] >> 1) & 0b11
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0b11
+    padding = (header[2] >> 1) & 0b1
+
+    if version not in _SAMPLE_RATES or layer != 0b01:
+        return None
+    if bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    is_mpeg1 = version == 0b11
+    bitrate = _LAYER3_BITRATES[is_mpeg1][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    samples_per_frame = 1152 if is_mpeg1 else 576
+
+    frame_length = (samples_per_frame // 8) * bitrate // sample_rate + padding
+    return frame_length, samples_per_frame, sample_rate
+
+def _is_info_frame(frame):
+    """Xing/Info/VBRI frames carry stream metadata and must not appear mid-stream."""
+    return b"Xing" in frame[:64] or b"Info" in frame[:64] or b"VBRI" in frame[:64]
+
+class Mp3FrameAligner:
+    """
+    Incrementally splits an mp3 byte stream into whole frames.
+
+    Chunks from edge-tts do not necessarily end on frame boundaries. Feeding them
+    through an aligner yields only complete frames, drops ID3 tags and Xing/Info
+    headers, and discards any trailing partial frame, so the output of several
+    aligners can be concatenated into one valid stream.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._first_frame = True
+
+    def feed(self, chunk):
+        """Add a chunk and return the complete frames now available (possibly b"")."""
+        self._buffer += chunk
+        buffer = self._buffer
+        frames = bytearray()
+        position = 0
+
+        while True:
+            if buffer[position:position + 3] == b"ID3":
+                # ID3v2 tag: 10-byte header with a syncsafe size
+                if len(buffer) - position < 10:
+                    break
+                size = (buffer[position + 6] << 21) | (buffer[position + 7] << 14) | (buffer[position + 8] << 7) | buffer[position + 9]
+                if len(buffer) - position < 10 + size:
+                    break
+                position += 10 + size
+                continue
+
+            parsed = parse_frame_header(buffer[position:position + 4])
+            if parsed is None:
+                if len(buffer) - position < 4:
+                    break
+                # Not at a frame boundary, resync on the next possible header
+                next_sync = buffer.find(b"\xff", position + 1)
+                position = next_sync if next_sync != -1 else len(buffer)
+                continue
+
+            frame_length = parsed[0]
+            if len(buffer) - position < frame_length:
+                break
+
+            frame = buffer[position:position + frame_length]
+            if not (self._first_frame and _is_info_frame(frame)):
+                frames += frame
+            self._first_frame = False
+            position += frame_length
+
+        del buffer[:position]
+        return bytes(frames)
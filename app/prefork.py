@@ -0,0 +1,163 @@
+# prefork.py
+
+import os
+import signal
+import socket
+import sys
+import shutil
+import tempfile
+import threading
+import time
+
+import metrics
+
+# A worker that exits sooner than this after starting is considered crash-looping
+MIN_WORKER_LIFETIME = 1.0
+MAX_RESTART_DELAY = 30.0
+
+class Supervisor:
+    """
+    Pre-fork process supervisor.
+
+    Binds the listening socket once, then forks workers that all accept on the
+    inherited socket. Workers that exit unexpectedly are replaced, with an increasing
+    delay while they keep crashing on startup. On SIGTERM or SIGINT every worker is
+    asked to drain (stop accepting, finish in-flight requests) and is killed if it
+    has not exited after the graceful timeout.
+
+    serve(listener, worker) runs in each child with the listening socket and the
+    worker's slot number, and should return once the worker has drained.
+    """
+
+    def __init__(self, address, workers, serve, graceful_timeout=30, backlog=2048):
+        self.address = address
+        self.workers = workers
+        self.serve = serve
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+
+        self.listener = None
+        self.metrics_dir = None
+        self.children = {}  # pid -> slot
+        self.started_at = {}  # slot -> time the current worker was forked
+        self.restart_delay = {}  # slot -> seconds to wait before the next restart
+        self.stopping = False
+
+    def _bind(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(self.address)
+        listener.listen(self.backlog)
+        listener.set_inheritable(True)
+        return listener
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = slot
+            self.started_at[slot] = time.monotonic()
+            return
+
+        # Child: let the parent decide when to stop, then serve until drained
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            self._watch_parent(os.getppid())
+            metrics.share_metrics(self.metrics_dir, str(slot))
+            self.serve(self.listener, slot)
+        except BaseException as e:
+            print(f"Worker {slot} (pid {os.getpid()}) failed: {e}")
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+    @staticmethod
+    def _watch_parent(parent_pid):
+        """Drain this worker if the supervisor dies without stopping it."""
+        def run():
+            while os.getppid() == parent_pid:
+                time.sleep(1)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        threading.Thread(target=run, name="parent-watch", daemon=True).start()
+
+    def _handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def _reap(self):
+        """Collect exited workers, returning the slots that need a new one."""
+        slots = []
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            slot = self.children.pop(pid, None)
+            if slot is None:
+                continue
+            metrics.registry.store.retire(str(slot), metrics.registry)
+            if not self.stopping:
+                print(f"Worker {slot} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+                slots.append(slot)
+        return slots
+
+    def _restart(self, slot):
+        lifetime = time.monotonic() - self.started_at.get(slot, 0)
+        if lifetime < MIN_WORKER_LIFETIME:
+            delay = self.restart_delay[slot] = min(MAX_RESTART_DELAY, max(1.0, self.restart_delay.get(slot, 0) * 2))
+            time.sleep(delay)
+        else:
+            self.restart_delay[slot] = 0
+        if not self.stopping:
+            self._spawn(slot)
+
+    def _stop_workers(self):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+
+        for pid in list(self.children):
+            print(f"Worker {self.children[pid]} (pid {pid}) did not drain in time, killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while self.children:
+            self._reap()
+            time.sleep(0.05)
+
+    def run(self):
+        self.listener = self._bind()
+        self.metrics_dir = tempfile.mkdtemp(prefix='openai-edge-tts-metrics-')
+        metrics.registry.store = metrics.SnapshotStore(self.metrics_dir)
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+
+        try:
+            for slot in range(self.workers):
+                self._spawn(slot)
+            print(f" * Supervisor (pid {os.getpid()}) started {self.workers} workers")
+
+            while not self.stopping:
+                for slot in self._reap():
+                    self._restart(slot)
+                time.sleep(0.2)
+
+            print(" * Shutting down, draining workers")
+            self._stop_workers()
+        finally:
+            self.listener.close()
+            shutil.rmtree(self.metrics_dir, ignore_errors=True)
@@ -0,0 +1,195 @@
+# scheduler.py
+
+import asyncio
+import itertools
+import math
+import os
+import time
+
+from config import DEFAULT_CONFIGS
+from tracing import record_span
+
+MAX_CONCURRENT_SYNTHESIS = int(os.getenv('MAX_CONCURRENT_SYNTHESIS', str(DEFAULT_CONFIGS["MAX_CONCURRENT_SYNTHESIS"])))
+MAX_CONCURRENT_PER_KEY = int(os.getenv('MAX_CONCURRENT_PER_KEY', str(DEFAULT_CONFIGS["MAX_CONCURRENT_PER_KEY"])))
+MAX_QUEUE_SIZE = int(os.getenv('MAX_QUEUE_SIZE', str(DEFAULT_CONFIGS["MAX_QUEUE_SIZE"])))
+QUEUE_TIMEOUT = float(os.getenv('QUEUE_TIMEOUT', str(DEFAULT_CONFIGS["QUEUE_TIMEOUT"])))
+
+# How many characters of input a request "earns" per second spent waiting. Short inputs
+# are admitted first, but a long input that has waited long enough overtakes them.
+AGING_CHARS_PER_SECOND = 500
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; carries the HTTP status and Retry-After."""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class _Waiter:
+    __slots__ = ("client_key", "cost", "slots", "enqueued_at", "seq", "future")
+
+    def __init__(self, client_key, cost, slots, seq, future):
+        self.client_key = client_key
+        self.cost = cost
+        self.slots = slots
+        self.enqueued_at = time.monotonic()
+        self.seq = seq
+        self.future = future
+
+    def priority(self, now):
+        # Lower is better; ties go to the earliest arrival
+        return (self.cost - (now - self.enqueued_at) * AGING_CHARS_PER_SECOND, self.seq)
+
+class Scheduler:
+    """
+    Admission control for upstream synthesis.
+
+    Caps the number of concurrent upstream sessions globally and per client key. A
+    request is admitted with one slot per session it may run at once (a long input
+    synthesized as parallel segments takes several), all granted together, so it is
+    rejected before any audio is sent rather than halfway through. Requests over the
+    cap wait in a bounded queue, where short inputs go first and waiting time
+    gradually raises the priority of long ones. A full queue rejects immediately with
+    429, and a request that waits longer than the queue timeout is rejected with 503.
+    A cap of 0 disables that limit. Must only be used from the shared event loop.
+    """
+
+    def __init__(self, max_concurrent, max_per_key, max_queue, queue_timeout):
+        self.max_concurrent = max_concurrent
+        self.max_per_key = max_per_key
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.active = 0
+        self.active_by_key = {}
+        self.waiters = []
+        self._seq = itertools.count()
+
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._service_time = 1.0  # Moving average of seconds a slot is held
+
+    def _slots(self, slots):
+        """Clamp a slot count to the caps, so that every request can be admitted eventually."""
+        for cap in (self.max_concurrent, self.max_per_key):
+            if cap:
+                slots = min(slots, cap)
+        return max(1, slots)
+
+    def _key_has_capacity(self, client_key, slots):
+        return not (self.max_per_key and client_key is not None
+                    and self.active_by_key.get(client_key, 0) + slots > self.max_per_key)
+
+    def _has_capacity(self, client_key, slots=1):
+        if self.max_concurrent and self.active + slots > self.max_concurrent:
+            return False
+        return self._key_has_capacity(client_key, slots)
+
+    def _grant(self, client_key, slots, waited):
+        self.active += slots
+        self.active_by_key[client_key] = self.active_by_key.get(client_key, 0) + slots
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return (client_key, slots, time.monotonic())
+
+    def _retry_after(self):
+        slots = self.max_concurrent or max(1, self.active)
+        return max(1, math.ceil(self._service_time * (len(self.waiters) + 1) / slots))
+
+    async def acquire(self, client_key, cost, slots=1):
+        """Wait for slots for up to slots concurrent sessions and return a ticket to pass to release()."""
+        slots = self._slots(slots)
+        if not self.waiters and self._has_capacity(client_key, slots):
+            return self._grant(client_key, slots, 0.0)
+
+        if self.max_queue and len(self.waiters) >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected("Server is busy, too many queued requests", 429, self._retry_after())
+
+        waiter = _Waiter(client_key, cost, slots, next(self._seq), asyncio.get_running_loop().create_future())
+        self.waiters.append(waiter)
+        self._dispatch()  # The queue may have been blocked only by other keys' caps
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout or None)
+        except asyncio.TimeoutError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                return waiter.future.result()  # Granted at the last moment
+            self.rejected_timeout += 1
+            raise AdmissionRejected("Timed out waiting in the request queue", 503, self._retry_after()) from None
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(waiter.future.result())
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            if not waiter.future.done():
+                waiter.future.cancel()
+            record_span("queue_wait", time.monotonic() - waiter.enqueued_at)
+
+    def try_acquire(self):
+        """
+        Take one spare slot for an extra session (a hedge) without waiting, or return
+        None. Only the global cap applies, and queued requests always go first.
+        """
+        if self.waiters or not self._has_capacity(None):
+            return None
+        self.active += 1
+        self.active_by_key[None] = self.active_by_key.get(None, 0) + 1
+        return (None, 1, time.monotonic())
+
+    def release(self, ticket):
+        client_key, slots, granted_at = ticket
+        self.active -= slots
+        remaining = self.active_by_key.get(client_key, slots) - slots
+        if remaining:
+            self.active_by_key[client_key] = remaining
+        else:
+            self.active_by_key.pop(client_key, None)
+        self._service_time = 0.9 * self._service_time + 0.1 * (time.monotonic() - granted_at)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Grant free slots to the best eligible waiters."""
+        while self.waiters:
+            now = time.monotonic()
+            eligible = [w for w in self.waiters if self._key_has_capacity(w.client_key, w.slots)]
+            if not eligible:
+                return
+            waiter = min(eligible, key=lambda w: w.priority(now))
+            if not self._has_capacity(waiter.client_key, waiter.slots):
+                return  # Free slots are held for it, so requests needing several are not starved
+            self.waiters.remove(waiter)
+            waiter.future.set_result(self._grant(waiter.client_key, waiter.slots, now - waiter.enqueued_at))
+
+    async def admit_stream(self, client_key, cost, chunks, slots=1):
+        """Hold slots for slots concurrent sessions for as long as the async iterable chunks is being consumed."""
+        ticket = await self.acquire(client_key, cost, slots)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "active": self.active,
+            "queued": len(self.waiters),
+            "oldest_wait_seconds": round(max((now - w.enqueued_at for w in self.waiters), default=0.0), 3),
+            "max_concurrent": self.max_concurrent,
+            "max_per_key": self.max_per_key,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_wait_seconds": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+            "max_wait_seconds": round(self.max_wait, 4),
+        }
+
+scheduler = Scheduler(MAX_CONCURRENT_SYNTHESIS, MAX_CONCURRENT_PER_KEY, MAX_QUEUE_SIZE, QUEUE_TIMEOUT)
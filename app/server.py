@@ -1,23 +1,41 @@
 # server.py
 
-from flask import Flask, request, send_file, jsonify, Response
+from flask import Flask, request, jsonify, Response, send_file
 from gevent.pywsgi import WSGIServer
 from dotenv import load_dotenv
 import os
+import signal
 import traceback
-import json
-import base64
+import time
+from functools import wraps
 
 from config import DEFAULT_CONFIGS
 from handle_text import prepare_tts_input_with_context
-from tts_handler import generate_speech, generate_speech_stream, get_models_formatted, get_voices, get_voices_formatted
-from utils import getenv_bool, require_api_key, AUDIO_FORMAT_MIME_TYPES, DETAILED_ERROR_LOGGING
+from tts_handler import (FFMPEG_OUTPUT_ARGS, generate_speech_stream, generate_speech_stream_async, generate_ssml_stream,
+                         generate_timed_speech_stream_async, get_models_formatted, get_voices, get_voices_formatted,
+                         is_ffmpeg_installed, is_known_voice, metric_labels, speed_to_rate)
+from ssml import Segment as SsmlSegment, SsmlError, output_format as ssml_output_format, parse_ssml
+from voice_catalog import VoiceCatalogUnavailable, voice_catalog
+from scheduler import AdmissionRejected
+from stats import component_stats
+from fragment_cache import track_fragments
+from batch import BatchError, prepare_batch, ndjson_stream, zip_stream
+from jobs import JobError, job_runner, job_status, submit_job
+from warmup import warmup
+import async_bridge
+from sse import (FRAMED_HEADERS, SSE_HEADERS, audio_delta_event, audio_done_event, audio_done_payload, audio_frame,
+                 coalesce_chunks, error_event, error_payload, event_frame, word_event, word_payload)
+from metrics import ERRORS, IN_FLIGHT, REQUESTS, RESPONSE_BYTES, observe_stage, render_metrics, time_stage
+from tracing import annotate, finish_trace, start_trace
+from utils import getenv_bool, get_client_key, require_api_key, AUDIO_FORMAT_MIME_TYPES, DETAILED_ERROR_LOGGING
 
 app = Flask(__name__)
 load_dotenv()
 
 API_KEY = os.getenv('API_KEY', DEFAULT_CONFIGS["API_KEY"])
 PORT = int(os.getenv('PORT', str(DEFAULT_CONFIGS["PORT"])))
+WORKERS = int(os.getenv('WORKERS', str(DEFAULT_CONFIGS["WORKERS"])))
+GRACEFUL_TIMEOUT = float(os.getenv('GRACEFUL_TIMEOUT', str(DEFAULT_CONFIGS["GRACEFUL_TIMEOUT"])))
 
 DEFAULT_VOICE = os.getenv('DEFAULT_VOICE', DEFAULT_CONFIGS["DEFAULT_VOICE"])
 DEFAULT_RESPONSE_FORMAT = os.getenv('DEFAULT_RESPONSE_FORMAT', DEFAULT_CONFIGS["DEFAULT_RESPONSE_FORMAT"])
@@ -25,111 +43,209 @@ DEFAULT_SPEED = float(os.getenv('DEFAULT_SPEED', str(DEFAULT_CONFIGS["DEFAULT_SP
 
 REMOVE_FILTER = getenv_bool('REMOVE_FILTER', DEFAULT_CONFIGS["REMOVE_FILTER"])
 EXPAND_API = getenv_bool('EXPAND_API', DEFAULT_CONFIGS["EXPAND_API"])
+VALIDATE_VOICES = getenv_bool('VALIDATE_VOICES', DEFAULT_CONFIGS["VALIDATE_VOICES"])
 
 # DEFAULT_MODEL = os.getenv('DEFAULT_MODEL', 'tts-1')
 
 # Currently in "beta" — needs more extensive testing where drop-in replacement warranted
-def generate_sse_audio_stream(text, voice, speed):
+def generate_sse_audio_stream(text, audio_stream):
     """Generator function for SSE streaming with JSON events."""
     try:
-        # Generate streaming audio chunks and convert to SSE format
-        for chunk in generate_speech_stream(text, voice, speed):
-            # Base64 encode the audio chunk
-            encoded_audio = base64.b64encode(chunk).decode('utf-8')
-            
-            # Create SSE event for audio delta
-            event_data = {
-                "type": "speech.audio.delta",
-                "audio": encoded_audio
-            }
-            
-            # Format as SSE event
-            yield f"data: {json.dumps(event_data)}\n\n"
-        
+        # Convert streaming audio chunks (and word timings) to SSE format
+        for chunk in audio_stream:
+            yield audio_delta_event(chunk) if isinstance(chunk, bytes) else word_event(chunk)
+
         # Send completion event
-        completion_event = {
-            "type": "speech.audio.done",
-            "usage": {
-                "input_tokens": len(text.split()),  # Rough estimate
-                "output_tokens": 0,  # Edge TTS doesn't provide this
-                "total_tokens": len(text.split())
-            }
-        }
-        yield f"data: {json.dumps(completion_event)}\n\n"
-        
+        yield audio_done_event(text)
+
     except Exception as e:
         print(f"Error during SSE streaming: {e}")
         # Send error event
-        error_event = {
-            "type": "error",
-            "error": str(e)
-        }
-        yield f"data: {json.dumps(error_event)}\n\n"
+        yield error_event(e)
+
+def generate_framed_audio_stream(text, audio_stream):
+    """Generator function for binary framed streaming: raw audio frames, JSON event frames."""
+    try:
+        for chunk in audio_stream:
+            yield audio_frame(chunk) if isinstance(chunk, bytes) else event_frame(word_payload(chunk))
+        yield event_frame(audio_done_payload(text))
+    except Exception as e:
+        print(f"Error during framed streaming: {e}")
+        yield event_frame(error_payload(e))
+
+def prime_audio_stream(audio_stream):
+    """
+    Wait for the first chunk of an audio stream before a response is started, so that
+    upstream failures and admission rejections still produce an error response.
+    """
+    first_chunk = next(audio_stream, b"")
+
+    def primed_stream():
+        yield first_chunk
+        yield from audio_stream  # Also forwards close() when the client disconnects
+
+    return primed_stream()
+
+def audio_stream_response(audio_stream, mime_type, download_name=None):
+    """Build a chunked audio response from a generator of audio chunks."""
+    audio_stream = prime_audio_stream(audio_stream)
+
+    headers = {
+        'Content-Type': mime_type,
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Disable nginx buffering
+    }
+    if download_name:
+        headers['Content-Disposition'] = f'attachment; filename={download_name}'
+
+    return Response(audio_stream, mimetype=mime_type, headers=headers)
+
+def filter_text(text):
+    """Clean Markdown and emoji from the input unless the filter is disabled."""
+    if REMOVE_FILTER:
+        return text
+    with time_stage("text_filter"):
+        return prepare_tts_input_with_context(text)
+
+def _metered_body(route, body, trace, status):
+    started = time.perf_counter()
+    sent = 0
+    try:
+        for chunk in body:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        observe_stage("response_write", time.perf_counter() - started)
+        RESPONSE_BYTES.inc(route, amount=sent)
+        IN_FLIGHT.dec(route)
+        if trace is not None:
+            finish_trace(trace, status, sent)
+
+def metered(route):
+    """
+    Track in-flight requests, bytes written and rejected requests for a speech route,
+    and trace the request when tracing is on.
+
+    Streamed responses stay in flight until their body has been fully written. Their
+    Server-Timing header covers the stages finished before the first chunk; the
+    trace written to the trace file covers the whole response.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            IN_FLIGHT.inc(route)
+            trace = start_trace(route)
+            try:
+                response = app.make_response(f(*args, **kwargs))
+            except BaseException:
+                IN_FLIGHT.dec(route)
+                if trace is not None:
+                    finish_trace(trace, 500)
+                raise
+
+            if response.status_code == 400:
+                ERRORS.inc("validation")
+            elif response.status_code in (429, 503):
+                ERRORS.inc("admission")
+
+            if trace is not None:
+                response.headers['Server-Timing'] = trace.server_timing()
+                response.headers['X-Trace-Id'] = trace.id
+
+            if response.is_streamed:
+                response.response = _metered_body(route, response.response, trace, response.status_code)
+            else:
+                RESPONSE_BYTES.inc(route, amount=response.content_length or 0)
+                IN_FLIGHT.dec(route)
+                if trace is not None:
+                    finish_trace(trace, response.status_code, response.content_length or 0)
+            return response
+        return decorated_function
+    return decorator
+
+def admission_rejected_response(e):
+    return jsonify({"error": str(e)}), e.status_code, {'Retry-After': str(e.retry_after)}
+
+class RequestError(ValueError):
+    """A speech request that cannot be served as sent (answered with a 400)."""
+
+def parse_speech_request(data):
+    """
+    Validate the body of an OpenAI speech request and return its settings as a dict.
+
+    Shared with the native speech route in asgi.py. Raises RequestError for a 400.
+    """
+    if not data or 'input' not in data:
+        raise RequestError("Missing 'input' in request body")
+
+    text = data.get('input')
+
+    text = filter_text(text)
+
+    # model = data.get('model', DEFAULT_MODEL)
+    voice = data.get('voice', DEFAULT_VOICE)
+    response_format = data.get('response_format', DEFAULT_RESPONSE_FORMAT)
+    speed = float(data.get('speed', DEFAULT_SPEED))
+
+    if VALIDATE_VOICES and not is_known_voice(voice):
+        raise RequestError(f"Unknown voice '{voice}'")
+
+    # Check stream format - "sse" and "binary" stream events
+    stream_format = data.get('stream_format', 'audio')  # 'audio' (default), 'sse' or 'binary'
+
+    annotate(voice=voice, response_format=response_format, stream_format=stream_format, chars=len(text))
+    REQUESTS.inc('speech', *metric_labels(response_format, voice))
+
+    return {
+        "text": text,
+        "voice": voice,
+        "response_format": response_format,
+        "speed": speed,
+        "stream_format": stream_format,
+        "timestamps": bool(data.get('timestamps')),
+        "mime_type": AUDIO_FORMAT_MIME_TYPES.get(response_format, "audio/mpeg"),
+    }
 
 # OpenAI endpoint format
 @app.route('/v1/audio/speech', methods=['POST'])
 @app.route('/audio/speech', methods=['POST'])  # Add this line for the alias
 @require_api_key
+@metered('speech')
 def text_to_speech():
     try:
-        data = request.json
-        if not data or 'input' not in data:
-            return jsonify({"error": "Missing 'input' in request body"}), 400
-
-        text = data.get('input')
+        speech = parse_speech_request(request.json)
+        text, voice, speed = speech['text'], speech['voice'], speech['speed']
+        fragments = track_fragments()  # Filled in by the cache lookups made before the first chunk
+        
+        if speech['stream_format'] in ('sse', 'binary'):
+            # mp3 chunks, merged into fewer events, with word timings if asked for
+            if speech['timestamps']:
+                events = generate_timed_speech_stream_async(text, voice, speed, client_key=get_client_key())
+            else:
+                events = generate_speech_stream_async(text, voice, speed, client_key=get_client_key())
+            audio_stream = prime_audio_stream(async_bridge.iterate(coalesce_chunks(events)))
 
-        if not REMOVE_FILTER:
-            text = prepare_tts_input_with_context(text)
+            if speech['stream_format'] == 'binary':
+                return Response(generate_framed_audio_stream(text, audio_stream), headers={**FRAMED_HEADERS, **fragments.headers()})
 
-        # model = data.get('model', DEFAULT_MODEL)
-        voice = data.get('voice', DEFAULT_VOICE)
-        response_format = data.get('response_format', DEFAULT_RESPONSE_FORMAT)
-        speed = float(data.get('speed', DEFAULT_SPEED))
-        
-        # Check stream format - only "sse" triggers streaming
-        stream_format = data.get('stream_format', 'audio')  # 'audio' (default) or 'sse'
-        
-        mime_type = AUDIO_FORMAT_MIME_TYPES.get(response_format, "audio/mpeg")
-        
-        if stream_format == 'sse':
             # Return SSE streaming response with JSON events
             def generate_sse():
-                for event in generate_sse_audio_stream(text, voice, speed):
+                for event in generate_sse_audio_stream(text, audio_stream):
                     yield event
             
-            return Response(
-                generate_sse(),
-                mimetype='text/event-stream',
-                headers={
-                    'Content-Type': 'text/event-stream',
-                    'Cache-Control': 'no-cache',
-                    'Connection': 'keep-alive',
-                    'X-Accel-Buffering': 'no'  # Disable nginx buffering
-                }
-            )
+            return Response(generate_sse(), mimetype='text/event-stream', headers={**SSE_HEADERS, **fragments.headers()})
         else:
-            # Return raw audio data (like OpenAI) - can be piped to ffplay
-            output_file_path = generate_speech(text, voice, response_format, speed)
-            
-            # Read the file and return raw audio data
-            with open(output_file_path, 'rb') as audio_file:
-                audio_data = audio_file.read()
-            
-            # Clean up the temporary file
-            try:
-                os.unlink(output_file_path)
-            except OSError:
-                pass  # File might already be cleaned up
-            
-            return Response(
-                audio_data,
-                mimetype=mime_type,
-                headers={
-                    'Content-Type': mime_type,
-                    'Content-Length': str(len(audio_data))
-                }
-            )
+            # Return raw audio data (like OpenAI) - can be piped to ffplay.
+            # Chunks are forwarded as they are synthesized (and transcoded, for non-mp3 formats).
+            audio_stream = generate_speech_stream(text, voice, speed, speech['response_format'], client_key=get_client_key())
+            response = audio_stream_response(audio_stream, speech['mime_type'])
+            response.headers.update(fragments.headers())
+            return response
             
+    except RequestError as e:
+        return jsonify({"error": str(e)}), 400
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
     except Exception as e:
         if DETAILED_ERROR_LOGGING:
             app.logger.error(f"Error in text_to_speech: {str(e)}\n{traceback.format_exc()}")
@@ -138,6 +254,64 @@ def text_to_speech():
         # Return a 500 error for unhandled exceptions, which is more standard than 400
         return jsonify({"error": "An internal server error occurred", "details": str(e)}), 500
 
+# Batch of short clips in one request, streamed back as each item completes
+@app.route('/v1/audio/speech/batch', methods=['POST'])
+@app.route('/audio/speech/batch', methods=['POST'])
+@require_api_key
+@metered('batch')
+def batch_text_to_speech():
+    try:
+        items, stream_format = prepare_batch(request.json, filter_text)
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+
+    client_key = get_client_key()
+    if stream_format == 'zip':
+        body = async_bridge.iterate(zip_stream(items, client_key))
+        return Response(body, mimetype='application/zip', headers={'Content-Disposition': 'attachment; filename=speech.zip'})
+    body = async_bridge.iterate(ndjson_stream(items, client_key))
+    return Response(body, mimetype='application/x-ndjson', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Long inputs as background jobs: submit, poll for progress, then fetch the audio
+@app.route('/v1/audio/speech/jobs', methods=['POST'])
+@app.route('/audio/speech/jobs', methods=['POST'])
+@require_api_key
+@metered('jobs')
+def create_speech_job():
+    if job_runner is None:
+        return jsonify({"error": "Jobs are disabled"}), 404
+    try:
+        job = submit_job(request.json, filter_text)
+    except JobError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(job_status(job)), 202, {'Location': f"/v1/audio/speech/jobs/{job['id']}"}
+
+@app.route('/v1/audio/speech/jobs/<job_id>', methods=['GET', 'DELETE'])
+@app.route('/audio/speech/jobs/<job_id>', methods=['GET', 'DELETE'])
+@require_api_key
+def speech_job(job_id):
+    job = job_runner.store.get(job_id) if job_runner is not None else None
+    if job is None:
+        return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+    if request.method == 'DELETE':
+        job_runner.store.delete(job_id)
+        return jsonify({"id": job_id, "object": "speech.job", "deleted": True})
+    return jsonify(job_status(job))
+
+@app.route('/v1/audio/speech/jobs/<job_id>/content', methods=['GET'])
+@app.route('/audio/speech/jobs/<job_id>/content', methods=['GET'])
+@require_api_key
+def speech_job_content(job_id):
+    job = job_runner.store.get(job_id) if job_runner is not None else None
+    if job is None:
+        return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+    if job['status'] != 'succeeded':
+        return jsonify({"error": f"Job is {job['status']}", "job": job_status(job)}), 409
+    # conditional=True answers Range and If-Range requests with 206 / 416
+    return send_file(job_runner.store.path(job_id, job['response_format']),
+                     mimetype=AUDIO_FORMAT_MIME_TYPES[job['response_format']], conditional=True,
+                     download_name=f"speech.{job['response_format']}")
+
 # OpenAI endpoint format
 @app.route('/v1/models', methods=['GET', 'POST'])
 @app.route('/models', methods=['GET', 'POST'])
@@ -152,6 +326,11 @@ def list_models():
 def list_voices_formatted():
     return jsonify({"voices": get_voices_formatted()})
 
+# Before the first voice list has loaded (no snapshot and edge-tts unreachable)
+@app.errorhandler(VoiceCatalogUnavailable)
+def voice_catalog_unavailable(e):
+    return jsonify({"error": str(e)}), 503, {'Retry-After': '5'}
+
 @app.route('/v1/voices', methods=['GET', 'POST'])
 @app.route('/voices', methods=['GET', 'POST'])
 @require_api_key
@@ -162,7 +341,7 @@ def list_voices():
     if data and ('language' in data or 'locale' in data):
         specific_language = data.get('language') if 'language' in data else data.get('locale')
 
-    return jsonify({"voices": get_voices(specific_language)})
+    return jsonify({"voices": get_voices(specific_language, data.get('gender') if data else None)})
 
 @app.route('/v1/voices/all', methods=['GET', 'POST'])
 @app.route('/voices/all', methods=['GET', 'POST'])
@@ -170,6 +349,23 @@ def list_voices():
 def list_all_voices():
     return jsonify({"voices": get_voices('all')})
 
+@app.route('/v1/stats', methods=['GET'])
+@app.route('/stats', methods=['GET'])
+@require_api_key
+def stats():
+    return jsonify(component_stats())
+
+@app.route('/metrics', methods=['GET'])
+@require_api_key
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Readiness for load balancers: 503 until the warmup phrases are pinned (no API key: it only reports counts)
+@app.route('/v1/ready', methods=['GET'])
+@app.route('/ready', methods=['GET'])
+def ready():
+    return jsonify(warmup.status()), 200 if warmup.ready else 503
+
 """
 Support for ElevenLabs and Azure AI Speech
     (currently in beta)
@@ -179,6 +375,7 @@ Support for ElevenLabs and Azure AI Speech
 # http://localhost:5050/elevenlabs/v1/text-to-speech/en-US-AndrewNeural
 @app.route('/elevenlabs/v1/text-to-speech/<voice_id>', methods=['POST'])
 @require_api_key
+@metered('elevenlabs')
 def elevenlabs_tts(voice_id):
     if not EXPAND_API:
         return jsonify({"error": f"Endpoint not allowed"}), 500
@@ -193,70 +390,107 @@ def elevenlabs_tts(voice_id):
 
     text = payload['text']
 
-    if not REMOVE_FILTER:
-        text = prepare_tts_input_with_context(text)
+    text = filter_text(text)
 
     voice = voice_id  # ElevenLabs uses the voice_id in the URL
 
+    if VALIDATE_VOICES and not is_known_voice(voice):
+        return jsonify({"error": f"Unknown voice '{voice}'"}), 400
+
     # Use default settings for edge-tts
     response_format = 'mp3'
     speed = DEFAULT_SPEED  # Optional customization via payload.get('speed', DEFAULT_SPEED)
 
+    REQUESTS.inc('elevenlabs', *metric_labels(response_format, voice))
+
     # Generate speech using edge-tts
     try:
-        output_file_path = generate_speech(text, voice, response_format, speed)
+        audio_stream = generate_speech_stream(text, voice, speed, response_format, client_key=get_client_key())
+        # Return the generated audio file, streamed as it is synthesized
+        return audio_stream_response(audio_stream, "audio/mpeg", download_name="speech.mp3")
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
     except Exception as e:
         return jsonify({"error": f"TTS generation failed: {str(e)}"}), 500
 
-    # Return the generated audio file
-    return send_file(output_file_path, mimetype="audio/mpeg", as_attachment=True, download_name="speech.mp3")
-
 # tts.speech.microsoft.com/cognitiveservices/v1
 # https://{region}.tts.speech.microsoft.com/cognitiveservices/v1
 # http://localhost:5050/azure/cognitiveservices/v1
 @app.route('/azure/cognitiveservices/v1', methods=['POST'])
 @require_api_key
+@metered('azure')
 def azure_tts():
     if not EXPAND_API:
         return jsonify({"error": f"Endpoint not allowed"}), 500
     
-    # Parse the SSML payload
+    # Parse the whole SSML document into voice segments and breaks
     try:
         ssml_data = request.data.decode('utf-8')
         if not ssml_data:
             return jsonify({"error": "Missing SSML payload"}), 400
-
-        # Extract the text and voice from SSML
-        from xml.etree import ElementTree as ET
-        root = ET.fromstring(ssml_data)
-        text = root.find('.//{http://www.w3.org/2001/10/synthesis}voice').text
-        voice = root.find('.//{http://www.w3.org/2001/10/synthesis}voice').get('name')
+        parts = parse_ssml(ssml_data, DEFAULT_VOICE, speed_to_rate(DEFAULT_SPEED), filter_text)
+        response_format = ssml_output_format(request.headers.get('X-Microsoft-OutputFormat'), 'mp3')
     except Exception as e:
-        return jsonify({"error": f"Invalid SSML payload: {str(e)}"}), 400
+        return jsonify({"error": str(e) if isinstance(e, SsmlError) else f"Invalid SSML payload: {str(e)}"}), 400
 
-    # Use default settings for edge-tts
-    response_format = 'mp3'
-    speed = DEFAULT_SPEED
+    voices = [part.voice for part in parts if isinstance(part, SsmlSegment)]
+    if VALIDATE_VOICES:
+        for voice in voices:
+            if not is_known_voice(voice):
+                return jsonify({"error": f"Unknown voice '{voice}'"}), 400
 
-    if not REMOVE_FILTER:
-        text = prepare_tts_input_with_context(text)
+    if response_format in FFMPEG_OUTPUT_ARGS and not is_ffmpeg_installed():
+        # Unlike the OpenAI route, an explicit Azure output format is never swapped for mp3
+        return jsonify({"error": f"X-Microsoft-OutputFormat '{request.headers.get('X-Microsoft-OutputFormat')}' needs FFmpeg, which is not installed"}), 400
+    REQUESTS.inc('azure', *metric_labels(response_format, voices[0]))
 
-    # Generate speech using edge-tts
+    # Generate speech using edge-tts, segments concurrently
     try:
-        output_file_path = generate_speech(text, voice, response_format, speed)
+        audio_stream = generate_ssml_stream(parts, response_format, client_key=get_client_key())
+        # Return the generated audio file, streamed as the segments are synthesized
+        return audio_stream_response(audio_stream, AUDIO_FORMAT_MIME_TYPES[response_format], download_name=f"speech.{response_format}")
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
     except Exception as e:
         return jsonify({"error": f"TTS generation failed: {str(e)}"}), 500
 
-    # Return the generated audio file
-    return send_file(output_file_path, mimetype="audio/mpeg", as_attachment=True, download_name="speech.mp3")
-
-print(f" Edge TTS (Free Azure TTS) Replacement for OpenAI's TTS API")
-print(f" ")
-print(f" * Serving OpenAI Edge TTS")
-print(f" * Server running on http://localhost:{PORT}")
-print(f" * TTS Endpoint: http://localhost:{PORT}/v1/audio/speech")
-print(f" ")
+def print_banner(mode=""):
+    print(f" Edge TTS (Free Azure TTS) Replacement for OpenAI's TTS API")
+    print(f" ")
+    print(f" * Serving OpenAI Edge TTS{mode}")
+    print(f" * Server running on http://localhost:{PORT}")
+    print(f" * TTS Endpoint: http://localhost:{PORT}/v1/audio/speech")
+    print(f" ")
+
+def serve_worker(listener, worker):
+    """Serve on an inherited listening socket until SIGTERM, then drain in-flight requests."""
+    import gevent
+    from gevent import socket as gevent_socket
+    from gevent.event import Event
+    from gevent.pool import Pool
+
+    voice_catalog.start()
+    if job_runner is not None:
+        job_runner.start()
+    warmup.start()
+    # An explicit pool lets stop() wait for the requests that are still running
+    http_server = WSGIServer(gevent_socket.socket(fileno=listener.detach()), app, spawn=Pool())
+    stop = Event()
+    gevent.signal_handler(signal.SIGTERM, stop.set)
+    http_server.start()
+    stop.wait()
+    http_server.stop(timeout=GRACEFUL_TIMEOUT)  # Stops accepting, then waits for in-flight requests
 
 if __name__ == '__main__':
-    http_server = WSGIServer(('0.0.0.0', PORT), app)
-    http_server.serve_forever()
+    print_banner()
+    if WORKERS > 1:
+        from prefork import Supervisor
+        Supervisor(('0.0.0.0', PORT), WORKERS, serve_worker, GRACEFUL_TIMEOUT).run()
+    else:
+        # Load the voice catalogue up front and keep it refreshed in the background
+        voice_catalog.start()
+        if job_runner is not None:
+            job_runner.start()  # Picks up jobs left unfinished by a previous run
+        warmup.start()  # Renders the warmup manifest in the background
+        http_server = WSGIServer(('0.0.0.0', PORT), app)
+        http_server.serve_forever()
@@ -0,0 +1,137 @@
+# speech_stream.py
+
+import asyncio
+import os
+import time
+
+from config import DEFAULT_CONFIGS
+from handle_text import IncrementalTextNormalizer, prepare_tts_input_with_context, split_sentences
+from metrics import observe_stage
+from tts_handler import generate_speech_stream_async
+from utils import getenv_bool
+
+SPEECH_STREAM_LOOKAHEAD = int(os.getenv('SPEECH_STREAM_LOOKAHEAD', str(DEFAULT_CONFIGS["SPEECH_STREAM_LOOKAHEAD"])))
+REMOVE_FILTER = getenv_bool('REMOVE_FILTER', DEFAULT_CONFIGS["REMOVE_FILTER"])
+
+_FLUSHED = object()
+_END = object()
+
+class SpeechStream:
+    """
+    Speech for text that arrives in pieces, such as the tokens of an LLM response.
+
+    Deltas are normalized incrementally and split at sentence ends. Each sentence is
+    synthesized as soon as it is complete, and events() yields the audio in reading
+    order. At most SPEECH_STREAM_LOOKAHEAD sentences, counting the one being read,
+    are synthesized or held at a time: a sentence keeps its place until events() has
+    yielded all of its audio, so a slow reader holds synthesis back.
+    Sentences go through generate_speech_stream_async, so they are cached, coalesced
+    and admitted like any other request. Only mp3 is produced: separately encoded
+    mp3 sentences can be concatenated, other containers cannot.
+    """
+
+    def __init__(self, voice, speed, client_key=None):
+        self.voice = voice
+        self.speed = speed
+        self.client_key = client_key
+        self._normalizer = IncrementalTextNormalizer(
+            by_sentence=True, normalize=str.strip if REMOVE_FILTER else prepare_tts_input_with_context)
+        self._semaphore = asyncio.Semaphore(max(1, SPEECH_STREAM_LOOKAHEAD))
+        self._segments = asyncio.Queue()  # (index, text, audio queue), _FLUSHED or _END, in order
+        self._tasks = []
+        self._closed = False
+        self.sentences = 0
+        self.audio_bytes = 0
+        self.first_text_at = None
+        self.first_audio_at = None
+
+    @property
+    def first_audio_seconds(self):
+        """Time from the first text delta to the first audio yielded, or None."""
+        if self.first_text_at is None or self.first_audio_at is None:
+            return None
+        return self.first_audio_at - self.first_text_at
+
+    def _start(self, text):
+        self._tasks = [task for task in self._tasks if not task.done()]
+        for sentence in split_sentences(text):
+            audio = asyncio.Queue()
+            read = asyncio.Event()
+            self._tasks.append(asyncio.create_task(self._synthesize(sentence, audio, read)))
+            self._segments.put_nowait((self.sentences, sentence, audio, read))
+            self.sentences += 1
+
+    async def _synthesize(self, sentence, audio, read):
+        async with self._semaphore:  # FIFO, so sentences start in reading order
+            try:
+                async for chunk in generate_speech_stream_async(sentence, self.voice, self.speed, "mp3", self.client_key):
+                    audio.put_nowait(chunk)
+                audio.put_nowait(_END)
+            except Exception as e:
+                audio.put_nowait(e)
+            await read.wait()  # The buffered audio counts against the lookahead until it is read
+
+    def feed(self, text):
+        """Add a text delta; sentences it completes start synthesizing at once."""
+        if self._closed:
+            raise ValueError("The stream is closed")
+        if self.first_text_at is None and text.strip():
+            self.first_text_at = time.perf_counter()
+        self._start(self._normalizer.feed(text))
+
+    def flush(self):
+        """Synthesize whatever text is buffered, as the end of a turn; events() then yields ("flushed",)."""
+        if self._closed:
+            raise ValueError("The stream is closed")
+        self._start(self._normalizer.flush())
+        self._segments.put_nowait(_FLUSHED)
+
+    def close(self):
+        """Flush, and end events() once the remaining audio has been yielded."""
+        if not self._closed:
+            self.flush()
+            self._closed = True
+            self._segments.put_nowait(_END)
+
+    async def events(self):
+        """
+        Yield ("sentence", index, text) before each sentence's audio, ("audio", bytes)
+        as it is synthesized, ("error", index, message) for a sentence that failed
+        (the stream carries on with the next one) and ("flushed",) after a flush.
+        """
+        while True:
+            segment = await self._segments.get()
+            if segment is _END:
+                return
+            if segment is _FLUSHED:
+                yield ("flushed",)
+                continue
+            index, sentence, audio, read = segment
+            yield ("sentence", index, sentence)
+            while True:
+                item = await audio.get()
+                if item is _END:
+                    read.set()
+                    break
+                if isinstance(item, Exception):
+                    read.set()
+                    yield ("error", index, str(item) or type(item).__name__)
+                    break
+                if self.first_audio_at is None:
+                    self.first_audio_at = time.perf_counter()
+                    if self.first_text_at is not None:
+                        observe_stage("stream_first_audio", self.first_audio_seconds)
+                self.audio_bytes += len(item)
+                yield ("audio", item)
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def summary(self):
+        seconds = self.first_audio_seconds
+        return {
+            "sentences": self.sentences,
+            "audio_bytes": self.audio_bytes,
+            "first_audio_seconds": round(seconds, 4) if seconds is not None else None,
+        }
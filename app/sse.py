@@ -0,0 +1,154 @@
+# sse.py
+
+import asyncio
+import base64
+import json
+import os
+import struct
+
+from config import DEFAULT_CONFIGS
+
+SSE_COALESCE_BYTES = int(os.getenv('SSE_COALESCE_BYTES', str(DEFAULT_CONFIGS["SSE_COALESCE_BYTES"])))
+SSE_COALESCE_MS = float(os.getenv('SSE_COALESCE_MS', str(DEFAULT_CONFIGS["SSE_COALESCE_MS"])))
+
+def sse_event(data):
+    """Format a JSON payload as a server-sent event."""
+    return f"data: {json.dumps(data)}\n\n"
+
+def audio_delta_event(chunk):
+    # Built by hand: base64 never needs JSON escaping, and the payload is most of the stream
+    return f'data: {{"type": "speech.audio.delta", "audio": "{base64.b64encode(chunk).decode("ascii")}"}}\n\n'
+
+def audio_done_payload(text):
+    return {
+        "type": "speech.audio.done",
+        "usage": {
+            "input_tokens": len(text.split()),  # Rough estimate
+            "output_tokens": 0,  # Edge TTS doesn't provide this
+            "total_tokens": len(text.split())
+        }
+    }
+
+def audio_done_event(text):
+    return sse_event(audio_done_payload(text))
+
+def word_payload(boundary):
+    """Payload for one spoken word, from a generate_timed_speech_stream_async word dict."""
+    return {"type": "speech.audio.word", **boundary}
+
+def word_event(boundary):
+    return sse_event(word_payload(boundary))
+
+def error_payload(e):
+    return {"type": "error", "error": str(e)}
+
+def error_event(e):
+    return sse_event(error_payload(e))
+
+SSE_HEADERS = {
+    'Content-Type': 'text/event-stream',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no'  # Disable nginx buffering
+}
+
+# Binary framing (stream_format "binary"): each frame is a one-byte type, a 4-byte
+# big-endian payload length and the payload. Audio frames carry raw mp3 bytes, event
+# frames a UTF-8 JSON object with the same fields as the SSE events.
+FRAME_AUDIO = b'A'
+FRAME_EVENT = b'E'
+FRAMED_MIME_TYPE = 'application/vnd.tts-frames'
+
+FRAMED_HEADERS = {
+    'Content-Type': FRAMED_MIME_TYPE,
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # Disable nginx buffering
+}
+
+def audio_frame(chunk):
+    return struct.pack('>cI', FRAME_AUDIO, len(chunk)) + chunk
+
+def event_frame(data):
+    payload = json.dumps(data).encode('utf-8')
+    return struct.pack('>cI', FRAME_EVENT, len(payload)) + payload
+
+async def coalesce_chunks(items, max_bytes=None, max_delay=None):
+    """
+    Merge the small audio chunks of a stream into fewer, larger ones.
+
+    Audio is held back until max_bytes are buffered or the oldest buffered chunk has
+    waited max_delay seconds, whichever comes first. The first chunk is passed on at
+    once, so the time to first byte is unchanged. Items that are not bytes (word
+    dicts) are passed on as they arrive; their timings are absolute, so they need
+    not stay in step with the audio. max_bytes <= 0 disables coalescing. Both
+    default to SSE_COALESCE_BYTES and SSE_COALESCE_MS.
+    """
+    max_bytes = SSE_COALESCE_BYTES if max_bytes is None else max_bytes
+    max_delay = SSE_COALESCE_MS / 1000 if max_delay is None else max_delay
+    if max_bytes <= 0:
+        async for item in items:
+            yield item
+        return
+
+    # A producer task reads the source and merges chunks, so a deadline can flush
+    # the buffer while the source is still waiting for upstream audio
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=16)
+    finished = object()
+    buffer = []
+    buffered_bytes = 0
+    timer = None
+
+    def take_buffer():
+        nonlocal buffer, buffered_bytes, timer
+        if timer is not None:
+            timer.cancel()
+            timer = None
+        chunk = b"".join(buffer)
+        buffer, buffered_bytes = [], 0
+        return chunk
+
+    def on_deadline():
+        nonlocal timer
+        timer = None
+        if queue.full():
+            timer = loop.call_later(max_delay, on_deadline)  # The client is behind anyway
+        else:
+            queue.put_nowait(take_buffer())
+
+    async def produce():
+        nonlocal buffered_bytes, timer
+        first_chunk = True
+        try:
+            async for item in items:
+                if not isinstance(item, bytes) or first_chunk:
+                    first_chunk = first_chunk and not isinstance(item, bytes)
+                    await queue.put(item)
+                    continue
+                if not buffer:
+                    timer = loop.call_later(max_delay, on_deadline)
+                buffer.append(item)
+                buffered_bytes += len(item)
+                if buffered_bytes >= max_bytes:
+                    await queue.put(take_buffer())
+            if buffer:
+                await queue.put(take_buffer())
+            await queue.put(finished)
+        except Exception as e:
+            if buffer:
+                await queue.put(take_buffer())  # Audio received before the failure is still delivered
+            await queue.put(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()  # Stops the source if the client went away early
+        if timer is not None:
+            timer.cancel()
@@ -0,0 +1,214 @@
+# ssml.py
+
+import math
+import re
+from xml.etree import ElementTree as ET
+
+# Relative values of the SSML prosody keywords, as Azure interprets them
+RATE_KEYWORDS = {"x-slow": 0.5, "slow": 0.64, "medium": 1.0, "fast": 1.55, "x-fast": 2.0, "default": 1.0}
+PITCH_KEYWORDS = {"x-low": 0.55, "low": 0.8, "medium": 1.0, "high": 1.2, "x-high": 1.45, "default": 1.0}
+VOLUME_KEYWORDS = {"silent": 0, "x-soft": 20, "soft": 40, "medium": 60, "loud": 80, "x-loud": 100, "default": 100}
+BREAK_STRENGTHS = {"none": 0, "x-weak": 250, "weak": 500, "medium": 750, "strong": 1000, "x-strong": 1250}
+
+# edge-tts only takes pitch changes in Hz, so relative pitches are taken against a typical voice
+NOMINAL_PITCH_HZ = 200
+
+# Longest silence a single break may insert
+MAX_BREAK_MS = 5000
+
+# Azure X-Microsoft-OutputFormat values that can be produced exactly: edge-tts gives
+# 24 kHz mono mp3 at 48 kbps, which FFmpeg converts without resampling
+OUTPUT_FORMATS = {
+    "audio-24khz-48kbitrate-mono-mp3": "mp3",
+    "ogg-24khz-16bit-mono-opus": "opus",
+    "riff-24khz-16bit-mono-pcm": "wav",
+    "raw-24khz-16bit-mono-pcm": "pcm",
+}
+
+class SsmlError(ValueError):
+    """The SSML document cannot be used (answered with a 400)."""
+
+class Segment:
+    """A run of text spoken with one voice and one set of prosody settings."""
+
+    def __init__(self, voice, rate, pitch, volume, text):
+        self.voice = voice
+        self.rate = rate
+        self.pitch = pitch
+        self.volume = volume
+        self.text = text
+
+    def key(self):
+        return ["say", self.voice, self.rate, self.pitch, self.volume, self.text]
+
+class Break:
+    """Silence between segments."""
+
+    def __init__(self, milliseconds):
+        self.milliseconds = milliseconds
+
+    def key(self):
+        return ["break", self.milliseconds]
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+def _percent(value):
+    return f"{round(value):+d}%"
+
+def parse_rate(value, current):
+    """An SSML prosody rate as an edge-tts rate ("+N%"), or current if it cannot be read."""
+    value = value.strip().lower()
+    try:
+        if value in RATE_KEYWORDS:
+            return _percent((RATE_KEYWORDS[value] - 1) * 100)
+        if value.endswith('%'):
+            return _percent(float(value[:-1]))
+        return _percent((float(value) - 1) * 100)  # A bare number is a multiplier
+    except ValueError:
+        return current
+
+def parse_pitch(value, current):
+    """An SSML prosody pitch as an edge-tts pitch ("+NHz"), or current if it cannot be read."""
+    value = value.strip().lower()
+    try:
+        if value in PITCH_KEYWORDS:
+            hertz = (PITCH_KEYWORDS[value] - 1) * NOMINAL_PITCH_HZ
+        elif value.endswith('hz'):
+            hertz = float(value[:-2])
+            if value[0] not in '+-':
+                hertz -= NOMINAL_PITCH_HZ  # Absolute pitch
+        elif value.endswith('%'):
+            hertz = float(value[:-1]) / 100 * NOMINAL_PITCH_HZ
+        elif value.endswith('st'):
+            hertz = (math.pow(2, float(value[:-2]) / 12) - 1) * NOMINAL_PITCH_HZ
+        else:
+            return current
+    except ValueError:
+        return current
+    return f"{round(hertz):+d}Hz"
+
+def parse_volume(value, current):
+    """An SSML prosody volume as an edge-tts volume ("+N%"), or current if it cannot be read."""
+    value = value.strip().lower()
+    try:
+        if value in VOLUME_KEYWORDS:
+            return _percent(VOLUME_KEYWORDS[value] - 100)
+        if value.endswith('%'):
+            return _percent(float(value[:-1]))
+        if value[0] in '+-':
+            return _percent(float(value))
+        return _percent(float(value) - 100)  # Absolute volume, 100 being the default
+    except (ValueError, IndexError):
+        return current
+
+def parse_duration(value):
+    """An SSML time ("500ms", "2s") in milliseconds, or None."""
+    match = re.fullmatch(r"\s*([\d.]+)\s*(ms|s)\s*", value or "", flags=re.IGNORECASE)
+    if match is None:
+        return None
+    milliseconds = float(match.group(1)) * (1000 if match.group(2).lower() == 's' else 1)
+    return min(int(milliseconds), MAX_BREAK_MS)
+
+def output_format(header, default):
+    """Response format for an X-Microsoft-OutputFormat header value, raising SsmlError if unsupported."""
+    if not header:
+        return default
+    response_format = OUTPUT_FORMATS.get(header.strip().lower())
+    if response_format is None:
+        raise SsmlError(f"Unsupported X-Microsoft-OutputFormat '{header}', expected one of: {', '.join(OUTPUT_FORMATS)}")
+    return response_format
+
+class _Parser:
+    def __init__(self, voice, rate):
+        self.state = (voice, rate, "+0Hz", "+0%")
+        self.parts = []
+        self._text = []
+
+    def _flush_text(self):
+        text = re.sub(r"\s+", " ", "".join(self._text)).strip()
+        self._text = []
+        if text:
+            previous = self.parts[-1] if self.parts else None
+            if isinstance(previous, Segment) and previous.key()[1:5] == list(self.state):
+                previous.text += " " + text
+            else:
+                self.parts.append(Segment(*self.state, text))
+
+    def _add_break(self, milliseconds):
+        self._flush_text()
+        if milliseconds <= 0:
+            return
+        if self.parts and isinstance(self.parts[-1], Break):
+            self.parts[-1].milliseconds = min(self.parts[-1].milliseconds + milliseconds, MAX_BREAK_MS)
+        else:
+            self.parts.append(Break(milliseconds))
+
+    def _set_state(self, state):
+        if state != self.state:
+            self._flush_text()
+            self.state = state
+
+    def walk(self, element):
+        name = _local_name(element.tag)
+        if name == 'break':
+            duration = parse_duration(element.get('time'))
+            self._add_break(duration if duration is not None else BREAK_STRENGTHS.get(element.get('strength', 'medium'), 750))
+            return
+        if name == 'silence':  # mstts:silence
+            self._add_break(parse_duration(element.get('value')) or 0)
+            return
+        if name in ('bookmark', 'viseme', 'backgroundaudio'):
+            return
+        if name == 'sub' and element.get('alias') is not None:
+            self._text.append(element.get('alias'))
+            return
+
+        outer = self.state
+        voice, rate, pitch, volume = outer
+        if name == 'voice' and element.get('name'):
+            voice = element.get('name').strip()
+        elif name == 'prosody':
+            rate = parse_rate(element.get('rate'), rate) if element.get('rate') else rate
+            pitch = parse_pitch(element.get('pitch'), pitch) if element.get('pitch') else pitch
+            volume = parse_volume(element.get('volume'), volume) if element.get('volume') else volume
+        self._set_state((voice, rate, pitch, volume))
+
+        if element.text:
+            self._text.append(element.text)
+        for child in element:
+            self.walk(child)
+            if child.tail:
+                self._text.append(child.tail)
+        if name in ('p', 's'):
+            self._text.append(" ")
+        self._set_state(outer)
+
+def parse_ssml(ssml, default_voice, default_rate="+0%", filter_text=None):
+    """
+    Parse an SSML document into an ordered list of Segment and Break parts.
+
+    Every <voice> element becomes its own segments, <prosody> rate, pitch and volume
+    are converted to edge-tts values (nested settings override outer ones), and
+    <break> and <mstts:silence> become Breaks. Text outside any <voice> uses
+    default_voice. Other elements (<p>, <s>, <say-as>, <emphasis>, <lang>...) only
+    contribute their text; <sub> is read as its alias. filter_text, if given, is
+    applied to the text of each segment.
+    """
+    try:
+        root = ET.fromstring(ssml)
+    except ET.ParseError as e:
+        raise SsmlError(f"Invalid SSML payload: {e}") from None
+    parser = _Parser(default_voice, default_rate)
+    parser.walk(root)
+    parser._flush_text()
+    if filter_text is not None:
+        for part in parser.parts:
+            if isinstance(part, Segment):
+                part.text = filter_text(part.text)
+        parser.parts = [part for part in parser.parts if not isinstance(part, Segment) or part.text]
+    while parser.parts and isinstance(parser.parts[-1], Break):
+        parser.parts.pop()  # Trailing silence would only delay the end of the response
+    if not any(isinstance(part, Segment) for part in parser.parts):
+        raise SsmlError("The SSML document contains no text")
+    return parser.parts
@@ -0,0 +1,37 @@
+# stats.py
+
+from audio_cache import get_cache_stats
+from fragment_cache import get_fragment_stats
+from coalesce import request_coalescer
+from scheduler import scheduler
+from voice_catalog import voice_catalog
+from upstream_pool import get_pool_stats
+from upstream_retry import get_retry_stats
+from jobs import get_job_stats
+from warmup import get_warmup_stats
+from tracing import get_tracing_stats
+from metrics import registry
+
+def component_stats():
+    """Statistics of the cache, fragment cache, coalescer, scheduler, upstream pool, retries, jobs, warmup, tracing and voice catalogue, as served by /v1/stats."""
+    return {
+        "cache": get_cache_stats(),
+        "fragments": get_fragment_stats(),
+        "coalescing": request_coalescer.stats(),
+        "scheduler": scheduler.stats(),
+        "upstream": get_pool_stats(),
+        "retries": get_retry_stats(),
+        "jobs": get_job_stats(),
+        "warmup": get_warmup_stats(),
+        "tracing": get_tracing_stats(),
+        "voices": voice_catalog.stats(),
+    }
+
+def collect_component_stats():
+    """Expose the numeric /v1/stats values as Prometheus gauges."""
+    for component, values in component_stats().items():
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield (f"tts_{component}_{key}", f"The {key} value of the {component} section of /v1/stats.", {(): value})
+
+registry.add_collector(collect_component_stats)
@@ -0,0 +1,263 @@
+# tracing.py
+
+import cProfile
+import contextvars
+import json
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+from config import DEFAULT_CONFIGS
+from utils import getenv_bool
+
+TRACING_ENABLED = getenv_bool('TRACING_ENABLED', DEFAULT_CONFIGS["TRACING_ENABLED"])
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', str(DEFAULT_CONFIGS["TRACE_SAMPLE_RATE"])))
+TRACE_FILE = os.getenv('TRACE_FILE', DEFAULT_CONFIGS["TRACE_FILE"]) or os.path.join(tempfile.gettempdir(), 'openai-edge-tts-traces.jsonl')
+TRACE_FILE_MAX_MB = float(os.getenv('TRACE_FILE_MAX_MB', str(DEFAULT_CONFIGS["TRACE_FILE_MAX_MB"])))
+TRACE_FILE_BACKUPS = int(os.getenv('TRACE_FILE_BACKUPS', str(DEFAULT_CONFIGS["TRACE_FILE_BACKUPS"])))
+TRACE_PROFILE_MS = float(os.getenv('TRACE_PROFILE_MS', str(DEFAULT_CONFIGS["TRACE_PROFILE_MS"])))
+TRACE_PROFILE_DIR = os.getenv('TRACE_PROFILE_DIR', DEFAULT_CONFIGS["TRACE_PROFILE_DIR"]) or os.path.join(tempfile.gettempdir(), 'openai-edge-tts-profiles')
+
+# Trace of the request being handled. Code on the shared loop runs in a copy of the
+# request's context (see async_bridge.submit), which holds the same Trace object.
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_NO_SPAN = nullcontext()
+
+class Trace:
+    """Timed spans of one request, as (name, start, duration) in seconds from its start."""
+
+    def __init__(self, route):
+        self.id = uuid.uuid4().hex[:16]
+        self.route = route
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self.attributes = {}
+        self.profiler = None
+
+    def add_span(self, name, seconds):
+        """Record a span of the given duration that ended just now."""
+        self.spans.append((name, time.perf_counter() - seconds - self.started, seconds))
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, started - self.started, time.perf_counter() - started))
+
+    def server_timing(self):
+        """
+        Server-Timing header value for the spans recorded so far, plus the total.
+
+        Repeated spans (one per segment of a long input, say) are reported as one,
+        from the start of the first to the end of the last, as they may overlap.
+        """
+        extents = {}
+        for name, start, duration in list(self.spans):
+            first, last = extents.get(name, (start, start + duration))
+            extents[name] = (min(first, start), max(last, start + duration))
+        metrics = [f"{name};dur={(last - first) * 1000:.1f}" for name, (first, last) in extents.items()]
+        metrics.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def record(self, duration, status, sent_bytes):
+        return {
+            "id": self.id,
+            "route": self.route,
+            "timestamp": round(self.timestamp, 3),
+            "duration_ms": round(duration * 1000, 3),
+            "status": status,
+            "bytes": sent_bytes,
+            **self.attributes,
+            "spans": [
+                {"name": name, "start_ms": round(start * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+                for name, start, duration in sorted(self.spans, key=lambda span: span[1])
+            ],
+        }
+
+class TraceWriter:
+    """
+    Appends finished traces to a JSONL file from a background thread, so requests
+    never wait on the disk. The file is rotated once it reaches max_bytes, keeping
+    `backups` older files (path.1 being the newest).
+    """
+
+    def __init__(self, path, max_bytes, backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.written = 0
+        self.profiles = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        # Started on first use, and again in a forked worker, which inherits no threads
+        if self._pid == os.getpid():
+            return self._queue
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+                threading.Thread(target=self._run, args=(self._queue,), name='trace-writer', daemon=True).start()
+                self._pid = os.getpid()
+        return self._queue
+
+    def write(self, record, profiler=None):
+        """Queue a trace record; profiler, if given, is dumped to record["profile"] first."""
+        self._ensure_thread().put((record, profiler))
+
+    def flush(self, timeout=5):
+        """Wait until the records queued so far are written."""
+        written = threading.Event()
+        self._ensure_thread().put((None, written))
+        return written.wait(timeout)
+
+    def _run(self, records):
+        while True:
+            batch = [records.get()]
+            try:
+                while len(batch) < 256:
+                    batch.append(records.get_nowait())
+            except queue.Empty:
+                pass
+
+            lines = []
+            waiters = []
+            for record, profiler in batch:
+                if record is None:
+                    waiters.append(profiler)
+                    continue
+                if profiler is not None:
+                    self._dump_profile(record, profiler)
+                lines.append(json.dumps(record))
+            if lines:
+                self._append(lines)
+            for waiter in waiters:
+                waiter.set()
+
+    def _dump_profile(self, record, profiler):
+        try:
+            os.makedirs(os.path.dirname(record["profile"]), exist_ok=True)
+            profiler.dump_stats(record["profile"])
+            self.profiles += 1
+        except OSError as e:
+            print(f"Tracing: could not write profile {record['profile']}: {e}")
+            record["profile"] = None
+
+    def _append(self, lines):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+                size = f.tell()
+            self.written += len(lines)
+            if self.max_bytes and size >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            self.errors += 1
+            if self.errors == 1:  # Reported once, not for every request
+                print(f"Tracing: could not write {self.path}: {e}")
+
+    def _rotate(self):
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+trace_writer = TraceWriter(TRACE_FILE, int(TRACE_FILE_MAX_MB * 1024 * 1024), TRACE_FILE_BACKUPS)
+
+# cProfile profiles a whole thread and allows one active profiler per thread, so only
+# one traced request at a time is profiled, and its profile also contains whatever
+# else that thread ran meanwhile (other requests' greenlets or coroutines)
+_profiler_lock = threading.Lock()
+_traces_started = 0
+
+def _start_profiler():
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # Another profiler (a debugger, say) is already active
+        _profiler_lock.release()
+        return None
+    return profiler
+
+def start_trace(route):
+    """
+    Start tracing the current request, if tracing is on and the request is sampled.
+
+    Returns the Trace, or None. Must be paired with finish_trace() in the same
+    greenlet or task once the response has been written.
+    """
+    global _traces_started
+    if not TRACING_ENABLED:
+        return None
+    trace = Trace(route) if TRACE_SAMPLE_RATE >= 1 or random.random() < TRACE_SAMPLE_RATE else None
+    _current_trace.set(trace)  # Also clears a trace left by an earlier request of a keep-alive connection
+    if trace is not None:
+        _traces_started += 1
+        if TRACE_PROFILE_MS > 0:
+            trace.profiler = _start_profiler()
+    return trace
+
+def finish_trace(trace, status, sent_bytes=0):
+    """Close a trace and queue it for the trace file, with a cProfile dump if it was slow."""
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+    duration = time.perf_counter() - trace.started
+    record = trace.record(duration, status, sent_bytes)
+    profiler = trace.profiler
+    if profiler is not None:
+        profiler.disable()
+        _profiler_lock.release()
+        trace.profiler = None
+        if duration * 1000 >= TRACE_PROFILE_MS:
+            record["profile"] = os.path.join(TRACE_PROFILE_DIR, f"{trace.id}.prof")
+        else:
+            profiler = None
+    trace_writer.write(record, profiler)
+
+def current_trace():
+    return _current_trace.get()
+
+def record_span(name, seconds):
+    """Add a span that ended just now to the current request's trace, if it has one."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, seconds)
+
+def span(name):
+    """Context manager timing a span of the current request's trace (a no-op when there is none)."""
+    trace = _current_trace.get()
+    return _NO_SPAN if trace is None else trace.span(name)
+
+def annotate(**attributes):
+    """Attach attributes (voice, format, ...) to the current request's trace record."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+def get_tracing_stats():
+    return {
+        "enabled": TRACING_ENABLED,
+        "sample_rate": TRACE_SAMPLE_RATE,
+        "traces": _traces_started,
+        "written": trace_writer.written,
+        "profiles": trace_writer.profiles,
+        "write_errors": trace_writer.errors,
+    }
@@ -1,18 +1,40 @@
 # tts_handler.py
 
-import edge_tts
 import asyncio
-import tempfile
+import functools
+import json
 import subprocess
 import os
-from pathlib import Path
+import time
+from functools import lru_cache
 
-from utils import DETAILED_ERROR_LOGGING
+from edge_tts.constants import TICKS_PER_SECOND
+
+from utils import getenv_bool, AUDIO_FORMAT_MIME_TYPES, DETAILED_ERROR_LOGGING
 from config import DEFAULT_CONFIGS
+from audio_cache import audio_cache, make_cache_key
+from handle_text import split_into_segments, split_sentences
+from mp3_frames import Mp3FrameAligner, silent_frames
+from voice_catalog import VoiceCatalogUnavailable, voice_catalog
+from coalesce import request_coalescer
+from scheduler import scheduler
+from metrics import ERRORS, observe_stage
+from tracing import span
+from upstream_retry import resilient_stream
+import fragment_cache
+import ssml
+import async_bridge
 
 # Language default (environment variable)
 DEFAULT_LANGUAGE = os.getenv('DEFAULT_LANGUAGE', DEFAULT_CONFIGS["DEFAULT_LANGUAGE"])
 
+# Long inputs are split into sentence-aligned segments that are synthesized concurrently
+SYNTHESIS_PARALLELISM = int(os.getenv('SYNTHESIS_PARALLELISM', str(DEFAULT_CONFIGS["SYNTHESIS_PARALLELISM"])))
+SEGMENT_MAX_CHARS = int(os.getenv('SEGMENT_MAX_CHARS', str(DEFAULT_CONFIGS["SEGMENT_MAX_CHARS"])))
+
+# Identical concurrent requests share a single upstream synthesis
+COALESCE_REQUESTS = getenv_bool('COALESCE_REQUESTS', DEFAULT_CONFIGS["COALESCE_REQUESTS"])
+
 # OpenAI voice names mapped to edge-tts equivalents
 voice_mapping = {
     'alloy': 'en-US-JennyNeural',
@@ -34,125 +56,439 @@ model_data = [
         {"id": "gpt-4o-mini-tts", "name": "GPT-4o mini TTS"}
     ]
 
+@lru_cache(maxsize=None)
 def is_ffmpeg_installed():
-    """Check if FFmpeg is installed and accessible."""
+    """Check if FFmpeg is installed and accessible (checked once per process)."""
     try:
         subprocess.run(['ffmpeg', '-version'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         return True
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
 
-async def _generate_audio_stream(text, voice, speed):
-    """Generate streaming TTS audio using edge-tts."""
+# FFmpeg encoder and container arguments per output format. Every container here can be
+# written to a non-seekable pipe, so output streams while synthesis is still running.
+FFMPEG_OUTPUT_ARGS = {
+    "aac": ["-c:a", "aac", "-b:a", "192k", "-f", "adts"],  # ADTS, matches the audio/aac MIME type
+    "opus": ["-c:a", "libopus", "-b:a", "192k", "-f", "ogg"],
+    "flac": ["-c:a", "flac", "-f", "flac"],
+    "wav": ["-c:a", "pcm_s16le", "-f", "wav"],
+    "pcm": ["-c:a", "pcm_s16le", "-ar", "24000", "-ac", "1", "-f", "s16le"],  # Raw 24kHz 16-bit mono, like OpenAI
+}
+
+def _resolve_voice_and_rate(voice, speed):
+    """Map the requested voice and speed to the edge-tts voice and SSML rate."""
     # Determine if the voice is an OpenAI-compatible voice or a direct edge-tts voice
     edge_tts_voice = voice_mapping.get(voice, voice)  # Use mapping if in OpenAI names, otherwise use as-is
-    
+
     # Convert speed to SSML rate format
     try:
         speed_rate = speed_to_rate(speed)  # Convert speed value to "+X%" or "-X%"
     except Exception as e:
         print(f"Error converting speed: {e}. Defaulting to +0%.")
         speed_rate = "+0%"
-    
-    # Create the communicator for streaming
-    communicator = edge_tts.Communicate(text=text, voice=edge_tts_voice, rate=speed_rate)
-    
-    # Stream the audio data
-    async for chunk in communicator.stream():
-        if chunk["type"] == "audio":
-            yield chunk["data"]
 
-def generate_speech_stream(text, voice, speed=1.0):
-    """Generate streaming speech audio (synchronous wrapper)."""
-    return asyncio.run(_generate_audio_stream(text, voice, speed))
+    return edge_tts_voice, speed_rate
 
-async def _generate_audio(text, voice, response_format, speed):
-    """Generate TTS audio and optionally convert to a different format."""
-    # Determine if the voice is an OpenAI-compatible voice or a direct edge-tts voice
-    edge_tts_voice = voice_mapping.get(voice, voice)  # Use mapping if in OpenAI names, otherwise use as-is
+class TranscodeError(RuntimeError):
+    """FFmpeg failed to convert the audio."""
+
+async def _stream_edge_tts(text, edge_tts_voice, speed_rate, **prosody):
+    """Stream mp3 audio of one synthesis, retried and resumed by upstream_retry on failure."""
+    started = time.perf_counter()
+    first_chunk = True
+    try:
+        async for chunk in resilient_stream(text, edge_tts_voice, speed_rate, **prosody):
+            if first_chunk and isinstance(chunk, bytes):  # Not a word boundary
+                observe_stage("upstream_first_chunk", time.perf_counter() - started)
+                first_chunk = False
+            yield chunk
+    except Exception:
+        ERRORS.inc("upstream")
+        raise
+    observe_stage("upstream_total", time.perf_counter() - started)
 
-    # Generate the TTS output in mp3 format first
-    temp_mp3_file_obj = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-    temp_mp3_path = temp_mp3_file_obj.name
+async def _synthesize_fragment(sentence, edge_tts_voice, speed_rate):
+    """Stream one sentence's audio and store it in the fragment cache once complete."""
+    parts = []
+    async for chunk in _stream_edge_tts(sentence, edge_tts_voice, speed_rate):
+        parts.append(chunk)
+        yield chunk
+    await asyncio.to_thread(fragment_cache.store, sentence, edge_tts_voice, speed_rate, b"".join(parts))
 
-    # Convert speed to SSML rate format
+async def _stream_in_order(sources):
+    """
+    Produce several pieces of audio concurrently and yield them in order as one mp3 stream.
+
+    A source is either mp3 frames (cached audio, silence), used as they are, or a
+    function returning an async iterator of mp3 chunks, such as a synthesis. At most
+    SYNTHESIS_PARALLELISM of those run at once. Audio of the source currently being
+    emitted is forwarded as it arrives, so the first one streams with normal TTFB
+    while later ones are prepared in the background. Each is frame-aligned so the
+    concatenation has no partial frames or stray headers at the joins.
+    """
+    semaphore = asyncio.Semaphore(max(1, SYNTHESIS_PARALLELISM))
+    queues = [asyncio.Queue() for _ in sources]
+    finished = object()
+
+    async def produce(source, queue):
+        async with semaphore:  # FIFO, so sources start in reading order
+            try:
+                aligner = Mp3FrameAligner()
+                async for chunk in source():
+                    frames = aligner.feed(chunk)
+                    if frames:
+                        queue.put_nowait(frames)
+                queue.put_nowait(finished)
+            except Exception as e:
+                queue.put_nowait(e)
+
+    tasks = []
+    for source, queue in zip(sources, queues):
+        if isinstance(source, bytes):
+            queue.put_nowait(source)
+            queue.put_nowait(finished)
+        else:
+            tasks.append(asyncio.create_task(produce(source, queue)))
     try:
-        speed_rate = speed_to_rate(speed)  # Convert speed value to "+X%" or "-X%"
-    except Exception as e:
-        print(f"Error converting speed: {e}. Defaulting to +0%.")
-        speed_rate = "+0%"
+        for queue in queues:
+            while True:
+                item = await queue.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
 
-    # Generate the MP3 file
-    communicator = edge_tts.Communicate(text=text, voice=edge_tts_voice, rate=speed_rate)
-    await communicator.save(temp_mp3_path)
-    temp_mp3_file_obj.close() # Explicitly close our file object for the initial mp3
+def _stream_segments_parallel(segments, edge_tts_voice, speed_rate, cached=None):
+    """
+    Synthesize text segments concurrently and stream their audio in order (see _stream_in_order).
+
+    With cached (the fragment cache's audio or None per segment), segments found
+    there are not synthesized, and the others are stored once complete.
+    """
+    sources = []
+    for index, segment in enumerate(segments):
+        if cached is None:
+            sources.append(functools.partial(_stream_edge_tts, segment, edge_tts_voice, speed_rate))
+        elif cached[index] is None:
+            sources.append(functools.partial(_synthesize_fragment, segment, edge_tts_voice, speed_rate))
+        else:
+            sources.append(cached[index])
+    return _stream_in_order(sources)
 
-    # If the requested format is mp3, return the generated file directly
-    if response_format == "mp3":
-        return temp_mp3_path
+def _stream_ssml_mp3(parts):
+    """Stream the mp3 audio of parsed SSML: segments synthesized concurrently, breaks as silence."""
+    sources = []
+    for part in parts:
+        if isinstance(part, ssml.Break):
+            sources.append(silent_frames(part.milliseconds))
+        else:
+            sources.append(functools.partial(
+                _stream_edge_tts, part.text, voice_mapping.get(part.voice, part.voice), part.rate,
+                pitch=part.pitch, volume=part.volume))
+    return _stream_in_order(sources)
 
-    # Check if FFmpeg is installed
-    if not is_ffmpeg_installed():
-        print("FFmpeg is not available. Returning unmodified mp3 file.")
-        return temp_mp3_path # Return the original mp3 path, it won't be cleaned by this function
+async def _stream_mp3(text, voice, speed):
+    """Stream mp3 audio chunks from edge-tts, in parallel segments for long inputs."""
+    edge_tts_voice, speed_rate = _resolve_voice_and_rate(voice, speed)
 
-    # Create a new temporary file for the converted output
-    converted_file_obj = tempfile.NamedTemporaryFile(delete=False, suffix=f".{response_format}")
-    converted_path = converted_file_obj.name
-    converted_file_obj.close() # Close file object, ffmpeg will write to the path
+    if fragment_cache.fragment_cache_enabled():
+        sentences = split_sentences(text)
+        if len(sentences) > 1:
+            # Synthesized sentence by sentence, so sentences shared with other texts are reused
+            cached = await asyncio.to_thread(fragment_cache.lookup, sentences, edge_tts_voice, speed_rate)
+            async for chunk in _stream_segments_parallel(sentences, edge_tts_voice, speed_rate, cached):
+                yield chunk
+            return
 
-    # Build the FFmpeg command
+    segments = [text]
+    if SYNTHESIS_PARALLELISM > 1 and len(text) > SEGMENT_MAX_CHARS:
+        segments = split_into_segments(text, SEGMENT_MAX_CHARS) or [text]
+
+    if len(segments) == 1:
+        audio_chunks = _stream_edge_tts(text, edge_tts_voice, speed_rate)
+    else:
+        audio_chunks = _stream_segments_parallel(segments, edge_tts_voice, speed_rate)
+
+    async for chunk in audio_chunks:
+        yield chunk
+
+async def _transcode_stream(mp3_chunks, response_format):
+    """Pipe mp3 chunks through FFmpeg and stream the converted output as it is produced."""
     ffmpeg_command = [
-        "ffmpeg",
-        "-i", temp_mp3_path,  # Input file path
-        "-c:a", {
-            "aac": "aac",
-            "mp3": "libmp3lame",
-            "wav": "pcm_s16le",
-            "opus": "libopus",
-            "flac": "flac"
-        }.get(response_format, "aac"),  # Default to AAC if unknown
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "mp3", "-i", "pipe:0",
+        *FFMPEG_OUTPUT_ARGS[response_format],
+        "pipe:1",
     ]
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *ffmpeg_command,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
 
-    if response_format != "wav":
-        ffmpeg_command.extend(["-b:a", "192k"])
-
-    ffmpeg_command.extend([
-        "-f", {
-            "aac": "mp4",  # AAC in MP4 container
-            "mp3": "mp3",
-            "wav": "wav",
-            "opus": "ogg",
-            "flac": "flac"
-        }.get(response_format, response_format),  # Default to matching format
-        "-y",  # Overwrite without prompt
-        converted_path  # Output file path
-    ])
+    async def feed_ffmpeg():
+        try:
+            async for chunk in mp3_chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # FFmpeg exited early, its exit status is reported below
+        finally:
+            process.stdin.close()
 
+    feeder = asyncio.create_task(feed_ffmpeg())
     try:
-        # Run FFmpeg command and ensure no errors occur
-        subprocess.run(ffmpeg_command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        # Clean up potentially created (but incomplete) converted file
-        Path(converted_path).unlink(missing_ok=True)
-        # Clean up the original mp3 file as well, since conversion failed
-        Path(temp_mp3_path).unlink(missing_ok=True)
-        
-        if DETAILED_ERROR_LOGGING:
-            error_message = f"FFmpeg error during audio conversion. Command: '{' '.join(e.cmd)}'. Stderr: {e.stderr.decode('utf-8', 'ignore')}"
-            print(error_message) # Log for server-side diagnosis
+        while True:
+            data = await process.stdout.read(64 * 1024)
+            if not data:
+                break
+            yield data
+
+        returncode = await process.wait()
+        if returncode != 0:
+            stderr = (await process.stderr.read()).decode('utf-8', 'ignore')
+            if DETAILED_ERROR_LOGGING:
+                print(f"FFmpeg error during audio conversion. Command: '{' '.join(ffmpeg_command)}'. Stderr: {stderr}")
+            else:
+                print(f"FFmpeg error during audio conversion: exit status {returncode}")
+            ERRORS.inc("ffmpeg")
+            raise TranscodeError(f"FFmpeg error during audio conversion: exit status {returncode}")
+
+        await feeder  # Re-raise any upstream edge-tts error
+        observe_stage("transcode", time.perf_counter() - started)
+    finally:
+        if not feeder.done():
+            feeder.cancel()
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+def _convert_audio(mp3_chunks, response_format):
+    """Convert a stream of mp3 chunks to the response format on the fly, if needed."""
+    if response_format == "mp3" or response_format not in FFMPEG_OUTPUT_ARGS:
+        return mp3_chunks
+    if not is_ffmpeg_installed():
+        print("FFmpeg is not available. Returning unmodified mp3 audio.")
+        return mp3_chunks
+    return _transcode_stream(mp3_chunks, response_format)
+
+def _generate_audio_stream(text, voice, speed, response_format="mp3"):
+    """Generate streaming TTS audio, converting from mp3 on the fly if needed."""
+    return _convert_audio(_stream_mp3(text, voice, speed), response_format)
+
+def _session_count(text):
+    """Most edge-tts sessions a synthesis of text runs at once (see _stream_mp3), for admission control."""
+    if fragment_cache.fragment_cache_enabled():
+        count = len(split_sentences(text))
+    elif len(text) > SEGMENT_MAX_CHARS:
+        count = -(-len(text) // SEGMENT_MAX_CHARS)
+    else:
+        count = 1
+    return max(1, min(SYNTHESIS_PARALLELISM, count))
+
+def _get_request_key(text, voice, response_format, speed):
+    """Key identifying the rendered audio of a request, used for caching and coalescing."""
+    try:
+        speed_rate = speed_to_rate(speed)
+    except Exception:
+        speed_rate = "+0%"  # Same fallback the generators apply
+    return make_cache_key(text, voice_mapping.get(voice, voice), speed_rate, response_format)
+
+async def _render_audio(cache_key, audio_chunks):
+    """
+    Forward streaming TTS audio and store the finished result in the audio cache.
+
+    The copy kept for the cache is bounded by the memory tier's entry limit; audio
+    beyond that is spooled to the disk tier instead of held in memory.
+    """
+    entry = audio_cache.open_entry(cache_key) if cache_key is not None else None
+    try:
+        async for chunk in audio_chunks:
+            if entry is not None:
+                if entry.on_disk or entry.size + len(chunk) > audio_cache.memory_max_bytes:
+                    await asyncio.to_thread(entry.write, chunk)
+                else:
+                    entry.write(chunk)
+            yield chunk
+    except BaseException:
+        if entry is not None:
+            entry.discard()
+        raise
+
+    if entry is not None:
+        await asyncio.to_thread(entry.commit)
+
+def _shared_stream(request_key, cost, sessions, client_key, generate):
+    """
+    Async audio stream for a request, shared with identical requests already in flight.
+
+    generate() starts the actual synthesis, which runs up to sessions edge-tts
+    sessions at once. Only the request that starts it goes through admission control,
+    taking a slot per session; requests that join it, like cache hits, do not take
+    a slot.
+    """
+    cache_key = request_key if audio_cache is not None else None
+
+    def start_render():
+        return scheduler.admit_stream(client_key, cost, _render_audio(cache_key, generate()), sessions)
+
+    if COALESCE_REQUESTS:
+        return request_coalescer.stream(request_key, start_render)
+    return start_render()
+
+def _audio_stream(request_key, text, voice, speed, response_format, client_key):
+    """Async audio stream for a text request (see _shared_stream)."""
+    return _shared_stream(request_key, len(text), _session_count(text), client_key,
+                          lambda: _generate_audio_stream(text, voice, speed, response_format))
+
+async def _generate_audio(request_key, text, voice, response_format, speed, client_key):
+    """Generate TTS audio in the requested format and return it as bytes."""
+    return b"".join([chunk async for chunk in _audio_stream(request_key, text, voice, speed, response_format, client_key)])
+
+def generate_speech_stream(text, voice, speed=1.0, response_format="mp3", client_key=None):
+    """
+    Generate streaming speech audio (synchronous wrapper).
+
+    Chunks are yielded as they arrive from edge-tts (or FFmpeg for non-mp3 formats).
+    Completed streams are stored in the audio cache, and repeated requests are
+    answered from it in a single chunk. Raises AdmissionRejected (before the first
+    chunk) when the scheduler cannot admit the request.
+    """
+    request_key = _get_request_key(text, voice, response_format, speed)
+    if audio_cache is not None:
+        with span("cache_lookup"):
+            cached_audio = audio_cache.get(request_key)
+        if cached_audio is not None:
+            yield cached_audio
+            return
+
+    yield from async_bridge.iterate(_audio_stream(request_key, text, voice, speed, response_format, client_key))
+
+async def generate_speech_stream_async(text, voice, speed=1.0, response_format="mp3", client_key=None):
+    """Same as generate_speech_stream, for callers already running on the shared loop (ASGI mode)."""
+    request_key = _get_request_key(text, voice, response_format, speed)
+    if audio_cache is not None:
+        with span("cache_lookup"):
+            cached_audio = await asyncio.to_thread(audio_cache.get, request_key)
+        if cached_audio is not None:
+            yield cached_audio
+            return
+
+    async for chunk in _audio_stream(request_key, text, voice, speed, response_format, client_key):
+        yield chunk
+
+def generate_speech(text, voice, response_format, speed=1.0, client_key=None):
+    """Generate speech audio as bytes, serving repeated requests from the audio cache."""
+    request_key = _get_request_key(text, voice, response_format, speed)
+    if audio_cache is not None:
+        with span("cache_lookup"):
+            cached_audio = audio_cache.get(request_key)
+        if cached_audio is not None:
+            return cached_audio
+
+    return async_bridge.run(_generate_audio(request_key, text, voice, response_format, speed, client_key))
+
+async def generate_speech_async(text, voice, response_format, speed=1.0, client_key=None):
+    """Same as generate_speech, for callers already running on the shared loop."""
+    request_key = _get_request_key(text, voice, response_format, speed)
+    if audio_cache is not None:
+        with span("cache_lookup"):
+            cached_audio = await asyncio.to_thread(audio_cache.get, request_key)
+        if cached_audio is not None:
+            return cached_audio
+
+    return await _generate_audio(request_key, text, voice, response_format, speed, client_key)
+
+async def pin_speech_async(text, voice, response_format, speed=1.0, client_key=None):
+    """
+    Render speech like generate_speech_async and pin it in the audio cache, so the
+    same request is always answered from memory. Returns False if the pinned region
+    has no room for it.
+    """
+    audio = await generate_speech_async(text, voice, response_format, speed, client_key)
+    return await asyncio.to_thread(audio_cache.pin, _get_request_key(text, voice, response_format, speed), audio)
+
+async def synthesize_mp3(text, voice, speed=1.0, client_key=None):
+    """
+    Synthesize mp3 audio as bytes under admission control, bypassing the audio cache
+    and coalescing (for background jobs, whose chunks are never requested twice).
+    """
+    audio_chunks = scheduler.admit_stream(client_key, len(text), _stream_mp3(text, voice, speed), _session_count(text))
+    return b"".join([chunk async for chunk in audio_chunks])
+
+async def _stream_timed_mp3(text, voice, speed):
+    """mp3 audio chunks of one synthesis of text, with a dict for every spoken word."""
+    edge_tts_voice, speed_rate = _resolve_voice_and_rate(voice, speed)
+    async for item in _stream_edge_tts(text, edge_tts_voice, speed_rate, word_boundaries=True):
+        if isinstance(item, bytes):
+            yield item
         else:
-            error_message = f"FFmpeg error during audio conversion: {e}"
-            print(error_message) # Log a simpler message
-        raise RuntimeError(f"FFmpeg error during audio conversion: {e}") # The raised error will still have details via e
+            yield {
+                "text": item["text"],
+                "start": round(item["offset"] / TICKS_PER_SECOND, 3),
+                "end": round((item["offset"] + item["duration"]) / TICKS_PER_SECOND, 3),
+            }
+
+async def generate_timed_speech_stream_async(text, voice, speed=1.0, client_key=None):
+    """
+    Generate streaming mp3 audio with word timings, on the shared loop.
+
+    Yields audio chunks (bytes) and, for every spoken word, a dict with its text and
+    its start and end in seconds from the beginning of the audio. The text is
+    synthesized in one edge-tts session so the timings stay continuous. Admitted like
+    generate_speech_stream, but neither cached nor coalesced: the cache holds no
+    timings.
+    """
+    async for item in scheduler.admit_stream(client_key, len(text), _stream_timed_mp3(text, voice, speed)):
+        yield item
+
+def _get_ssml_request_key(parts, response_format):
+    """Key identifying the rendered audio of parsed SSML, used for caching and coalescing."""
+    return make_cache_key(json.dumps([part.key() for part in parts]), "ssml", "", response_format)
+
+def _ssml_audio_stream(request_key, parts, response_format, client_key):
+    segments = [part for part in parts if isinstance(part, ssml.Segment)]
+    cost = sum(len(segment.text) for segment in segments)
+    sessions = max(1, min(SYNTHESIS_PARALLELISM, len(segments)))
+    return _shared_stream(request_key, cost, sessions, client_key,
+                          lambda: _convert_audio(_stream_ssml_mp3(parts), response_format))
+
+def generate_ssml_stream(parts, response_format="mp3", client_key=None):
+    """
+    Generate streaming audio for SSML parsed by ssml.parse_ssml (synchronous wrapper).
+
+    Voice segments are synthesized concurrently and streamed in document order as
+    they complete, with silence for breaks. Cached, coalesced and admitted like
+    generate_speech_stream.
+    """
+    request_key = _get_ssml_request_key(parts, response_format)
+    if audio_cache is not None:
+        with span("cache_lookup"):
+            cached_audio = audio_cache.get(request_key)
+        if cached_audio is not None:
+            yield cached_audio
+            return
 
-    # Clean up the original temporary file (original mp3) as it's now converted
-    Path(temp_mp3_path).unlink(missing_ok=True)
+    yield from async_bridge.iterate(_ssml_audio_stream(request_key, parts, response_format, client_key))
 
-    return converted_path
+async def generate_ssml_stream_async(parts, response_format="mp3", client_key=None):
+    """Same as generate_ssml_stream, for callers already running on the shared loop (ASGI mode)."""
+    request_key = _get_ssml_request_key(parts, response_format)
+    if audio_cache is not None:
+        with span("cache_lookup"):
+            cached_audio = await asyncio.to_thread(audio_cache.get, request_key)
+        if cached_audio is not None:
+            yield cached_audio
+            return
 
-def generate_speech(text, voice, response_format, speed=1.0):
-    return asyncio.run(_generate_audio(text, voice, response_format, speed))
+    async for chunk in _ssml_audio_stream(request_key, parts, response_format, client_key):
+        yield chunk
 
 def get_models():
     return model_data
@@ -163,18 +499,47 @@ def get_models_formatted():
 def get_voices_formatted():
     return [{ "id": k, "name": v } for k, v in voice_mapping.items()]
 
-async def _get_voices(language=None):
-    # List all voices, filter by language if specified
-    all_voices = await edge_tts.list_voices()
+def get_voices(language=None, gender=None):
+    """
+    List voices from the cached catalogue, optionally for a single locale ('all' for every voice)
+    and a single gender.
+
+    Raises VoiceCatalogUnavailable when no voice list could be loaded at all.
+    """
+    index = voice_catalog.ensure_loaded()
+    if index is None:
+        raise VoiceCatalogUnavailable("Voice catalogue is not available yet, try again shortly")
     language = language or DEFAULT_LANGUAGE  # Use default if no language specified
-    filtered_voices = [
-        {"name": v['ShortName'], "gender": v['Gender'], "language": v['Locale']}
-        for v in all_voices if language == 'all' or language is None or v['Locale'] == language
-    ]
-    return filtered_voices
+    if gender:
+        gender = gender.lower()
+        if language == 'all':
+            return index.by_gender.get(gender, [])
+        return [voice for voice in index.by_locale.get(language, []) if voice['gender'].lower() == gender]
+    if language == 'all':
+        return index.voices
+    return index.by_locale.get(language, [])
+
+def is_known_voice(voice):
+    """
+    Check a requested voice (OpenAI name or edge-tts voice) against the catalogue.
 
-def get_voices(language=None):
-    return asyncio.run(_get_voices(language))
+    Returns True when the catalogue is unavailable, so an outage of the voice list
+    never blocks synthesis.
+    """
+    index = voice_catalog.ensure_loaded()
+    if index is None:
+        return True
+    return voice_mapping.get(voice, voice) in index.by_name
+
+def metric_labels(response_format, voice):
+    """
+    Format and voice label values for the request counter. Values outside the known
+    formats and voices are counted as 'other', so clients cannot create new series.
+    """
+    index = voice_catalog.index
+    known_voice = voice in voice_mapping or (index is not None and voice in index.by_name)
+    return (response_format if response_format in AUDIO_FORMAT_MIME_TYPES else 'other',
+            voice if known_voice else 'other')
 
 def speed_to_rate(speed: float) -> str:
     """
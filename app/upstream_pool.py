@@ -0,0 +1,344 @@
+# upstream_pool.py
+
+import asyncio
+import json
+import math
+import os
+import ssl
+import time
+from xml.sax.saxutils import escape, unescape
+
+import aiohttp
+import certifi
+import edge_tts
+from edge_tts.communicate import (
+    connect_id, date_to_string, get_headers_and_data, mkssml,
+    remove_incompatible_characters, split_text_by_byte_length, ssml_headers_plus_data,
+)
+from edge_tts.constants import MP3_BITRATE_BPS, SEC_MS_GEC_VERSION, TICKS_PER_SECOND, WSS_HEADERS, WSS_URL
+from edge_tts.data_classes import TTSConfig
+from edge_tts.drm import DRM
+from edge_tts.exceptions import NoAudioReceived, UnexpectedResponse, UnknownResponse, WebSocketError
+
+from config import DEFAULT_CONFIGS
+from tracing import record_span
+
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', str(DEFAULT_CONFIGS["UPSTREAM_POOL_SIZE"])))
+UPSTREAM_POOL_IDLE_TIMEOUT = float(os.getenv('UPSTREAM_POOL_IDLE_TIMEOUT', str(DEFAULT_CONFIGS["UPSTREAM_POOL_IDLE_TIMEOUT"])))
+UPSTREAM_POOL_MAX_AGE = float(os.getenv('UPSTREAM_POOL_MAX_AGE', str(DEFAULT_CONFIGS["UPSTREAM_POOL_MAX_AGE"])))
+UPSTREAM_URL = os.getenv('UPSTREAM_URL', DEFAULT_CONFIGS["UPSTREAM_URL"]) or WSS_URL
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', str(DEFAULT_CONFIGS["UPSTREAM_CONNECT_TIMEOUT"])))
+
+RECEIVE_TIMEOUT = 60
+
+_SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
+
+class _Connection:
+    """One upstream WebSocket and what the service has been told on it so far."""
+
+    def __init__(self, websocket, handshake_seconds):
+        self.websocket = websocket
+        self.handshake_seconds = handshake_seconds
+        self.created_at = self.last_used = time.monotonic()
+        self.turns = 0
+        self.boundary = None  # Metadata options sent with speech.config, None before the first turn
+        self.reused = False
+
+    def is_alive(self, now, idle_timeout, max_age):
+        websocket = self.websocket
+        return (
+            not websocket.closed
+            and websocket.exception() is None
+            and now - self.last_used < idle_timeout
+            and now - self.created_at < max_age
+        )
+
+    async def close(self):
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+class UpstreamPool:
+    """
+    Pool of open WebSocket connections to the edge-tts service.
+
+    edge_tts.Communicate opens a new TLS WebSocket for every request, so each
+    synthesis pays DNS, TCP, TLS and the WebSocket upgrade before the first byte
+    of audio. The service accepts any number of consecutive turns (speech.config
+    and SSML in, audio until turn.end out) on one connection, so connections that
+    finish a turn cleanly are kept and handed to the next request.
+
+    At most max_idle connections are kept; concurrent requests beyond that still
+    get a connection of their own, which is closed after use. Idle connections are
+    closed after idle_timeout seconds (the service drops quiet connections) and
+    every connection is retired after max_age seconds, since its Sec-MS-GEC token
+    was only valid when it connected. A connection that errors, or that is left
+    mid-turn because the client went away, is closed rather than returned.
+
+    Must only be used from the shared event loop.
+    """
+
+    def __init__(self, max_idle, idle_timeout, max_age, url=WSS_URL,
+                 connect_timeout=UPSTREAM_CONNECT_TIMEOUT, receive_timeout=RECEIVE_TIMEOUT):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.receive_timeout = receive_timeout
+
+        self._session = None
+        self._idle = []  # Most recently used last
+        self._sweeper = None
+
+        self.in_use = 0
+        self.opened = 0
+        self.reused = 0
+        self.retired = 0
+        self.stale = 0
+        self.handshake_seconds = 0.0
+
+    def _connection_url(self):
+        separator = '&' if '?' in self.url else '?'
+        return (
+            f"{self.url}{separator}ConnectionId={connect_id()}"
+            f"&Sec-MS-GEC={DRM.generate_sec_ms_gec()}"
+            f"&Sec-MS-GEC-Version={SEC_MS_GEC_VERSION}"
+        )
+
+    async def _open(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                trust_env=True,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout),
+            )
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+        for attempt in range(2):
+            started = time.perf_counter()
+            try:
+                websocket = await self._session.ws_connect(
+                    self._connection_url(),
+                    compress=15,
+                    headers=DRM.headers_with_muid(WSS_HEADERS),
+                    ssl=_SSL_CONTEXT,
+                )
+            except aiohttp.ClientResponseError as e:
+                if e.status != 403 or attempt:
+                    raise
+                DRM.handle_client_response_error(e)  # Clock skew, retry with a corrected token
+                continue
+            handshake_seconds = time.perf_counter() - started
+            self.opened += 1
+            self.handshake_seconds += handshake_seconds
+            record_span("upstream_connect", handshake_seconds)
+            return _Connection(websocket, handshake_seconds)
+
+    async def acquire(self, fresh=False):
+        """Check out an idle connection that is still usable, or open a new one."""
+        now = time.monotonic()
+        while self._idle and not fresh:
+            connection = self._idle.pop()
+            if connection.is_alive(now, self.idle_timeout, self.max_age):
+                connection.reused = True
+                self.reused += 1
+                self.in_use += 1
+                return connection
+            self.retired += 1
+            await connection.close()
+
+        connection = await self._open()
+        self.in_use += 1
+        return connection
+
+    async def release(self, connection, reusable):
+        """Return a connection after a turn; only clean turns make it reusable."""
+        self.in_use -= 1
+        connection.last_used = time.monotonic()
+        connection.turns += 1
+        connection.reused = False
+        if (reusable and len(self._idle) < self.max_idle
+                and connection.is_alive(connection.last_used, self.idle_timeout, self.max_age)):
+            self._idle.append(connection)
+            return
+        self.retired += 1
+        await connection.close()
+
+    async def _sweep_forever(self):
+        """Close idle connections that have expired, so they do not linger between bursts."""
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_timeout / 2))
+            now = time.monotonic()
+            expired = [c for c in self._idle if not c.is_alive(now, self.idle_timeout, self.max_age)]
+            for connection in expired:
+                self._idle.remove(connection)
+                self.retired += 1
+                await connection.close()
+
+    async def close(self):
+        """Close every idle connection and the HTTP session."""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await connection.close()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self):
+        checkouts = self.opened + self.reused
+        avg_handshake = self.handshake_seconds / self.opened if self.opened else 0.0
+        return {
+            "enabled": True,
+            "idle": len(self._idle),
+            "in_use": self.in_use,
+            "max_idle": self.max_idle,
+            "opened": self.opened,
+            "reused": self.reused,
+            "retired": self.retired,
+            "stale": self.stale,
+            "reuse_ratio": round(self.reused / checkouts, 4) if checkouts else 0.0,
+            "avg_handshake_seconds": round(avg_handshake, 4),
+            "handshake_seconds_saved": round(self.reused * avg_handshake, 3),
+        }
+
+class PooledCommunicate:
+    """
+    Drop-in replacement for edge_tts.Communicate that runs its turns on pooled connections.
+
+    Text is split and escaped exactly as edge-tts does it and the same chunk dicts
+    are yielded (audio, plus WordBoundary or SentenceBoundary metadata), with offsets
+    compensated across the 4096-byte text chunks the same way.
+    """
+
+    def __init__(self, text, voice, *, rate="+0%", volume="+0%", pitch="+0Hz",
+                 boundary="SentenceBoundary", pool=None):
+        self.tts_config = TTSConfig(voice, rate, volume, pitch, boundary)
+        self.texts = split_text_by_byte_length(escape(remove_incompatible_characters(text)), 4096)
+        self.pool = pool or upstream_pool
+        self.offset_compensation = 0
+        self.cumulative_audio_bytes = 0
+
+    async def _send_speech_config(self, websocket):
+        word_boundary = self.tts_config.boundary == "WordBoundary"
+        await websocket.send_str(
+            f"X-Timestamp:{date_to_string()}\r\n"
+            "Content-Type:application/json; charset=utf-8\r\n"
+            "Path:speech.config\r\n\r\n"
+            '{"context":{"synthesis":{"audio":{"metadataoptions":{'
+            f'"sentenceBoundaryEnabled":"{str(not word_boundary).lower()}",'
+            f'"wordBoundaryEnabled":"{str(word_boundary).lower()}"'
+            "},"
+            '"outputFormat":"audio-24khz-48kbitrate-mono-mp3"'
+            "}}}}\r\n"
+        )
+
+    def _parse_metadata(self, data):
+        for meta_obj in json.loads(data)["Metadata"]:
+            meta_type = meta_obj["Type"]
+            if meta_type in ("WordBoundary", "SentenceBoundary"):
+                return {
+                    "type": meta_type,
+                    "offset": meta_obj["Data"]["Offset"] + self.offset_compensation,
+                    "duration": meta_obj["Data"]["Duration"],
+                    "text": unescape(meta_obj["Data"]["text"]["Text"]),
+                }
+            if meta_type == "SessionEnd":
+                continue
+            raise UnknownResponse(f"Unknown metadata type: {meta_type}")
+        raise UnexpectedResponse("No WordBoundary metadata found")
+
+    async def _turn(self, connection, partial_text):
+        """Synthesize one text chunk on a connection, yielding until turn.end."""
+        websocket = connection.websocket
+        if connection.boundary != self.tts_config.boundary:
+            await self._send_speech_config(websocket)
+            connection.boundary = self.tts_config.boundary
+        await websocket.send_str(ssml_headers_plus_data(connect_id(), date_to_string(), mkssml(self.tts_config, partial_text)))
+
+        audio_bytes = 0
+        while True:
+            received = await websocket.receive(timeout=self.pool.receive_timeout)
+            if received.type == aiohttp.WSMsgType.TEXT:
+                encoded_data = received.data.encode("utf-8")
+                parameters, data = get_headers_and_data(encoded_data, encoded_data.find(b"\r\n\r\n"))
+                path = parameters.get(b"Path")
+                if path == b"audio.metadata":
+                    yield self._parse_metadata(data)
+                elif path == b"turn.end":
+                    break
+                elif path not in (b"response", b"turn.start"):
+                    raise UnknownResponse("Unknown path received")
+            elif received.type == aiohttp.WSMsgType.BINARY:
+                if len(received.data) < 2:
+                    raise UnexpectedResponse("We received a binary message, but it is missing the header length.")
+                header_length = int.from_bytes(received.data[:2], "big")
+                if header_length > len(received.data):
+                    raise UnexpectedResponse("The header length is greater than the length of the data.")
+                parameters, data = get_headers_and_data(received.data, header_length)
+                if parameters.get(b"Path") != b"audio":
+                    raise UnexpectedResponse("Received binary message, but the path is not audio.")
+                content_type = parameters.get(b"Content-Type")
+                if content_type not in (b"audio/mpeg", None):
+                    raise UnexpectedResponse("Received binary message, but with an unexpected Content-Type.")
+                if content_type is None:
+                    if not data:
+                        continue
+                    raise UnexpectedResponse("Received binary message with no Content-Type, but with data.")
+                if not data:
+                    raise UnexpectedResponse("Received binary message, but it is missing the audio data.")
+                audio_bytes += len(data)
+                yield {"type": "audio", "data": data}
+            elif received.type == aiohttp.WSMsgType.ERROR:
+                raise WebSocketError(str(received.data) if received.data else "Unknown error")
+            else:  # CLOSE, CLOSING or CLOSED: the service hung up mid-turn
+                raise WebSocketError("Connection closed by the service")
+
+        if not audio_bytes:
+            raise NoAudioReceived("No audio was received. Please verify that your parameters are correct.")
+
+        # Offsets restart with every turn; shift them by the CBR duration of the audio so far
+        self.cumulative_audio_bytes += audio_bytes
+        self.offset_compensation = self.cumulative_audio_bytes * 8 * TICKS_PER_SECOND // MP3_BITRATE_BPS
+
+    async def stream(self):
+        for partial_text in self.texts:
+            fresh = False
+            while True:
+                connection = await self.pool.acquire(fresh=fresh)
+                reused = connection.reused
+                started = False
+                clean = False
+                try:
+                    async for message in self._turn(connection, partial_text):
+                        started = True
+                        yield message
+                    clean = True
+                except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, WebSocketError):
+                    if not reused or started:
+                        raise
+                    # The service closed the idle connection before we used it; retry on a new one
+                    self.pool.stale += 1
+                    fresh = True
+                    continue
+                finally:
+                    await self.pool.release(connection, clean)
+                break
+
+upstream_pool = UpstreamPool(UPSTREAM_POOL_SIZE, UPSTREAM_POOL_IDLE_TIMEOUT, UPSTREAM_POOL_MAX_AGE, UPSTREAM_URL) if UPSTREAM_POOL_SIZE > 0 else None
+
+def communicate(text, voice, rate="+0%", **kwargs):
+    """A Communicate-like object for one synthesis, on a pooled connection when pooling is enabled."""
+    if upstream_pool is not None:
+        return PooledCommunicate(text, voice, rate=rate, **kwargs)
+    # edge-tts only takes whole seconds
+    return edge_tts.Communicate(text=text, voice=voice, rate=rate, connect_timeout=math.ceil(UPSTREAM_CONNECT_TIMEOUT), **kwargs)
+
+def get_pool_stats():
+    if upstream_pool is None:
+        return {"enabled": False}
+    return upstream_pool.stats()
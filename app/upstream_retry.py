@@ -0,0 +1,272 @@
+# upstream_retry.py
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+
+import aiohttp
+from edge_tts.constants import MP3_BITRATE_BPS, TICKS_PER_SECOND
+from edge_tts.exceptions import NoAudioReceived, UnexpectedResponse, UnknownResponse, WebSocketError
+
+from config import DEFAULT_CONFIGS
+from metrics import HEDGES, RETRIES
+from mp3_frames import Mp3FrameAligner
+from scheduler import scheduler
+from upstream_pool import communicate
+
+UPSTREAM_FIRST_CHUNK_TIMEOUT = float(os.getenv('UPSTREAM_FIRST_CHUNK_TIMEOUT', str(DEFAULT_CONFIGS["UPSTREAM_FIRST_CHUNK_TIMEOUT"])))
+UPSTREAM_CHUNK_TIMEOUT = float(os.getenv('UPSTREAM_CHUNK_TIMEOUT', str(DEFAULT_CONFIGS["UPSTREAM_CHUNK_TIMEOUT"])))
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', str(DEFAULT_CONFIGS["UPSTREAM_RETRIES"])))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv('UPSTREAM_RETRY_BACKOFF', str(DEFAULT_CONFIGS["UPSTREAM_RETRY_BACKOFF"])))
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv('UPSTREAM_HEDGE_PERCENTILE', str(DEFAULT_CONFIGS["UPSTREAM_HEDGE_PERCENTILE"])))
+
+# Hedging waits for this many first-chunk samples before trusting the percentile
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 500
+
+# edge-tts output is 48 kbps CBR at 24 kHz: 576 samples per frame, 144 bytes each
+FRAME_BYTES = MP3_BITRATE_BPS // 8 * 576 // 24000
+
+# Failures worth another attempt; anything else (bad parameters, FFmpeg) is raised at once
+RETRYABLE_ERRORS = (
+    aiohttp.ClientError, asyncio.TimeoutError, ConnectionError,
+    UnexpectedResponse, UnknownResponse, WebSocketError,
+)
+
+class UpstreamTimeout(asyncio.TimeoutError):
+    """edge-tts did not produce audio within a stage's time budget."""
+
+class LatencyTracker:
+    """Rolling window of recent first-chunk latencies."""
+
+    def __init__(self, window):
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+
+    def percentile(self, p):
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+first_chunk_latency = LatencyTracker(HEDGE_WINDOW)
+
+_stats = {"retries": 0, "resumed": 0, "hedges_started": 0, "hedges_won": 0}
+
+def _hedge_delay():
+    if UPSTREAM_HEDGE_PERCENTILE <= 0:
+        return None
+    return first_chunk_latency.percentile(UPSTREAM_HEDGE_PERCENTILE)
+
+class _Attempt:
+    """One upstream synthesis, read ahead until its first audio arrives."""
+
+    def __init__(self, text, voice, rate, prosody):
+        self.stream = communicate(text, voice, rate=rate, **prosody).stream()
+        self.started = time.perf_counter()
+        self.latency = None
+        self.pending = []  # Messages read while waiting for the first audio
+        self.first_audio = asyncio.create_task(self._read_until_audio())
+
+    async def _read_until_audio(self):
+        while True:
+            try:
+                message = await self.stream.__anext__()
+            except StopAsyncIteration:
+                raise NoAudioReceived("No audio was received.") from None
+            self.pending.append(message)
+            if message["type"] == "audio":
+                self.latency = time.perf_counter() - self.started
+                return
+
+    async def messages(self, chunk_timeout):
+        """Every message of the synthesis, failing if the next one takes longer than chunk_timeout."""
+        pending, self.pending = self.pending, []
+        for message in pending:
+            yield message
+        while True:
+            try:
+                message = await asyncio.wait_for(self.stream.__anext__(), chunk_timeout)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise UpstreamTimeout(f"No audio from edge-tts for {chunk_timeout}s") from None
+            yield message
+
+    async def close(self):
+        if not self.first_audio.done():
+            self.first_audio.cancel()
+        try:
+            await self.first_audio
+        except BaseException:
+            pass
+        await self.stream.aclose()
+
+async def _start(text, voice, rate, prosody):
+    """
+    Start a synthesis and return it once its first audio has arrived.
+
+    With hedging enabled, a duplicate synthesis is started when the first one has
+    produced no audio after the configured percentile of recent first-chunk
+    latencies, and whichever answers first is kept. The duplicate is an extra
+    upstream session, so it is only started if admission control has a spare slot,
+    which it holds until the race is decided.
+    """
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + UPSTREAM_FIRST_CHUNK_TIMEOUT
+    attempts = {}
+    winner = None
+    hedge_ticket = None
+    try:
+        primary = _Attempt(text, voice, rate, prosody)
+        attempts[primary.first_audio] = primary
+
+        hedge_delay = _hedge_delay()
+        if hedge_delay is not None and hedge_delay < UPSTREAM_FIRST_CHUNK_TIMEOUT:
+            done, _ = await asyncio.wait([primary.first_audio], timeout=hedge_delay)
+            if not done:
+                hedge_ticket = scheduler.try_acquire()
+            if hedge_ticket is not None:
+                hedge = _Attempt(text, voice, rate, prosody)
+                attempts[hedge.first_audio] = hedge
+                _stats["hedges_started"] += 1
+                HEDGES.inc("started")
+
+        waiting = set(attempts)
+        error = None
+        while waiting and winner is None:
+            done, waiting = await asyncio.wait(waiting, timeout=max(0, give_up_at - loop.time()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                if task.exception() is None:
+                    winner = winner or attempts[task]
+                else:
+                    error = task.exception()
+
+        if winner is None:
+            if error is not None:
+                raise error
+            first_chunk_latency.observe(UPSTREAM_FIRST_CHUNK_TIMEOUT)
+            raise UpstreamTimeout(f"No audio from edge-tts within {UPSTREAM_FIRST_CHUNK_TIMEOUT}s")
+
+        first_chunk_latency.observe(winner.latency)
+        if winner is not primary:
+            _stats["hedges_won"] += 1
+            HEDGES.inc("won")
+        return winner
+    finally:
+        for attempt in attempts.values():
+            if attempt is not winner:
+                await attempt.close()
+        if hedge_ticket is not None:
+            scheduler.release(hedge_ticket)  # One session is left, covered by the request's own slot
+
+def _ticks_to_bytes(ticks):
+    return ticks * MP3_BITRATE_BPS // (8 * TICKS_PER_SECOND)
+
+def _bytes_to_ticks(audio_bytes):
+    return audio_bytes * 8 * TICKS_PER_SECOND // MP3_BITRATE_BPS
+
+def _resume_point(text, sentences, delivered):
+    """
+    Where to pick up a synthesis of text after delivered bytes of its audio reached the client.
+
+    A new synthesis is not byte-identical to the one that broke, so it can only take
+    over where the client's audio ends between two sentences (or words, with word
+    boundaries): the last one started is fully delivered and the next has not begun.
+    Returns the text still to synthesize, the whole text if only the leading silence
+    was delivered, or None if the stream broke in the middle of a sentence.
+    """
+    if sentences and delivered <= sentences[0][0]:
+        return text
+    cursor = 0
+    for i, (start, end, sentence) in enumerate(sentences):
+        index = text.find(sentence, cursor) if sentence else -1
+        if index < 0 or delivered < end:
+            return None
+        cursor = index + len(sentence)
+        if i + 1 == len(sentences) or delivered <= sentences[i + 1][0]:
+            return text[cursor:]
+    return None
+
+async def resilient_stream(text, voice, rate, word_boundaries=False, **prosody):
+    """
+    Stream the mp3 frames of one synthesis, retrying sessions that fail or stall.
+
+    prosody holds optional pitch and volume settings passed on to edge-tts. With
+    word_boundaries, edge-tts is asked for WordBoundary metadata and every word is
+    yielded too, as its message dict with the offset (in ticks) moved to where the
+    word plays in the yielded audio, across retries.
+
+    The first audio must arrive within UPSTREAM_FIRST_CHUNK_TIMEOUT and each later
+    message within UPSTREAM_CHUNK_TIMEOUT. A failed session is retried up to
+    UPSTREAM_RETRIES times in a row (attempts that delivered no whole sentence count
+    against the same budget) with jittered exponential backoff. If audio had
+    already been delivered, the retry synthesizes the rest of the text after the last
+    sentence the client has in full (see _resume_point); a stream that broke in the
+    middle of a sentence is not retried. Only whole frames are yielded, so the joins
+    are clean.
+    """
+    if word_boundaries:
+        prosody = {**prosody, "boundary": "WordBoundary"}
+    failures = 0
+    origin = 0  # Position in the yielded audio of this attempt's first byte
+    last_word = -1  # Offset of the last word yielded, so resumed attempts do not repeat words
+    while True:
+        aligner = Mp3FrameAligner()
+        received = 0
+        sentences = []  # (start byte, end byte, text) of each sentence boundary
+        attempt = None
+        try:
+            attempt = await _start(text, voice, rate, prosody)
+            async for message in attempt.messages(UPSTREAM_CHUNK_TIMEOUT):
+                if message["type"] == "audio":
+                    frames = aligner.feed(message["data"])
+                    received += len(frames)
+                    if frames:
+                        yield frames
+                elif message["type"] in ("SentenceBoundary", "WordBoundary"):
+                    start = _ticks_to_bytes(message["offset"])
+                    sentences.append((start, start + _ticks_to_bytes(message["duration"]), message["text"]))
+                    offset = message["offset"] + _bytes_to_ticks(origin)
+                    if word_boundaries and offset > last_word:
+                        last_word = offset
+                        yield {**message, "offset": offset}
+            return
+        except RETRYABLE_ERRORS as e:
+            if received:
+                remaining = _resume_point(text, sentences, received)
+                if remaining is None:
+                    raise  # Broke mid-sentence: a resynthesis would repeat or cut audio the client has
+                if not remaining.strip():
+                    return  # Every sentence was delivered, only trailing silence is missing
+                if len(remaining) < len(text):
+                    failures = 0  # The budget is per interruption, as long as each attempt gets through a sentence
+            failures += 1
+            if failures > UPSTREAM_RETRIES:
+                raise
+            reason = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+            _stats["retries"] += 1
+            RETRIES.inc(reason)
+            if received:
+                _stats["resumed"] += 1
+                text = remaining
+                origin += received
+            print(f"Upstream {reason} after {received} bytes, retrying ({failures}/{UPSTREAM_RETRIES}): {e}")
+            await asyncio.sleep(UPSTREAM_RETRY_BACKOFF * 2 ** (failures - 1) * random.uniform(0.5, 1.5))
+        finally:
+            if attempt is not None:
+                await attempt.close()
+
+def get_retry_stats():
+    threshold = _hedge_delay()
+    return {
+        **_stats,
+        "hedge_threshold_seconds": round(threshold, 4) if threshold is not None else None,
+    }
@@ -19,20 +19,33 @@ API_KEY = os.getenv('API_KEY', DEFAULT_CONFIGS["API_KEY"])
 REQUIRE_API_KEY = getenv_bool('REQUIRE_API_KEY', DEFAULT_CONFIGS["REQUIRE_API_KEY"])
 DETAILED_ERROR_LOGGING = getenv_bool('DETAILED_ERROR_LOGGING', DEFAULT_CONFIGS["DETAILED_ERROR_LOGGING"])
 
+def api_key_error(auth_header):
+    """Return why a request with this Authorization header is refused, or None if it may go ahead."""
+    if not REQUIRE_API_KEY:
+        return None
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return "Missing or invalid API key"
+    token = auth_header.split('Bearer ')[1]
+    if token != API_KEY:
+        return "Invalid API key"
+    return None
+
 def require_api_key(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not REQUIRE_API_KEY:
-            return f(*args, **kwargs)
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({"error": "Missing or invalid API key"}), 401
-        token = auth_header.split('Bearer ')[1]
-        if token != API_KEY:
-            return jsonify({"error": "Invalid API key"}), 401
+        error = api_key_error(request.headers.get('Authorization'))
+        if error is not None:
+            return jsonify({"error": error}), 401
         return f(*args, **kwargs)
     return decorated_function
 
+def get_client_key():
+    """
+    Identify the caller for per-client limits by its remote address. Every client
+    shares the one API_KEY, so the bearer token cannot tell them apart.
+    """
+    return request.remote_addr or 'anonymous'
+
 # Mapping of audio format to MIME type
 AUDIO_FORMAT_MIME_TYPES = {
     "mp3": "audio/mpeg",
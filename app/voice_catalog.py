@@ -0,0 +1,166 @@
+# voice_catalog.py
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import edge_tts
+
+from config import DEFAULT_CONFIGS
+import async_bridge
+
+VOICE_CATALOG_TTL = float(os.getenv('VOICE_CATALOG_TTL', str(DEFAULT_CONFIGS["VOICE_CATALOG_TTL"])))
+VOICE_CATALOG_SNAPSHOT = os.getenv('VOICE_CATALOG_SNAPSHOT', DEFAULT_CONFIGS["VOICE_CATALOG_SNAPSHOT"]) or os.path.join(tempfile.gettempdir(), 'openai-edge-tts-voices.json')
+
+# Voice list written when the Docker image is built (read only), used until the first refresh succeeds
+BUNDLED_SNAPSHOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'voices_bundled.json')
+
+# Retry sooner than the TTL when a refresh fails
+RETRY_INTERVAL = 60
+
+class VoiceCatalogUnavailable(RuntimeError):
+    """No voice list has been loaded: no snapshot could be read and edge-tts could not be reached."""
+
+class VoiceIndex:
+    """Immutable set of voice lookup tables, replaced as a whole on refresh."""
+
+    def __init__(self, voices):
+        self.voices = [
+            {"name": v['ShortName'], "gender": v['Gender'], "language": v['Locale']}
+            for v in voices
+        ]
+        self.by_name = {}
+        self.by_locale = {}
+        self.by_gender = {}
+        for raw, voice in zip(voices, self.voices):
+            self.by_name[raw['ShortName']] = voice
+            if raw.get('Name'):
+                self.by_name[raw['Name']] = voice  # edge-tts also accepts the long form
+            self.by_locale.setdefault(voice['language'], []).append(voice)
+            self.by_gender.setdefault(voice['gender'].lower(), []).append(voice)
+
+class VoiceCatalog:
+    """
+    In-memory voice catalogue with per-name, per-locale and per-gender indexes.
+
+    It is loaded from the snapshot of the last refresh when one exists, and from the
+    bundled voice list otherwise, which lets a server that has one start offline. The
+    source tree does not include it: it is written when the Docker image is built. It is refreshed
+    from edge-tts in the background every VOICE_CATALOG_TTL seconds, straight away
+    when only the bundled list is loaded, and each successful refresh is written to
+    snapshot_path, which belongs in a writable cache directory.
+    """
+
+    def __init__(self, ttl, snapshot_path=None, bundled_path=None):
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.bundled_path = bundled_path
+        self.index = None
+        self.updated_at = None
+        self.source = None
+        self._started = False
+        self._refresh_task = None
+
+    @property
+    def loaded(self):
+        return self.index is not None
+
+    def load_snapshot(self):
+        """Load the last refreshed snapshot, or the bundled one. Returns False if neither could be read."""
+        return self._load_file(self.snapshot_path, 'snapshot') or self._load_file(self.bundled_path, 'bundled')
+
+    def _load_file(self, path, source):
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                voices = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Voice catalogue: could not read {source} voice list {path}: {e}")
+            return False
+        self._install(voices, source, os.path.getmtime(path))
+        return True
+
+    def _install(self, voices, source, updated_at):
+        self.index = VoiceIndex(voices)
+        self.updated_at = updated_at
+        self.source = source
+
+    def _write_snapshot(self, voices):
+        if not self.snapshot_path:
+            return
+        try:
+            directory = os.path.dirname(self.snapshot_path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(voices, f)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"Voice catalogue: could not write snapshot {self.snapshot_path}: {e}")
+
+    async def refresh(self):
+        """Fetch the voice list from edge-tts and swap in new indexes."""
+        voices = await edge_tts.list_voices()
+        self._install(voices, 'edge-tts', time.time())
+        await asyncio.to_thread(self._write_snapshot, voices)
+
+    async def _refresh_forever(self):
+        while True:
+            age = time.time() - self.updated_at if self.updated_at and self.source != 'bundled' else self.ttl
+            if age < self.ttl:
+                await asyncio.sleep(self.ttl - age)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Voice catalogue: refresh failed: {e}")
+                await asyncio.sleep(RETRY_INTERVAL)
+
+    async def _load(self):
+        if not await asyncio.to_thread(self.load_snapshot):
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Voice catalogue: initial load failed, will retry in the background: {e}")
+        self._refresh_task = asyncio.create_task(self._refresh_forever())
+
+    def start(self):
+        """Load the catalogue and schedule background refreshes on the shared loop."""
+        if self._started:
+            return
+        self._started = True
+        async_bridge.run(self._load())
+
+    async def start_async(self):
+        """Same as start(), for callers already running on the shared loop."""
+        if self._started:
+            return
+        self._started = True
+        await self._load()
+
+    def ensure_loaded(self):
+        """Load the catalogue on first use when start() was not called."""
+        if self.index is None:
+            self.start()
+        return self.index
+
+    def stats(self):
+        index = self.index
+        return {
+            "loaded": index is not None,
+            "voices": len(index.voices) if index else 0,
+            "locales": len(index.by_locale) if index else 0,
+            "source": self.source,
+            "age_seconds": round(time.time() - self.updated_at, 1) if self.updated_at else None,
+        }
+
+voice_catalog = VoiceCatalog(VOICE_CATALOG_TTL, VOICE_CATALOG_SNAPSHOT, BUNDLED_SNAPSHOT)
+
+if __name__ == '__main__':
+    # Regenerate the bundled voice list: python app/voice_catalog.py
+    bundle = VoiceCatalog(0, BUNDLED_SNAPSHOT)
+    asyncio.run(bundle.refresh())
+    print(f"Wrote {len(bundle.index.voices)} voices to {BUNDLED_SNAPSHOT}")
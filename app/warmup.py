@@ -0,0 +1,171 @@
+# warmup.py
+
+import asyncio
+import json
+import os
+import time
+
+import yaml
+
+from config import DEFAULT_CONFIGS
+from audio_cache import audio_cache
+from handle_text import prepare_tts_input_with_context
+from tts_handler import is_known_voice, pin_speech_async
+from utils import getenv_bool, AUDIO_FORMAT_MIME_TYPES
+import async_bridge
+
+WARMUP_MANIFEST = os.getenv('WARMUP_MANIFEST', DEFAULT_CONFIGS["WARMUP_MANIFEST"])
+WARMUP_CONCURRENCY = int(os.getenv('WARMUP_CONCURRENCY', str(DEFAULT_CONFIGS["WARMUP_CONCURRENCY"])))
+
+DEFAULT_VOICE = os.getenv('DEFAULT_VOICE', DEFAULT_CONFIGS["DEFAULT_VOICE"])
+DEFAULT_RESPONSE_FORMAT = os.getenv('DEFAULT_RESPONSE_FORMAT', DEFAULT_CONFIGS["DEFAULT_RESPONSE_FORMAT"])
+DEFAULT_SPEED = float(os.getenv('DEFAULT_SPEED', str(DEFAULT_CONFIGS["DEFAULT_SPEED"])))
+REMOVE_FILTER = getenv_bool('REMOVE_FILTER', DEFAULT_CONFIGS["REMOVE_FILTER"])
+VALIDATE_VOICES = getenv_bool('VALIDATE_VOICES', DEFAULT_CONFIGS["VALIDATE_VOICES"])
+
+# Admission control key of warmup renders, so they are limited like one client
+WARMUP_CLIENT_KEY = 'warmup'
+
+class WarmupError(ValueError):
+    """The warmup manifest cannot be read."""
+
+def load_manifest(path):
+    """
+    Read a warmup manifest: a YAML list (.yaml, .yml) or one JSON object per line.
+
+    Each entry has an input and optionally a voice, speed and response_format, as
+    in a /v1/audio/speech request. Blank lines and lines starting with # are
+    skipped in JSONL manifests. Raises WarmupError naming the first bad entry.
+    """
+    with open(path, encoding='utf-8') as f:
+        content = f.read()
+
+    if path.lower().endswith(('.yaml', '.yml')):
+        try:
+            raw_entries = yaml.safe_load(content) or []
+        except yaml.YAMLError as e:
+            raise WarmupError(f"{path}: {e}") from None
+        if not isinstance(raw_entries, list):
+            raise WarmupError(f"{path}: expected a list of entries")
+        numbered = [(f"entry {index + 1}", raw) for index, raw in enumerate(raw_entries)]
+    else:
+        numbered = []
+        for number, line in enumerate(content.splitlines(), 1):
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            try:
+                numbered.append((f"line {number}", json.loads(line)))
+            except json.JSONDecodeError as e:
+                raise WarmupError(f"{path}, line {number}: {e}") from None
+
+    entries = []
+    for where, raw in numbered:
+        if not isinstance(raw, dict) or not isinstance(raw.get('input'), str) or not raw['input'].strip():
+            raise WarmupError(f"{path}, {where}: missing 'input'")
+        try:
+            speed = float(raw.get('speed', DEFAULT_SPEED))
+        except (TypeError, ValueError):
+            raise WarmupError(f"{path}, {where}: invalid 'speed'") from None
+        response_format = raw.get('response_format', DEFAULT_RESPONSE_FORMAT)
+        if response_format not in AUDIO_FORMAT_MIME_TYPES:
+            raise WarmupError(f"{path}, {where}: unsupported response_format '{response_format}'")
+        entries.append({"input": raw['input'], "voice": raw.get('voice', DEFAULT_VOICE),
+                        "speed": speed, "response_format": response_format})
+    return entries
+
+class Warmup:
+    """
+    Renders the phrases of a warmup manifest in the background at startup.
+
+    Every entry goes through the same text filter and generate_speech path as a
+    /v1/audio/speech request, up to WARMUP_CONCURRENCY at a time, and its audio is
+    pinned in the audio cache, so the matching requests are answered from memory
+    and never evicted. The server is ready once every entry has been attempted;
+    entries that fail are reported but do not hold readiness back.
+    """
+
+    def __init__(self, manifest, concurrency):
+        self.manifest = manifest
+        self.concurrency = max(1, concurrency)
+        self.state = "disabled" if not manifest else "pending"
+        self.entries = 0
+        self.pinned = 0
+        self.unpinned = 0  # Rendered, but the pinned region was full
+        self.failed = 0
+        self.started_at = None
+        self.seconds = None
+        self._started = False
+        self._task = None
+
+    @property
+    def ready(self):
+        return self.state in ("disabled", "ready")
+
+    def start(self):
+        """
+        Read the manifest and start rendering it on the shared loop, without waiting.
+
+        A manifest that cannot be read raises WarmupError (or OSError) here, so a bad
+        deploy fails at startup instead of never becoming ready.
+        """
+        if self._started or self.state == "disabled":
+            return
+        entries = load_manifest(self.manifest)
+        self._started = True
+        async_bridge.submit(self._run(entries))
+
+    async def start_async(self):
+        """Same as start(), for callers already running on the shared loop."""
+        if self._started or self.state == "disabled":
+            return
+        entries = await asyncio.to_thread(load_manifest, self.manifest)
+        self._started = True
+        self._task = asyncio.create_task(self._run(entries))
+
+    async def _render(self, entry, semaphore):
+        async with semaphore:
+            voice = entry["voice"]
+            try:
+                if VALIDATE_VOICES and not await asyncio.to_thread(is_known_voice, voice):
+                    raise WarmupError(f"Unknown voice '{voice}'")
+                text = entry["input"] if REMOVE_FILTER else await asyncio.to_thread(prepare_tts_input_with_context, entry["input"])
+                if await pin_speech_async(text, voice, entry["response_format"], entry["speed"], WARMUP_CLIENT_KEY):
+                    self.pinned += 1
+                else:
+                    self.unpinned += 1
+                    print(f"Warmup: no room left in the pinned region (AUDIO_CACHE_PINNED_MB) for '{entry['input'][:40]}'")
+            except Exception as e:
+                self.failed += 1
+                print(f"Warmup: failed to render '{entry['input'][:40]}': {e}")
+
+    async def _run(self, entries):
+        self.state = "warming"
+        self.entries = len(entries)
+        self.started_at = time.perf_counter()
+        try:
+            if audio_cache is None:
+                print("Warmup: the audio cache is disabled, nothing to warm")
+                return
+            semaphore = asyncio.Semaphore(self.concurrency)
+            await asyncio.gather(*(self._render(entry, semaphore) for entry in entries))
+        finally:
+            self.seconds = time.perf_counter() - self.started_at
+            self.state = "ready"
+        print(f"Warmup: {self.pinned} of {self.entries} phrases pinned in {self.seconds:.1f}s"
+              f"{f', {self.failed} failed' if self.failed else ''}")
+
+    def status(self):
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "entries": self.entries,
+            "pinned": self.pinned,
+            "unpinned": self.unpinned,
+            "failed": self.failed,
+            "seconds": round(self.seconds, 3) if self.seconds is not None else None,
+        }
+
+warmup = Warmup(WARMUP_MANIFEST, WARMUP_CONCURRENCY)
+
+def get_warmup_stats():
+    return warmup.status()
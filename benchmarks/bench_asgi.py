@@ -0,0 +1,136 @@
+# bench_asgi.py
+"""
+Side-by-side comparison of the gevent (server.py) and ASGI (asgi.py under uvicorn)
+serving modes against the fake edge-tts backend.
+
+Each mode runs in its own subprocess. A single asyncio client opens N concurrent
+streaming connections (raw audio or SSE) and reports requests/sec, latency and
+time-to-first-byte, plus the server's peak RSS and thread count.
+
+Usage: python benchmarks/bench_asgi.py [connections] [audio|sse]
+"""
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def serve(mode, port):
+    """Subprocess entry point: serve the app in the given mode until killed."""
+    import harness  # Installs the fake backend and benchmark settings
+
+    if mode == 'gevent':
+        from gevent.pywsgi import WSGIServer
+        import server
+        server.voice_catalog.start()
+        WSGIServer(('127.0.0.1', port), server.app, log=None, backlog=4096).serve_forever()
+    else:
+        import uvicorn
+        import asgi
+        uvicorn.run(asgi.app, host='127.0.0.1', port=port, log_level='warning', backlog=4096)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def proc_status(pid):
+    """Peak RSS (MB) and thread count of a process, from /proc."""
+    values = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                fields = value.split()
+                if fields:
+                    values[key] = fields[0]
+    except OSError:
+        return None, None
+    return int(values['VmHWM']) / 1024, int(values['Threads'])
+
+async def fetch(port, body, results):
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    payload = json.dumps(body).encode('utf-8')
+    writer.write(
+        b"POST /v1/audio/speech HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+        b"Content-Type: application/json\r\nContent-Length: " + str(len(payload)).encode() + b"\r\n\r\n" + payload
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    ttfb = time.perf_counter() - started
+    size = len(await reader.read())
+    writer.close()
+    results.append((status_line.split()[1] == b'200', ttfb, time.perf_counter() - started, size))
+
+async def drive(port, connections, make_body):
+    # Wait for the server to accept connections, then warm it up
+    for _ in range(200):
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            break
+        except OSError:
+            await asyncio.sleep(0.05)
+    await fetch(port, {"input": "Warm up.", "voice": "alloy"}, [])
+
+    results = []
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        fetch(port, make_body(i), results) for i in range(connections)
+    ))
+    return results, time.perf_counter() - started
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] if ordered else float('nan')
+
+def run_mode(mode, connections, stream_format):
+    port = free_port()
+    env = dict(os.environ, MAX_CONCURRENT_SYNTHESIS='0', MAX_QUEUE_SIZE='0')
+    process = subprocess.Popen([sys.executable, __file__, '--serve', mode, str(port)], env=env, cwd=BENCH_DIR,
+                               stdout=subprocess.DEVNULL)
+    try:
+        make_body = lambda i: {"input": f"Concurrent request {i}. " * 4, "voice": "alloy", "stream_format": stream_format}
+        results, elapsed = asyncio.run(drive(port, connections, make_body))
+        peak_rss, threads = proc_status(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+
+    ok = [r for r in results if r[0]]
+    return {
+        "mode": mode,
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "rps": len(ok) / elapsed,
+        "p50": percentile([r[2] for r in ok], 50),
+        "p99": percentile([r[2] for r in ok], 99),
+        "ttfb_p50": percentile([r[1] for r in ok], 50),
+        "ttfb_p99": percentile([r[1] for r in ok], 99),
+        "peak_rss_mb": peak_rss,
+        "threads": threads,
+    }
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve(sys.argv[2], int(sys.argv[3]))
+        return
+
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    stream_format = sys.argv[2] if len(sys.argv) > 2 else 'audio'
+
+    print(f"{connections} concurrent {stream_format} streams\n")
+    print(f"{'mode':<8} {'ok':>6} {'failed':>6} {'rps':>8} {'p50':>7} {'p99':>7} {'ttfb p50':>9} {'ttfb p99':>9} {'rss MB':>7} {'threads':>7}")
+    for mode in ('gevent', 'asgi'):
+        r = run_mode(mode, connections, stream_format)
+        print(f"{r['mode']:<8} {r['ok']:>6} {r['failed']:>6} {r['rps']:>8.1f} {r['p50']:>7.3f} {r['p99']:>7.3f} "
+              f"{r['ttfb_p50']:>9.3f} {r['ttfb_p99']:>9.3f} {r['peak_rss_mb'] or 0:>7.1f} {r['threads'] or 0:>7}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# bench_concurrency.py
+"""
+Checks that concurrent speech requests overlap their upstream I/O.
+
+Starts the gevent server against the fake edge-tts backend, times one request,
+then fires N requests in parallel. With the shared asyncio loop, N parallel
+requests should finish in about the time of one.
+
+Usage: python benchmarks/bench_concurrency.py [N]
+"""
+
+import json
+import sys
+import threading
+import time
+import urllib.request
+
+from harness import fake_edge_tts, serve_while
+
+def post_speech(url, text):
+    body = json.dumps({"input": text, "voice": "alloy"}).encode('utf-8')
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req) as resp:
+        return len(resp.read())
+
+def run_benchmark(base_url, n):
+    url = f"{base_url}/v1/audio/speech"
+    results = {}
+
+    started = time.perf_counter()
+    post_speech(url, "Warm up request 0")
+    results['single'] = time.perf_counter() - started
+
+    errors = results['errors'] = []
+    def worker(i):
+        try:
+            post_speech(url, f"Parallel request number {i}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results['parallel'] = time.perf_counter() - started
+    return results
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    results = serve_while(run_benchmark, n)
+
+    single, parallel, errors = results['single'], results['parallel'], results['errors']
+    print(f"upstream latency: {fake_edge_tts.LATENCY:.3f}s")
+    print(f"1 request:        {single:.3f}s")
+    print(f"{n} parallel:      {parallel:.3f}s ({parallel / single:.2f}x a single request)")
+    if errors:
+        print(f"{len(errors)} requests failed, first error: {errors[0]}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
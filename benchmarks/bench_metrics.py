@@ -0,0 +1,59 @@
+# bench_metrics.py
+"""
+Measures the cost of the Prometheus instrumentation on the request path.
+
+Times the per-request metric updates (request counter, in-flight gauge, stage
+histograms, byte counter) with METRICS_ENABLED on and off, and the cost of rendering
+a /metrics scrape once a realistic number of label combinations exist.
+
+Usage: python benchmarks/bench_metrics.py
+"""
+
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+
+import metrics
+from metrics import ERRORS, IN_FLIGHT, REQUESTS, RESPONSE_BYTES, observe_stage, render_metrics, time_stage
+
+VOICES = ["alloy", "echo", "fable", "onyx", "nova", "shimmer"]
+FORMATS = ["mp3", "opus", "aac", "flac", "wav", "pcm"]
+
+def one_request(i=0):
+    """The metric updates made while serving one streamed speech request."""
+    IN_FLIGHT.inc("speech")
+    with time_stage("text_filter"):
+        pass
+    REQUESTS.inc("speech", FORMATS[i % len(FORMATS)], VOICES[i % len(VOICES)])
+    observe_stage("upstream_first_chunk", 0.3)
+    observe_stage("upstream_total", 1.2)
+    observe_stage("response_write", 1.25)
+    RESPONSE_BYTES.inc("speech", amount=48_000)
+    IN_FLIGHT.dec("speech")
+    if i % 50 == 0:
+        ERRORS.inc("upstream")
+
+def bench(func):
+    number, _ = timeit.Timer(func).autorange()
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    return best / number
+
+def main():
+    metrics.METRICS_ENABLED = False
+    disabled = bench(one_request)
+    metrics.METRICS_ENABLED = True
+    enabled = bench(one_request)
+
+    for i in range(len(VOICES) * len(FORMATS)):
+        one_request(i)
+    scrape = bench(render_metrics)
+
+    print(f"per-request updates, metrics disabled: {disabled * 1e6:8.2f}us")
+    print(f"per-request updates, metrics enabled:  {enabled * 1e6:8.2f}us")
+    print(f"/metrics render ({len(render_metrics())} bytes):  {scrape * 1e6:8.2f}us")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# bench_normalizer.py
+"""
+Micro-benchmark for handle_text.prepare_tts_input_with_context.
+
+Before timing, the current normalizer is checked against the original multi-pass
+implementation (kept below as reference_prepare) on a golden corpus of Markdown
+edge cases plus the benchmark documents; any difference aborts the run.
+
+Usage: python benchmarks/bench_normalizer.py
+"""
+
+import os
+import re
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+
+import emoji
+from handle_text import IncrementalTextNormalizer, prepare_tts_input_with_context
+
+def reference_prepare(text):
+    """The original normalizer: emoji removal plus ten uncompiled re.sub passes."""
+    text = emoji.replace_emoji(text, replace='')
+
+    def header_replacer(match):
+        level = len(match.group(1))
+        header_text = match.group(2).strip()
+        if level == 1:
+            return f"Title — {header_text}\n"
+        elif level == 2:
+            return f"Section — {header_text}\n"
+        else:
+            return f"Subsection — {header_text}\n"
+
+    text = re.sub(r"^(#{1,6})\s+(.*)", header_replacer, text, flags=re.MULTILINE)
+    text = re.sub(r"\[([^\]]+)\]\([^\)]+\)", r"\1", text)
+    text = re.sub(r"`([^`]+)`", r"code snippet: \1", text)
+    text = re.sub(r"(\*\*|__|\*|_)", '', text)
+    text = re.sub(r"```([\s\S]+?)```", r"(code block omitted)", text)
+    text = re.sub(r"!\[([^\]]*)\]\([^\)]+\)", r"Image: \1", text)
+    text = re.sub(r"</?[^>]+(>|$)", '', text)
+    text = re.sub(r"\n{2,}", '\n\n', text)
+    text = re.sub(r" {2,}", ' ', text)
+    return text.strip()
+
+GOLDEN_CORPUS = [
+    "",
+    "Plain sentence with nothing to clean.",
+    "# Title\n## Section\n### Sub\n#### Deeper\n####### Not a header",
+    "#\nheader text on the next line",
+    "Read [the docs](https://example.com/docs) and [this](http://x.y).",
+    "![alt text](image.png) and ![](empty.png)",
+    "Use `pip install` then ```python\nprint('hi')\n``` done",
+    "**bold** __bold__ *italic* _italic_ snake_case_name",
+    "<p>Hello <b>world</b></p> and an unclosed <tag",
+    "Too   many    spaces\n\n\n\nand newlines\n\n\n",
+    "Emoji 😀 and 👍🏽 and 👨‍👩‍👧 and ❤️ and #️⃣ and stray ️ selector",
+    "Accents: café, naïve, 日本語のテキスト。",
+    "   leading and trailing whitespace   \n",
+    "Nested **[bold link](u)** and `code with *stars*`",
+]
+
+PARAGRAPH = (
+    "## Release notes\n\n"
+    "This **release** adds [streaming](https://example.com/streaming) support, "
+    "fixes `generate_speech` for _long_ inputs and improves <em>latency</em> 🚀.\n\n"
+    "- Item one with ![diagram](d.png)\n- Item two   with  extra spaces\n\n\n"
+    "```bash\ncurl -X POST http://localhost:5050/v1/audio/speech\n```\n\n"
+)
+
+DOCUMENTS = {
+    "small (200 B)": PARAGRAPH[:200],
+    "medium (20 KB)": PARAGRAPH * (20_000 // len(PARAGRAPH)),
+    "large (1 MB)": PARAGRAPH * (1_000_000 // len(PARAGRAPH)),
+    "large ascii (1 MB)": PARAGRAPH.replace("🚀", "").replace("—", "-") * (1_000_000 // len(PARAGRAPH)),
+}
+
+def check_golden():
+    for text in GOLDEN_CORPUS + list(DOCUMENTS.values()):
+        expected = reference_prepare(text)
+        actual = prepare_tts_input_with_context(text)
+        if actual != expected:
+            sys.exit(f"Output differs from reference for input {text[:80]!r}:\n{actual[:200]!r}\n!=\n{expected[:200]!r}")
+    print(f"golden corpus: {len(GOLDEN_CORPUS) + len(DOCUMENTS)} inputs match the reference\n")
+
+def bench(func, text):
+    number, _ = timeit.Timer(lambda: func(text)).autorange()
+    best = min(timeit.repeat(lambda: func(text), number=number, repeat=5))
+    return best / number
+
+def bench_incremental(text, piece=64):
+    normalizer = IncrementalTextNormalizer()
+    for start in range(0, len(text), piece):
+        normalizer.feed(text[start:start + piece])
+    normalizer.flush()
+
+def main():
+    check_golden()
+    print(f"{'document':<20} {'reference':>12} {'current':>12} {'speedup':>8} {'incremental':>12}")
+    for name, text in DOCUMENTS.items():
+        reference = bench(reference_prepare, text)
+        current = bench(prepare_tts_input_with_context, text)
+        incremental = bench(bench_incremental, text)
+        print(f"{name:<20} {reference * 1e3:>10.3f}ms {current * 1e3:>10.3f}ms {reference / current:>7.1f}x {incremental * 1e3:>10.3f}ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# bench_prefork.py
+"""
+Throughput of the pre-fork worker mode (WORKERS=N) on a CPU-heavy workload.
+
+Each request sends a long Markdown document and asks for the SSE stream, so the
+text filter and the base64/JSON encoding of every audio chunk dominate, while
+the fake edge-tts backend adds only a small upstream delay. The server is started
+once per worker count and driven with the same set of concurrent requests.
+
+Usage: python benchmarks/bench_prefork.py [max_workers] [connections]
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+from bench_asgi import BENCH_DIR, drive, free_port, percentile, proc_status
+
+PARAGRAPH = (
+    "## Section\n\nThis **paragraph** has [links](https://example.com), `code`, _emphasis_ "
+    "and <b>tags</b> to clean up before synthesis. 🚀\n\n"
+)
+
+def serve():
+    """Subprocess entry point: run server.py as a script (honouring WORKERS and PORT)."""
+    import runpy
+    import harness
+
+    runpy.run_path(os.path.join(harness.ROOT, 'app', 'server.py'), run_name='__main__')
+
+def process_tree_rss(pid):
+    """Peak RSS (MB) summed over the supervisor and its workers."""
+    total, _ = proc_status(pid)
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        children = []
+    for child in children:
+        rss, _ = proc_status(child)
+        total = (total or 0) + (rss or 0)
+    return total
+
+def run(workers, connections):
+    port = free_port()
+    env = dict(os.environ, WORKERS=str(workers), PORT=str(port), MAX_CONCURRENT_SYNTHESIS='0', MAX_QUEUE_SIZE='0',
+               FAKE_TTS_LATENCY=os.getenv('FAKE_TTS_LATENCY', '0.05'))
+    process = subprocess.Popen([sys.executable, __file__, '--serve'], env=env, cwd=BENCH_DIR,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        make_body = lambda i: {"input": f"Request {i}.\n\n" + PARAGRAPH * 150, "voice": "alloy", "stream_format": "sse"}
+        time.sleep(1)  # Give the workers time to fork
+        results, elapsed = asyncio.run(drive(port, connections, make_body))
+        rss = process_tree_rss(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+
+    ok = [r for r in results if r[0]]
+    return len(ok), len(results) - len(ok), len(ok) / elapsed, percentile([r[2] for r in ok], 50), percentile([r[2] for r in ok], 99), rss
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve()
+        return
+
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    connections = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    print(f"{connections} concurrent SSE requests with ~{len(PARAGRAPH) * 150 // 1000} KB Markdown inputs, {os.cpu_count()} CPUs\n")
+    print(f"{'workers':>7} {'ok':>6} {'failed':>6} {'rps':>8} {'speedup':>8} {'p50':>7} {'p99':>7} {'rss MB':>7}")
+    baseline = None
+    worker_counts = sorted({1, *[n for n in (2, 4, 8, 16) if n <= max_workers], max_workers})
+    for workers in worker_counts:
+        ok, failed, rps, p50, p99, rss = run(workers, connections)
+        baseline = baseline or rps
+        print(f"{workers:>7} {ok:>6} {failed:>6} {rps:>8.1f} {rps / baseline:>7.2f}x {p50:>7.3f} {p99:>7.3f} {rss or 0:>7.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# bench_speech_stream.py
+"""
+Time from an LLM's first token to the first audio, for a simulated voice agent.
+
+A fake LLM emits a reply word by word at a fixed token rate. In "full" mode the
+agent waits for the whole reply and then posts it to /v1/audio/speech; in "stream"
+mode it forwards every token to the /v1/audio/speech/stream WebSocket as it is
+generated. Both drive the ASGI app in-process against the fake edge-tts backend,
+and report the delay between the first token and the first audio byte, and
+until the last audio byte.
+
+Usage: python benchmarks/bench_speech_stream.py [runs] [tokens_per_second]
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+import harness  # Installs the fake backend and benchmark settings
+import asgi
+
+REPLY = (
+    "Sure, I can help with that. Your order left our warehouse this morning and is on its way. "
+    "It should arrive on Thursday between nine and noon. Would you like me to send you a text "
+    "message when the driver is close? You can also change the delivery address until tomorrow evening."
+)
+
+async def tokens(rate):
+    for index, word in enumerate(REPLY.split(" ")):
+        await asyncio.sleep(1 / rate)
+        yield word if index == 0 else " " + word
+
+async def run_full(rate):
+    started = time.perf_counter()
+    text = "".join([token async for token in tokens(rate)])
+    first_token = started + 1 / rate
+    first_audio = None
+    body = json.dumps({"input": text}).encode()
+    messages = [{"type": "http.request", "body": body}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal first_audio
+        if message["type"] == "http.response.body" and message.get("body") and first_audio is None:
+            first_audio = time.perf_counter()
+
+    scope = {"type": "http", "method": "POST", "path": "/v1/audio/speech", "query_string": b"",
+             "headers": [(b"content-type", b"application/json")]}
+    await asgi.app(scope, receive, send)
+    return first_audio - first_token, time.perf_counter() - first_token
+
+async def run_stream(rate):
+    inbox = asyncio.Queue()
+    first_token = None
+    first_audio = None
+    closed = asyncio.Event()
+
+    async def receive():
+        return await inbox.get()
+
+    async def send(message):
+        nonlocal first_audio
+        if message["type"] == "websocket.send" and message.get("bytes") and first_audio is None:
+            first_audio = time.perf_counter()
+        elif message["type"] == "websocket.close":
+            closed.set()
+
+    async def client():
+        nonlocal first_token
+        inbox.put_nowait({"type": "websocket.connect"})
+        async for token in tokens(rate):
+            first_token = first_token or time.perf_counter()
+            inbox.put_nowait({"type": "websocket.receive", "text": json.dumps({"type": "text", "text": token})})
+        inbox.put_nowait({"type": "websocket.receive", "text": json.dumps({"type": "close"})})
+        await closed.wait()
+
+    scope = {"type": "websocket", "path": "/v1/audio/speech/stream", "query_string": b"", "headers": []}
+    await asyncio.gather(asgi.app(scope, receive, send), client())
+    return first_audio - first_token, time.perf_counter() - first_token
+
+async def main(runs, rate):
+    print(f"{len(REPLY.split(' '))} tokens at {rate:g} tokens/s, {runs} runs per mode")
+    print(f"{'mode':<8} {'first audio p50':>16} {'last audio p50':>15}")
+    for name, run in (("full", run_full), ("stream", run_stream)):
+        results = [await run(rate) for _ in range(runs)]
+        first = sorted(r[0] for r in results)[len(results) // 2]
+        last = sorted(r[1] for r in results)[len(results) // 2]
+        print(f"{name:<8} {first * 1000:>14.0f}ms {last * 1000:>13.0f}ms")
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+    asyncio.run(main(runs, rate))
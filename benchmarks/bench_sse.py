@@ -0,0 +1,139 @@
+# bench_sse.py
+"""
+Bytes on the wire and server CPU per second of audio for the streaming formats.
+
+Each mode sends the same speech requests, against the fake edge-tts backend, to
+either the ASGI app in-process or the gevent server over HTTP, and reports per
+second of audio delivered: response bytes, events and CPU time. CPU is process
+time over the run, so it includes the fake backend and (for gevent) the HTTP
+clients, which do the same work in every mode.
+
+- "per-chunk": SSE with coalescing off, one base64 event per edge-tts chunk (the
+  previous format)
+- "sse": SSE with chunks coalesced (SSE_COALESCE_BYTES / SSE_COALESCE_MS)
+- "binary": the binary framed format, coalesced
+- "sse+words" and "binary+words": the same, with word timestamp events
+
+Usage: python benchmarks/bench_sse.py [asgi|gevent] [requests] [concurrency] [chunk_frames]
+"""
+
+import asyncio
+import json
+import struct
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import harness  # Installs the fake backend and benchmark settings
+import fake_edge_tts
+import asgi
+import sse
+
+TEXT = (
+    "The quarterly report shows steady growth across every region. Revenue rose by eight percent, "
+    "driven mostly by the new subscription plans, while costs stayed flat. The board expects the "
+    "trend to continue next year, and has approved a larger budget for research and support. "
+) * 3
+
+# edge-tts mp3 is 48 kbps
+MP3_BYTES_PER_SECOND = 6000
+
+MODES = [
+    ("per-chunk", "sse", False, 0),
+    ("sse", "sse", False, None),
+    ("binary", "binary", False, None),
+    ("sse+words", "sse", True, None),
+    ("binary+words", "binary", True, None),
+]
+
+async def request(body):
+    """POST /v1/audio/speech and return (response bytes, body messages)."""
+    messages = [{"type": "http.request", "body": json.dumps(body).encode()}]
+    received = [0, 0]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            received[0] += len(message["body"])
+            received[1] += 1
+
+    scope = {"type": "http", "method": "POST", "path": "/v1/audio/speech", "query_string": b"",
+             "headers": [(b"content-type", b"application/json")]}
+    await asgi.app(scope, receive, send)
+    return received
+
+async def run_asgi(body, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await request(body)
+
+    cpu_started = time.process_time()
+    results = await asyncio.gather(*(one() for _ in range(requests)))
+    cpu = time.process_time() - cpu_started
+    return sum(r[0] for r in results), sum(r[1] for r in results), cpu
+
+def count_events(body, stream_format):
+    if stream_format == "sse":
+        return body.count(b"data: ")
+    events = position = 0
+    while position < len(body):
+        position += 5 + struct.unpack_from('>I', body, position + 1)[0]
+        events += 1
+    return events
+
+def post(base_url, body):
+    req = urllib.request.Request(f"{base_url}/v1/audio/speech", data=json.dumps(body).encode(),
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req) as resp:
+        return resp.read()
+
+def run_gevent(body, requests, concurrency):
+    def drive(base_url):
+        def one(_):
+            response = post(base_url, body)
+            return len(response), count_events(response, body.get("stream_format"))
+
+        cpu_started = time.process_time()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(one, range(requests)))
+        cpu = time.process_time() - cpu_started
+        return sum(r[0] for r in results), sum(r[1] for r in results), cpu
+
+    return harness.serve_while(drive)
+
+async def main(server, requests, concurrency):
+    # The gevent server needs the bridge's own loop, so it is never driven from this one
+    if server == "gevent":
+        audio_bytes = await asyncio.to_thread(harness.serve_while, lambda base_url: len(post(base_url, {"input": TEXT})))
+    else:
+        audio_bytes, _ = await request({"input": TEXT})
+    audio_seconds = audio_bytes / MP3_BYTES_PER_SECOND * requests
+    print(f"{server}: {requests} requests of {audio_bytes / MP3_BYTES_PER_SECOND:.1f}s of audio, concurrency {concurrency}, "
+          f"{fake_edge_tts.CHUNK_FRAMES * len(fake_edge_tts.SILENT_FRAME)}-byte upstream chunks")
+    print(f"{'mode':<14} {'bytes/s audio':>14} {'overhead':>9} {'events/s audio':>15} {'cpu ms/s audio':>15}")
+    default_coalesce = sse.SSE_COALESCE_BYTES
+    for name, stream_format, timestamps, coalesce_bytes in MODES:
+        sse.SSE_COALESCE_BYTES = default_coalesce if coalesce_bytes is None else coalesce_bytes
+        body = {"input": TEXT, "stream_format": stream_format, "timestamps": timestamps}
+        if server == "gevent":
+            wire, events, cpu = await asyncio.to_thread(run_gevent, body, requests, concurrency)
+        else:
+            wire, events, cpu = await run_asgi(body, requests, concurrency)
+        print(f"{name:<14} {wire / audio_seconds:>14.0f} {wire / (audio_bytes * requests) - 1:>8.1%} "
+              f"{events / audio_seconds:>15.2f} {cpu * 1000 / audio_seconds:>15.2f}")
+    sse.SSE_COALESCE_BYTES = default_coalesce
+
+if __name__ == '__main__':
+    server = sys.argv[1] if len(sys.argv) > 1 else "asgi"
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    chunk_frames = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+    fake_edge_tts.configure(latency=0.02, chunk_frames=chunk_frames, chunk_delay=0.002)
+    asyncio.run(main(server, requests, concurrency))
@@ -0,0 +1,77 @@
+# bench_tracing.py
+"""
+Cost of per-request tracing on the ASGI app.
+
+Sends the same speech requests, against the fake edge-tts backend with no upstream
+latency, with tracing off, on (every request traced and written to a temporary
+trace file) and on with profiling, and reports the server time per request. The
+hooks left in the hot path when tracing is off (stage spans in the text filter,
+cache lookups, scheduler and upstream pool) are also timed on their own.
+
+Usage: python benchmarks/bench_tracing.py [requests] [concurrency]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+import harness  # Installs the fake backend and benchmark settings
+import fake_edge_tts
+import asgi
+import tracing
+
+TEXT = "The quarterly report shows **steady growth** across every region. Revenue rose by eight percent."
+
+async def request(body):
+    messages = [{"type": "http.request", "body": json.dumps(body).encode()}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "POST", "path": "/v1/audio/speech", "query_string": b"",
+             "headers": [(b"content-type", b"application/json")]}
+    await asgi.app(scope, receive, send)
+
+async def run(requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await request({"input": f"{TEXT} {i}"})
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return time.perf_counter() - started
+
+async def main(requests, concurrency):
+    await run(concurrency, concurrency)  # Warm up imports, caches and the loop
+    print(f"{requests} requests, concurrency {concurrency}")
+    print(f"{'mode':<12} {'us/request':>11}")
+    for name, enabled, profile_ms in (("off", False, 0), ("on", True, 0), ("on+profile", True, 1e9)):
+        tracing.TRACING_ENABLED = enabled
+        tracing.TRACE_PROFILE_MS = profile_ms
+        seconds = await run(requests, concurrency)
+        tracing.trace_writer.flush()
+        print(f"{name:<12} {seconds / requests * 1e6:>11.1f}")
+    tracing.TRACING_ENABLED = False
+
+    number = 1000000
+    print(f"\nhooks with tracing off (ns/call)")
+    print(f"{'record_span':<12} {timeit.timeit(lambda: tracing.record_span('stage', 0.001), number=number) / number * 1e9:>11.1f}")
+    print(f"{'span':<12} {timeit.timeit(lambda: tracing.span('stage').__enter__(), number=number) / number * 1e9:>11.1f}")
+
+if __name__ == '__main__':
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    fake_edge_tts.configure(latency=0, chunk_delay=0)
+    tracing.trace_writer.path = os.path.join(tempfile.mkdtemp(prefix='edge-tts-bench-'), 'traces.jsonl')
+    asyncio.run(main(requests, concurrency))
@@ -0,0 +1,43 @@
+# bench_ttfb.py
+"""
+Measures time-to-first-byte and total time of /v1/audio/speech (stream_format=audio)
+for 100, 1k and 10k character inputs against the fake edge-tts backend.
+
+Usage: python benchmarks/bench_ttfb.py [response_format]
+"""
+
+import json
+import sys
+import time
+import urllib.request
+
+from harness import serve_while
+
+SIZES = (100, 1_000, 10_000)
+
+def measure(url, text, response_format):
+    body = json.dumps({"input": text, "voice": "alloy", "response_format": response_format}).encode('utf-8')
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    with urllib.request.urlopen(req) as resp:
+        resp.read(1)
+        ttfb = time.perf_counter() - started
+        size = 1 + len(resp.read())
+    return ttfb, time.perf_counter() - started, size
+
+def run_benchmark(base_url, response_format):
+    sentence = "The quick brown fox jumps over the lazy dog. "
+    rows = []
+    for n in SIZES:
+        text = (sentence * (n // len(sentence) + 1))[:n]
+        rows.append((n, *measure(f"{base_url}/v1/audio/speech", text, response_format)))
+    return rows
+
+def main():
+    response_format = sys.argv[1] if len(sys.argv) > 1 else 'mp3'
+    print(f"{'chars':>8} {'ttfb (s)':>10} {'total (s)':>10} {'bytes':>10}")
+    for n, ttfb, total, size in serve_while(run_benchmark, response_format):
+        print(f"{n:>8} {ttfb:>10.3f} {total:>10.3f} {size:>10}")
+
+if __name__ == '__main__':
+    main()
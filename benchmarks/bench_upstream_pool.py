@@ -0,0 +1,79 @@
+# bench_upstream_pool.py
+"""
+Time to first audio with and without the upstream connection pool.
+
+Both edge_tts.Communicate (a new WebSocket per request) and PooledCommunicate are
+pointed at the local WebSocket stand-in (fake_edge_ws.py), which delays every
+connection by a simulated handshake. Requests are short utterances sent in waves
+of concurrent clients, the shape of a voice assistant's traffic, so the handshake
+is a large share of each request's latency.
+
+Usage: python benchmarks/bench_upstream_pool.py [waves] [concurrency] [handshake_seconds]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+import edge_tts
+import edge_tts.communicate
+import fake_edge_ws
+from upstream_pool import PooledCommunicate, UpstreamPool
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] if ordered else float('nan')
+
+async def synthesize(make_communicate, text, results):
+    started = time.perf_counter()
+    first_audio = None
+    size = 0
+    async for chunk in make_communicate(text).stream():
+        if chunk["type"] == "audio":
+            first_audio = first_audio or time.perf_counter() - started
+            size += len(chunk["data"])
+    results.append((first_audio, time.perf_counter() - started, size))
+
+async def run(name, make_communicate, waves, concurrency):
+    results = []
+    started = time.perf_counter()
+    for wave in range(waves):
+        await asyncio.gather(*(
+            synthesize(make_communicate, f"Short reply number {wave}-{i}, read aloud.", results)
+            for i in range(concurrency)
+        ))
+    elapsed = time.perf_counter() - started
+    first = [r[0] for r in results]
+    total = [r[1] for r in results]
+    print(f"{name:<9} {len(results):>6} {elapsed:>8.2f} {percentile(first, 50) * 1000:>9.1f} "
+          f"{percentile(first, 99) * 1000:>9.1f} {percentile(total, 50) * 1000:>9.1f}")
+
+async def main():
+    waves = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    handshake = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+
+    runner, url = await fake_edge_ws.start(handshake_delay=handshake, latency=0.05, idle_close=30)
+    service = runner.app["service"]
+    try:
+        print(f"{waves} waves of {concurrency} concurrent requests, {handshake * 1000:.0f} ms simulated handshake\n")
+        print(f"{'mode':<9} {'reqs':>6} {'wall s':>8} {'ttfa p50':>9} {'ttfa p99':>9} {'total p50':>9}")
+
+        edge_tts.communicate.WSS_URL = url  # Communicate builds its URL from this global
+        await run("unpooled", lambda text: edge_tts.Communicate(text, "en-US-AvaNeural"), waves, concurrency)
+        unpooled_connections = service.connections
+
+        pool = UpstreamPool(max_idle=concurrency, idle_timeout=30, max_age=300, url=url)
+        await run("pooled", lambda text: PooledCommunicate(text, "en-US-AvaNeural", pool=pool), waves, concurrency)
+
+        print(f"\nconnections opened: unpooled {unpooled_connections}, pooled {service.connections - unpooled_connections}")
+        print(f"pool stats: {pool.stats()}")
+        await pool.close()
+    finally:
+        await runner.cleanup()
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+# bench_upstream_retry.py
+"""
+How resilient_stream handles sessions that the service drops part-way through.
+
+The server's retry logic is run against the local WebSocket stand-in
+(fake_edge_ws.py), which here drops every turn after a fixed number of frames:
+
+  silence   every session breaks during the leading silence, before any sentence
+            has been delivered. The stream must fail after UPSTREAM_RETRIES
+            retries, having sent the client no more than that much silence.
+  sentence  every session breaks right after its first sentence. Each retry
+            makes progress, so the stream must complete with one session per
+            sentence and no audio repeated.
+
+Usage: python benchmarks/bench_upstream_retry.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+os.environ.setdefault('UPSTREAM_POOL_SIZE', '0')
+os.environ.setdefault('UPSTREAM_RETRIES', '2')
+os.environ.setdefault('UPSTREAM_RETRY_BACKOFF', '0.01')
+
+import edge_tts.communicate
+import fake_edge_ws
+from fake_edge_ws import SILENT_FRAME
+from upstream_retry import UPSTREAM_RETRIES, resilient_stream
+
+TEXT = "One two three. Four five six. Seven and six."  # Sentences of 7 frames each
+SENTENCES = 3
+SENTENCE_FRAMES = len("One two three.") // 2
+LEAD_FRAMES = 4
+
+async def scenario(name, drop_after_frames):
+    runner, url = await fake_edge_ws.start(handshake_delay=0, latency=0.01, lead_frames=LEAD_FRAMES,
+                                           drop_after_frames=drop_after_frames, tag_frames=True)
+    service = runner.app["service"]
+    edge_tts.communicate.WSS_URL = url  # Communicate builds its URL from this global
+    audio = b""
+    error = None
+    started = time.perf_counter()
+    try:
+        async for frames in resilient_stream(TEXT, "en-US-AvaNeural", "+0%"):
+            audio += frames
+            if service.turns > 10 * (UPSTREAM_RETRIES + 1):
+                break  # Retrying without end, which the checks below report
+    except Exception as e:
+        error = e
+    finally:
+        await runner.cleanup()
+    frames = [audio[i:i + len(SILENT_FRAME)] for i in range(0, len(audio), len(SILENT_FRAME))]
+    spoken = [frame for frame in frames if frame[4:12] != b"00000000"]  # Tagged with crc32("") for silence
+    print(f"{name:<9} {service.turns:>6} {len(frames):>7} {len(spoken):>7} {len(set(spoken)):>7} "
+          f"{time.perf_counter() - started:>7.2f}  {type(error).__name__ if error else 'completed'}")
+    return service.turns, frames, spoken, error
+
+async def main():
+    print(f"UPSTREAM_RETRIES={UPSTREAM_RETRIES}\n")
+    print(f"{'scenario':<9} {'turns':>6} {'frames':>7} {'speech':>7} {'unique':>7} {'secs':>7}  result")
+
+    turns, frames, spoken, error = await scenario("silence", LEAD_FRAMES)
+    assert error is not None, "a session that never gets past the silence must fail the stream"
+    assert turns == UPSTREAM_RETRIES + 1, f"expected {UPSTREAM_RETRIES + 1} sessions, got {turns}"
+    assert len(frames) <= turns * LEAD_FRAMES and not spoken
+
+    turns, frames, spoken, error = await scenario("sentence", LEAD_FRAMES + SENTENCE_FRAMES)
+    assert error is None, f"a stream that makes progress on every session must complete: {error!r}"
+    assert turns == SENTENCES, f"expected one session per sentence, got {turns}"
+    assert len(spoken) == SENTENCES * SENTENCE_FRAMES and len(set(spoken)) == len(spoken), "speech was cut or repeated"
+    print("\nok")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+# fake_edge_tts.py
+"""
+Local stand-in for edge-tts used by the benchmarks.
+
+Importing this module and calling install() replaces edge_tts.Communicate and
+edge_tts.list_voices with fakes that sleep instead of talking to Microsoft, so the
+server can be measured without network access.
+"""
+
+import asyncio
+import os
+import random
+import re
+
+import edge_tts
+from edge_tts.exceptions import WebSocketError
+
+# A silent MPEG-2 Layer III frame matching edge-tts output (24 kHz, 48 kbps, mono).
+SILENT_FRAME = bytes([0xFF, 0xF3, 0x64, 0xC0]) + bytes(140)
+FRAME_TICKS = 240000  # 24 ms in edge-tts offset ticks (100 ns)
+
+LATENCY = float(os.getenv('FAKE_TTS_LATENCY', '0.5'))  # Seconds before the first chunk
+CHUNK_FRAMES = int(os.getenv('FAKE_TTS_CHUNK_FRAMES', '8'))  # Frames per audio chunk
+CHUNK_DELAY = float(os.getenv('FAKE_TTS_CHUNK_DELAY', '0.005'))  # Seconds between chunks
+JITTER = float(os.getenv('FAKE_TTS_JITTER', '0'))  # Up to this many extra seconds of first-chunk latency
+FAILURE_RATE = float(os.getenv('FAKE_TTS_FAILURE_RATE', '0'))  # Fraction of sessions that fail
+
+def configure(latency=None, chunk_frames=None, chunk_delay=None, jitter=None, failure_rate=None):
+    """Override the fake's settings; they are read at the start of every session."""
+    global LATENCY, CHUNK_FRAMES, CHUNK_DELAY, JITTER, FAILURE_RATE
+    if latency is not None:
+        LATENCY = latency
+    if chunk_frames is not None:
+        CHUNK_FRAMES = chunk_frames
+    if chunk_delay is not None:
+        CHUNK_DELAY = chunk_delay
+    if jitter is not None:
+        JITTER = jitter
+    if failure_rate is not None:
+        FAILURE_RATE = failure_rate
+
+class FakeCommunicate:
+    def __init__(self, text, voice="en-US-AvaNeural", *, rate="+0%", volume="+0%", pitch="+0Hz",
+                 boundary="SentenceBoundary", **kwargs):
+        self.text = text
+        self.voice = voice
+        self.rate = rate
+        self.boundary = boundary
+
+    def _words(self):
+        """(first frame, WordBoundary message) for every word, each spoken over its share of the frames."""
+        return [
+            (match.start() // 2, {
+                "type": "WordBoundary",
+                "offset": match.start() // 2 * FRAME_TICKS,
+                "duration": max(1, len(match.group()) // 2) * FRAME_TICKS,
+                "text": match.group(),
+            })
+            for match in re.finditer(r"\S+", self.text)
+        ]
+
+    async def stream(self):
+        await asyncio.sleep(LATENCY + random.uniform(0, JITTER))
+        if FAILURE_RATE and random.random() < FAILURE_RATE:
+            raise WebSocketError("Connection dropped (simulated failure)")
+        # Roughly one frame (24 ms of audio) per two characters of input
+        frames = max(1, len(self.text) // 2)
+        words = self._words() if self.boundary == "WordBoundary" else []
+        for start in range(0, frames, CHUNK_FRAMES):
+            if start:
+                await asyncio.sleep(CHUNK_DELAY)
+            while words and words[0][0] < start + CHUNK_FRAMES:
+                yield words.pop(0)[1]
+            yield {"type": "audio", "data": SILENT_FRAME * min(CHUNK_FRAMES, frames - start)}
+
+    async def save(self, audio_fname, metadata_fname=None):
+        with open(audio_fname, 'wb') as audio:
+            async for chunk in self.stream():
+                if chunk["type"] == "audio":
+                    audio.write(chunk["data"])
+
+FAKE_VOICES = [
+    ("en-US", "AvaNeural", "Female"), ("en-US", "AndrewNeural", "Male"), ("en-US", "JennyNeural", "Female"),
+    ("en-US", "GuyNeural", "Male"), ("en-US", "AriaNeural", "Female"), ("en-US", "EricNeural", "Male"),
+    ("en-US", "EmmaNeural", "Female"), ("en-US", "BrianNeural", "Male"), ("en-GB", "ThomasNeural", "Male"),
+    ("en-GB", "SoniaNeural", "Female"), ("en-AU", "NatashaNeural", "Female"), ("ja-JP", "KeitaNeural", "Male"),
+]
+
+async def fake_list_voices(**kwargs):
+    await asyncio.sleep(LATENCY / 5)
+    return [
+        {
+            "Name": f"Microsoft Server Speech Text to Speech Voice ({locale}, {name})",
+            "ShortName": f"{locale}-{name}",
+            "Gender": gender,
+            "Locale": locale,
+        }
+        for locale, name, gender in FAKE_VOICES
+    ]
+
+def install():
+    edge_tts.Communicate = FakeCommunicate
+    edge_tts.list_voices = fake_list_voices
@@ -0,0 +1,150 @@
+# fake_edge_ws.py
+"""
+Local WebSocket stand-in for the edge-tts service, for testing the upstream pool.
+
+Unlike fake_edge_tts.py, which replaces edge_tts.Communicate, this speaks the
+service's wire protocol (speech.config and SSML text frames in; turn.start,
+metadata, binary audio frames and turn.end out), so both edge_tts.Communicate and
+upstream_pool.PooledCommunicate can be pointed at it. Like the real service it
+accepts any number of turns per connection and drops connections left idle.
+Stalls and dropped connections can be injected to exercise retries.
+
+    runner, url = await start(handshake_delay=0.1)
+    ...
+    await runner.cleanup()
+"""
+
+import asyncio
+import json
+import random
+import re
+import uuid
+import zlib
+from xml.sax.saxutils import unescape
+
+from aiohttp import web
+from edge_tts.constants import TICKS_PER_SECOND
+
+# A silent MPEG-2 Layer III frame matching edge-tts output (24 kHz, 48 kbps, mono).
+SILENT_FRAME = bytes([0xFF, 0xF3, 0x64, 0xC0]) + bytes(140)
+
+class FakeEdgeService:
+    def __init__(self, handshake_delay=0.1, latency=0.05, chunk_frames=8, chunk_delay=0.0, idle_close=None,
+                 lead_frames=4, drop_rate=0.0, drop_after_frames=None, stall_rate=0.0, stall_seconds=30.0, tag_frames=False):
+        self.handshake_delay = handshake_delay  # Stands in for TCP, TLS and the WebSocket upgrade
+        self.latency = latency  # Seconds from SSML to the first audio frame
+        self.chunk_frames = chunk_frames
+        self.chunk_delay = chunk_delay
+        self.idle_close = idle_close  # Close connections idle for this long, None keeps them
+        self.lead_frames = lead_frames  # Silence before the first sentence, like the real service
+        self.drop_rate = drop_rate  # Fraction of turns whose connection is dropped halfway through
+        self.drop_after_frames = drop_after_frames  # Drop every turn after this many frames, None never does
+        self.stall_rate = stall_rate  # Fraction of turns that wait stall_seconds before any audio
+        self.stall_seconds = stall_seconds
+        self.tag_frames = tag_frames  # Mark each frame with its sentence and position, to check resumed audio
+        self.connections = 0
+        self.turns = 0
+        self.dropped = 0
+        self.stalled = 0
+
+    @staticmethod
+    def _text_message(request_id, path, body=""):
+        return (f"X-RequestId:{request_id}\r\nContent-Type:application/json; charset=utf-8\r\n"
+                f"Path:{path}\r\n\r\n{body}")
+
+    @staticmethod
+    def _audio_message(request_id, data):
+        header = f"X-RequestId:{request_id}\r\nContent-Type:audio/mpeg\r\nPath:audio\r\n".encode()
+        return len(header).to_bytes(2, "big") + header + data
+
+    def _frame(self, sentence, index):
+        if not self.tag_frames:
+            return SILENT_FRAME
+        tag = f"{zlib.crc32(sentence.encode()):08x}:{index}".encode()
+        return SILENT_FRAME[:4] + tag + bytes(len(SILENT_FRAME) - 4 - len(tag))
+
+    def _render(self, text):
+        """Audio frames for the text, and a SentenceBoundary-style entry per sentence."""
+        frames = [self._frame("", i) for i in range(self.lead_frames)]
+        boundaries = []
+        for sentence in re.findall(r"[^.!?]+[.!?]*\s*", text):
+            spoken = sentence.strip()
+            if not spoken:
+                continue
+            count = max(1, len(spoken) // 2)  # Roughly one frame (24 ms of audio) per two characters
+            offset = len(frames) * len(SILENT_FRAME) * 8 * TICKS_PER_SECOND // 48000
+            duration = count * len(SILENT_FRAME) * 8 * TICKS_PER_SECOND // 48000
+            boundaries.append((len(frames), {"Offset": offset, "Duration": duration, "text": {"Text": spoken}}))
+            frames += [self._frame(spoken, i) for i in range(count)]
+        return frames, boundaries
+
+    async def _turn(self, ws, request_id, ssml, boundary):
+        self.turns += 1
+        frames, boundaries = self._render(unescape(re.sub(r"<[^>]+>", "", ssml)))
+        if random.random() < self.stall_rate:
+            self.stalled += 1
+            await asyncio.sleep(self.stall_seconds)
+        await asyncio.sleep(self.latency)
+        await ws.send_str(self._text_message(request_id, "turn.start", "{}"))
+        drop_at = len(frames) // 2 if random.random() < self.drop_rate else None
+        if self.drop_after_frames is not None and self.drop_after_frames < len(frames):
+            drop_at = min(drop_at if drop_at is not None else len(frames), self.drop_after_frames)
+
+        position = 0
+        while position < len(frames):
+            while boundaries and boundaries[0][0] <= position:
+                _, data = boundaries.pop(0)
+                await ws.send_str(self._text_message(request_id, "audio.metadata", json.dumps(
+                    {"Metadata": [{"Type": boundary, "Data": data}]})))
+            end = min(position + self.chunk_frames, len(frames))
+            if boundaries:
+                end = min(end, boundaries[0][0])  # Metadata goes out before its sentence's audio
+            if drop_at is not None and end > drop_at:
+                await ws.send_bytes(self._audio_message(request_id, b"".join(frames[position:drop_at])))
+                self.dropped += 1
+                await ws.close()
+                return False
+            if position and self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            await ws.send_bytes(self._audio_message(request_id, b"".join(frames[position:end])))
+            position = end
+        await ws.send_str(self._text_message(request_id, "turn.end", "{}"))
+        return True
+
+    async def handle(self, request):
+        await asyncio.sleep(self.handshake_delay)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+
+        boundary = "SentenceBoundary"
+        while True:
+            try:
+                message = await ws.receive(timeout=self.idle_close)
+            except asyncio.TimeoutError:
+                break
+            if message.type != web.WSMsgType.TEXT:
+                break
+            head, _, body = message.data.partition("\r\n\r\n")
+            headers = dict(line.split(":", 1) for line in head.split("\r\n") if ":" in line)
+            if headers.get("Path") == "speech.config":
+                options = json.loads(body)["context"]["synthesis"]["audio"]["metadataoptions"]
+                boundary = "WordBoundary" if options["wordBoundaryEnabled"] == "true" else "SentenceBoundary"
+            elif headers.get("Path") == "ssml":
+                if not await self._turn(ws, headers.get("X-RequestId", uuid.uuid4().hex), body, boundary):
+                    break
+        await ws.close()
+        return ws
+
+async def start(port=0, **settings):
+    """Serve a FakeEdgeService on localhost; returns the runner and the URL to connect to."""
+    service = FakeEdgeService(**settings)
+    app = web.Application()
+    app.router.add_get("/edge/v1", service.handle)
+    app["service"] = service
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"ws://127.0.0.1:{port}/edge/v1?TrustedClientToken=fake"
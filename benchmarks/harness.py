@@ -0,0 +1,82 @@
+# harness.py
+"""Shared setup for the benchmarks: fake edge-tts backend and an in-process gevent server."""
+
+import os
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('REQUIRE_API_KEY', 'False')
+os.environ.setdefault('AUDIO_CACHE_ENABLED', 'False')
+# Keep the fake voice list out of the real voice catalogue snapshot
+os.environ.setdefault('VOICE_CATALOG_SNAPSHOT', os.path.join(tempfile.mkdtemp(prefix='edge-tts-bench-'), 'voices.json'))
+
+import asyncio
+import edge_tts
+import edge_tts.communicate
+import fake_edge_tts
+import fake_edge_ws
+
+_real_communicate = edge_tts.Communicate
+fake_edge_tts.install()
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+def use_websocket_backend(pool_size, **settings):
+    """
+    Answer upstream sessions from the WebSocket stand-in (fake_edge_ws.py) instead of
+    the fake edge_tts.Communicate, so that the real upstream code runs: the upstream
+    pool with pool_size idle connections, or edge_tts.Communicate with pool_size 0.
+    settings go to fake_edge_ws.FakeEdgeService. Must be called before the app is
+    imported; returns the service, whose counters can be read afterwards.
+    """
+    started = threading.Event()
+    state = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        state['runner'], state['url'] = loop.run_until_complete(fake_edge_ws.start(**settings))
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="fake-edge-ws", daemon=True).start()
+    started.wait()
+
+    edge_tts.Communicate = _real_communicate
+    edge_tts.communicate.WSS_URL = state['url']  # Where edge_tts.Communicate connects
+    os.environ['UPSTREAM_URL'] = state['url']  # Where the pool connects
+    os.environ['UPSTREAM_POOL_SIZE'] = str(pool_size)
+    return state['runner'].app["service"]
+
+def serve_while(driver, *args):
+    """
+    Serve the app on the main thread's gevent hub while driver(base_url, *args) runs
+    in a client thread, and return whatever the driver returns.
+    """
+    import server
+
+    http_server = WSGIServer(('127.0.0.1', 0), server.app, log=None)
+    http_server.start()
+    base_url = f"http://127.0.0.1:{http_server.server_port}"
+
+    result = {}
+    def run():
+        try:
+            result['value'] = driver(base_url, *args)
+        except BaseException as e:
+            result['error'] = e
+
+    client = threading.Thread(target=run, daemon=True)
+    client.start()
+    while client.is_alive():
+        gevent.sleep(0.01)
+    http_server.stop()
+
+    if 'error' in result:
+        raise result['error']
+    return result['value']
@@ -0,0 +1,316 @@
+# loadtest.py
+"""
+Load test for the speech endpoints against the fake edge-tts backend.
+
+Each scenario (a route and response format) is driven with a fixed number of
+requests at a fixed concurrency. The report covers latency and time-to-first-byte
+percentiles, requests/sec, errors, peak RSS and any temp files or file descriptors
+left behind. It is printed as a table and saved as JSON so that runs can be compared
+with --compare.
+
+By default the fake replaces edge_tts.Communicate. With --backend websocket the
+upstream sessions are answered by a local stand-in speaking the edge-tts wire
+protocol instead, so the real upstream code runs: the connection pool with
+--pool-size N, or edge_tts.Communicate with the default --pool-size 0.
+
+Usage:
+    python benchmarks/loadtest.py [-c 16] [-n 200] [--formats mp3,opus] [--routes speech,sse]
+                                  [--latency 0.5] [--failure-rate 0.01] [-o results.json]
+                                  [--backend websocket [--pool-size 8]] [--compare previous.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ("speech", "sse", "elevenlabs", "azure")
+FORMATS = ("mp3", "opus", "aac", "flac", "wav", "pcm")
+VOICE = "en-US-AvaNeural"
+SENTENCE = "The quick brown fox jumps over the lazy dog. "
+
+def build_request(base_url, route, response_format, text):
+    """Return (url, body, content type) for one request."""
+    if route == "speech":
+        body = {"input": text, "voice": VOICE, "response_format": response_format}
+        return f"{base_url}/v1/audio/speech", json.dumps(body).encode('utf-8'), 'application/json'
+    if route == "sse":
+        body = {"input": text, "voice": VOICE, "response_format": response_format, "stream_format": "sse"}
+        return f"{base_url}/v1/audio/speech", json.dumps(body).encode('utf-8'), 'application/json'
+    if route == "elevenlabs":
+        return f"{base_url}/elevenlabs/v1/text-to-speech/{VOICE}", json.dumps({"text": text}).encode('utf-8'), 'application/json'
+    ssml = (
+        '<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="en-US">'
+        f'<voice name="{VOICE}">{text}</voice></speak>'
+    )
+    return f"{base_url}/azure/cognitiveservices/v1", ssml.encode('utf-8'), 'application/ssml+xml'
+
+def timed_request(url, body, content_type, sse):
+    """Send one request and return (status, ttfb, total, bytes, error)."""
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': content_type})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            first = resp.read(1)
+            ttfb = time.perf_counter() - started
+            rest = resp.read()
+            total = time.perf_counter() - started
+            error = None
+            if sse and b'"type": "error"' in rest:
+                error = "error event in SSE stream"
+            return resp.status, ttfb, total, len(first) + len(rest), error
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code, None, time.perf_counter() - started, 0, f"HTTP {e.code}"
+    except Exception as e:
+        return None, None, time.perf_counter() - started, 0, str(e)
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    def rank(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 4)
+    return {
+        "p50": rank(50), "p95": rank(95), "p99": rank(99),
+        "mean": round(sum(ordered) / len(ordered), 4), "max": round(ordered[-1], 4),
+    }
+
+def current_rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def open_fd_count():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+class RssSampler:
+    """Track the peak RSS of this process (server and clients) while a scenario runs."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+def run_scenario(base_url, route, response_format, args):
+    temp_dir = tempfile.gettempdir()
+    temp_before = set(os.listdir(temp_dir))
+    fds_before = open_fd_count()
+
+    results = []
+    lock = threading.Lock()
+    counter = iter(range(args.requests))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            # Unique text per request, so requests are neither cached nor coalesced
+            text = f"Request {i} for {route} {response_format}. " + SENTENCE * (args.chars // len(SENTENCE) + 1)
+            url, body, content_type = build_request(base_url, route, response_format, text[:max(args.chars, 32)])
+            result = timed_request(url, body, content_type, route == "sse")
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=worker) for _ in range(min(args.concurrency, args.requests))]
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+    time.sleep(0.2)  # Let the server finish closing streams before counting leftovers
+    leaked_temp = sorted(set(os.listdir(temp_dir)) - temp_before)
+    fds_after = open_fd_count()
+
+    ok = [r for r in results if r[0] == 200 and r[4] is None]
+    status_codes = {}
+    for r in results:
+        status_codes[str(r[0])] = status_codes.get(str(r[0]), 0) + 1
+    errors = [r[4] for r in results if r[4] is not None]
+
+    return {
+        "scenario": f"{route}/{response_format}",
+        "route": route,
+        "format": response_format,
+        "requests": len(results),
+        "concurrency": args.concurrency,
+        "ok": len(ok),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "status_codes": status_codes,
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "latency_seconds": percentiles([r[2] for r in ok]),
+        "ttfb_seconds": percentiles([r[1] for r in ok]),
+        "bytes_received": sum(r[3] for r in ok),
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+        "temp_files_leaked": len(leaked_temp),
+        "temp_files_leaked_names": leaked_temp[:10],
+        "fds_leaked": fds_after - fds_before if fds_before is not None and fds_after is not None else None,
+    }
+
+def scenarios(args):
+    for route in args.routes:
+        # The ElevenLabs and Azure routes always return mp3
+        for response_format in (args.formats if route in ("speech", "sse") else ("mp3",)):
+            yield route, response_format
+
+def run_all(base_url, args):
+    # Start the event loop, voice catalogue and connection handling before measuring
+    timed_request(*build_request(base_url, "speech", "mp3", "Warm up."), False)
+    return [run_scenario(base_url, route, response_format, args) for route, response_format in scenarios(args)]
+
+def print_report(report, previous=None):
+    previous_by_name = {s["scenario"]: s for s in previous["scenarios"]} if previous else {}
+    print(f"{'scenario':<16} {'ok':>5} {'err':>4} {'rps':>8} {'p50':>7} {'p95':>7} {'p99':>7} "
+          f"{'ttfb p50':>8} {'ttfb p95':>8} {'rss MB':>7} {'tmp':>4} {'fds':>4}")
+    for s in report["scenarios"]:
+        latency = s["latency_seconds"] or {}
+        ttfb = s["ttfb_seconds"] or {}
+        print(f"{s['scenario']:<16} {s['ok']:>5} {s['errors']:>4} {s['requests_per_second']:>8.2f} "
+              f"{latency.get('p50', 0):>7.3f} {latency.get('p95', 0):>7.3f} {latency.get('p99', 0):>7.3f} "
+              f"{ttfb.get('p50', 0):>8.3f} {ttfb.get('p95', 0):>8.3f} {s['peak_rss_mb']:>7.1f} "
+              f"{s['temp_files_leaked']:>4} {s['fds_leaked'] if s['fds_leaked'] is not None else '-':>4}")
+        old = previous_by_name.get(s["scenario"])
+        if old and old["latency_seconds"] and s["latency_seconds"]:
+            rps_change = s["requests_per_second"] / old["requests_per_second"] - 1 if old["requests_per_second"] else 0.0
+            p95_change = s["latency_seconds"]["p95"] / old["latency_seconds"]["p95"] - 1 if old["latency_seconds"]["p95"] else 0.0
+            print(f"{'  vs previous':<16} rps {rps_change:+.1%}, p95 {p95_change:+.1%}, rss {s['peak_rss_mb'] - old['peak_rss_mb']:+.1f} MB")
+        if s["first_error"]:
+            print(f"{'  first error':<16} {s['first_error']}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    parser.add_argument('-n', '--requests', type=int, default=100, help="requests per scenario")
+    parser.add_argument('--chars', type=int, default=400, help="input length in characters")
+    parser.add_argument('--routes', default=",".join(ROUTES), help=f"comma-separated subset of {','.join(ROUTES)}")
+    parser.add_argument('--formats', default="mp3,opus", help=f"comma-separated subset of {','.join(FORMATS)}")
+    parser.add_argument('--latency', type=float, help="fake upstream first-chunk latency in seconds")
+    parser.add_argument('--jitter', type=float, help="extra random first-chunk latency in seconds")
+    parser.add_argument('--chunk-frames', type=int, help="mp3 frames per fake upstream chunk")
+    parser.add_argument('--chunk-delay', type=float, help="seconds between fake upstream chunks")
+    parser.add_argument('--failure-rate', type=float, help="fraction of fake upstream sessions that fail")
+    parser.add_argument('--cache', action='store_true', help="leave the audio cache enabled")
+    parser.add_argument('--backend', choices=("communicate", "websocket"), default="communicate",
+                        help="fake edge_tts.Communicate, or a local WebSocket stand-in for the service")
+    parser.add_argument('--pool-size', type=int, default=0, help="upstream pool size (websocket backend only)")
+    parser.add_argument('--handshake', type=float, default=0.05, help="simulated connection setup in seconds (websocket backend only)")
+    parser.add_argument('-o', '--output', help="JSON report path (default benchmarks/results/loadtest-<time>.json)")
+    parser.add_argument('--compare', help="previous JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    if args.pool_size and args.backend != "websocket":
+        parser.error("--pool-size needs --backend websocket")
+    args.routes = [r for r in args.routes.split(',') if r]
+    args.formats = [f for f in args.formats.split(',') if f]
+    for route in args.routes:
+        if route not in ROUTES:
+            parser.error(f"unknown route {route!r}")
+    for response_format in args.formats:
+        if response_format not in FORMATS:
+            parser.error(f"unknown format {response_format!r}")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.cache:
+        os.environ.setdefault('AUDIO_CACHE_ENABLED', 'True')
+    # Injected failures would otherwise print a traceback each
+    os.environ.setdefault('DETAILED_ERROR_LOGGING', 'False')
+
+    # Imported here so that the environment above is in place before the app loads
+    from harness import fake_edge_tts, serve_while, use_websocket_backend
+    fake_edge_tts.configure(
+        latency=args.latency, chunk_frames=args.chunk_frames, chunk_delay=args.chunk_delay,
+        jitter=args.jitter, failure_rate=args.failure_rate,
+    )
+    service = None
+    if args.backend == "websocket":
+        service = use_websocket_backend(
+            args.pool_size, handshake_delay=args.handshake, latency=fake_edge_tts.LATENCY,
+            chunk_frames=fake_edge_tts.CHUNK_FRAMES, chunk_delay=fake_edge_tts.CHUNK_DELAY,
+            drop_rate=fake_edge_tts.FAILURE_RATE,
+        )
+
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+
+    started_at = datetime.now(timezone.utc)
+    report = {
+        "started_at": started_at.isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "ffmpeg": shutil.which('ffmpeg') is not None,
+        "config": {
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "chars": args.chars,
+            "audio_cache": os.environ.get('AUDIO_CACHE_ENABLED'),
+            "fake_latency": fake_edge_tts.LATENCY,
+            "fake_jitter": fake_edge_tts.JITTER,
+            "fake_chunk_frames": fake_edge_tts.CHUNK_FRAMES,
+            "fake_chunk_delay": fake_edge_tts.CHUNK_DELAY,
+            "fake_failure_rate": fake_edge_tts.FAILURE_RATE,
+            "backend": args.backend,
+            "pool_size": args.pool_size,
+        },
+        "scenarios": serve_while(run_all, args),
+    }
+    if service is not None:
+        report["upstream_connections"] = service.connections
+        report["upstream_turns"] = service.turns
+    if not report["ffmpeg"]:
+        print("ffmpeg is not installed: every format is served as mp3\n")
+
+    print_report(report, previous)
+    if service is not None:
+        print(f"\nupstream: {report['upstream_turns']} turns on {report['upstream_connections']} connections")
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f"loadtest-{started_at:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nreport written to {output}")
+
+if __name__ == '__main__':
+    main()